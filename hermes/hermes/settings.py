@@ -160,3 +160,46 @@ CORS_ALLOW_CREDENTIALS = True
 # CORS_ALLOWED_ORIGINS = [
 #     "http://localhost:5173",  # React dev server
 # ]
+
+# Score tables
+# Season CSVs live in SCORE_TABLE_DIR as <season>.csv and are compiled into
+# memory-mappable arrays in SCORE_TABLE_CACHE_DIR. Without a season the
+# tables built into tests/score_tables.py are used. Events are pinned to
+# "<season>-<content hash>" and scored from that compiled array, keep the
+# cache directory across deploys so edited CSVs don't lose old versions.
+SCORE_TABLE_DIR = BASE_DIR / "tests" / "score_table_seasons"
+SCORE_TABLE_CACHE_DIR = BASE_DIR / ".score_table_cache"
+SCORE_TABLE_SEASON = os.getenv("SCORE_TABLE_SEASON")
+# Expand the score tables into dense per-value lookup tables, worth it for
+# processes that score in bulk (recalculations, simulations)
+SCORE_LOOKUP_TABLES = os.getenv("SCORE_LOOKUP_TABLES") == "1"
+
+# Worker processes of a parallel score recalculation
+RECALCULATION_WORKERS = int(os.getenv("RECALCULATION_WORKERS", os.cpu_count() or 1))
+
+# API token cache, see tests/auth_cache.py
+# Seconds a token's user is trusted without checking the database again
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+# Tokens kept per process
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 1024))
+# Alias of a CACHES entry shared by all processes, instead of a cache per process
+AUTH_CACHE_BACKEND = os.getenv("AUTH_CACHE_BACKEND")
+
+# Default cache, which the dashboard statistics are cached in. The local
+# memory cache is per process: an invalidation only reaches the process that
+# saved the change and the others serve their statistics for up to
+# STATISTICS_CACHE_TTL. Deployments running several processes point it at a
+# shared backend, e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# and CACHE_LOCATION=redis://127.0.0.1:6379 (the database cache costs more
+# queries than the statistics it would save).
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Seconds dashboard statistics are cached for at most, see tests/statistics.py
+STATISTICS_CACHE_TTL = int(os.getenv("STATISTICS_CACHE_TTL", 300))
@@ -5,6 +5,7 @@ from .models import Person
 from .models import Event
 from .models import Team
 from .models import PersonMeasurement
+from .models import Job
 
 
 @admin.register(TestResult)
@@ -12,5 +13,6 @@ from .models import PersonMeasurement
 @admin.register(Event)
 @admin.register(Team)
 @admin.register(PersonMeasurement)
+@admin.register(Job)
 class CustomAdminClass(ModelAdmin):
     pass
@@ -1,37 +1,41 @@
-from ninja import NinjaAPI, Schema, Body  # Add this import
-from typing import List, Optional, Dict
+from ninja import NinjaAPI, Schema, Body, Path, Query  # Add this import
+from typing import Any, List, Optional, Dict
 from datetime import date, datetime, timedelta
-from .models import Person, TestResult, Event, Team, PersonMeasurement
+from .models import Person, TestResult, Event, Team, PersonMeasurement, Job
 from django.shortcuts import get_object_or_404
+from ninja.errors import HttpError
+from ninja.pagination import paginate
 from ninja.security import HttpBearer
 import jwt
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 # Add this import
-from .score_tables import calculate_score, calculate_beep_test_total_laps, calculate_y_test_index
+from .score_tables import calculate_score, calculate_y_test_index
 from django.contrib.auth.models import Group
 from django.contrib.auth.decorators import user_passes_test
+from .pagination import KeysetPagination
+from .renderers import ORJSONRenderer
 
 SECRET_KEY = settings.SECRET_KEY
 
 
 class AuthBearer(HttpBearer):
     def authenticate(self, request, token):
+        from .auth_cache import get_user
+
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
             username = payload.get("username")
             if username:
-                try:
-                    user = User.objects.get(username=username)
-                    return user  # Return the full User object
-                except User.DoesNotExist:
-                    return None
+                # The verified signature identifies the token, its user is
+                # cached with their team ids and group names
+                return get_user(token.rsplit(".", 1)[-1], username)
         except jwt.PyJWTError:
             return None
 
 
-api = NinjaAPI(auth=AuthBearer())
+api = NinjaAPI(auth=AuthBearer(), renderer=ORJSONRenderer())
 
 
 # Auth Schemas
@@ -130,6 +134,48 @@ class TestResultSchema(Schema):
     max_hr: int | None
 
 
+class PagedTestResultSchema(KeysetPagination.Output):
+    items: List[TestResultSchema]
+
+
+# TestResultSchema's fields read straight from the table, see test_result_rows
+TEST_RESULT_COLUMNS = [name for name in TestResultSchema.model_fields if name != "team"]
+
+
+def test_result_rows(test_results):
+    """
+    Results as TestResultSchema dicts from a single ``values()`` query, with
+    the team's name joined in SQL as ``team_name``, no model instances are built.
+    """
+    from django.db.models import F
+
+    return test_results.values(*TEST_RESULT_COLUMNS, team_name=F("team__name"))
+
+
+def test_result_dict(test_result):
+    """A loaded result as a TestResultSchema dict, without querying its team"""
+    row = {name: getattr(test_result, name) for name in TEST_RESULT_COLUMNS}
+    row["team"] = test_result.team.name if test_result.team else None
+    return row
+
+
+def test_results_response(request, test_results, pagination=None):
+    """
+    Respond with results from test_result_rows, paginated with KeysetPagination
+    if ``pagination`` is given. The rows already have the schema's shape, so
+    they skip its validation and go straight to the orjson renderer.
+    """
+    rows = test_result_rows(test_results)
+    if pagination is None:
+        page = rows = list(rows)
+    else:
+        page = KeysetPagination().paginate_queryset(rows, pagination, request)
+        rows = page["items"]
+    for row in rows:
+        row["team"] = row.pop("team_name")
+    return api.create_response(request, page, status=200)
+
+
 class TeamSchema(Schema):
     id: int
     name: str
@@ -155,6 +201,18 @@ class UserSchema(Schema):
     groups: List[str]  # Add group names
 
 
+class UserListSchema(UserSchema):
+    """Listed users (prefetch_related the teams and groups)"""
+
+    @staticmethod
+    def resolve_teams(obj):
+        return [team.id for team in obj.teams.all()]
+
+    @staticmethod
+    def resolve_groups(obj):
+        return [group.name for group in obj.groups.all()]
+
+
 # Schema for creating a new adjudicator
 class AdjudicatorSchema(Schema):
     username: str
@@ -181,6 +239,23 @@ class PersonMeasurementCreateSchema(Schema):
     notes: str | None = None
 
 
+class JobSchema(Schema):
+    id: int
+    kind: str
+    status: str
+    progress: float
+    result: dict | None = None
+    error: str
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+
+class JobCreateSchema(Schema):
+    kind: str
+    params: dict = {}
+
+
 class PersonDataCollectionSchema(Schema):
     date_of_birth: date | None = None
     gender: str | None = None
@@ -190,6 +265,14 @@ def is_superadmin(user):
     return user.is_superuser
 
 
+def is_adjudicator(user):
+    """Adjudicators and admins, who may generate the PDF reports of everyone"""
+    return (
+        user.is_superuser
+        or user.groups.filter(name__in=["Adjudicators", "Foreign Admin"]).exists()
+    )
+
+
 # Auth endpoints
 @api.post("/token", auth=None, response=TokenSchema)
 def get_token(request, auth_data: AuthSchema):
@@ -212,25 +295,39 @@ def get_token(request, auth_data: AuthSchema):
 
 
 # Existing endpoints
-@api.get("/people", response=List[PersonSchema])
-def get_people(request):
-    # Return each person as a dict with age
-    return [
-        {
-            "id": p.id,
-            "name": p.name,
-            "surname": p.surname,
-            "date_of_birth": p.date_of_birth,
-            "gender": p.gender,
-            "height": p.latest_height,
-            "weight": p.latest_weight,
-            "team_id": p.team.id if p.team else None,
-            "age": p.age,
-            "gender_required": p.gender_required,
-            "date_of_birth_required": p.date_of_birth_required,
-        }
-        for p in Person.objects.all()
-    ]
+class PersonListSchema(PersonSchema):
+    """Listed people, with the latest measurements annotated by get_people"""
+
+    @staticmethod
+    def resolve_height(obj):
+        return obj.measured_height
+
+    @staticmethod
+    def resolve_weight(obj):
+        return obj.measured_weight
+
+
+@api.get("/people", response=List[PersonListSchema])
+@paginate(KeysetPagination)
+def get_people(request, team_id: int | None = None, search: str | None = None):
+    """List people, optionally of one team or matching a name"""
+    from django.db.models import F, OuterRef, Q, Subquery
+    from django.db.models.functions import Coalesce
+
+    # The latest measurement is joined in the same query, falling back to the
+    # base height and weight like Person.latest_height and latest_weight
+    latest = PersonMeasurement.objects.filter(person=OuterRef("pk")).order_by(
+        "-measurement_date"
+    )
+    people = Person.objects.annotate(
+        measured_height=Coalesce(Subquery(latest.values("height")[:1]), F("height")),
+        measured_weight=Coalesce(Subquery(latest.values("weight")[:1]), F("weight")),
+    )
+    if team_id is not None:
+        people = people.filter(team_id=team_id)
+    if search:
+        people = people.filter(Q(name__icontains=search) | Q(surname__icontains=search))
+    return people
 
 
 @api.get("/person/{person_id}", response=PersonSchema)
@@ -238,23 +335,49 @@ def get_person(request, person_id: int):
     return get_object_or_404(Person, id=person_id)
 
 
-@api.get("/results", response=List[TestResultSchema])
-def get_test_results(request):
-    results = TestResult.objects.all()
-    # Serialize team as string (team name) for each result
-    serialized = []
-    for r in results:
-        d = r.__dict__.copy()
-        d["team"] = r.team.name if hasattr(r, "team") and r.team else None
-        d["person_id"] = r.person.id if hasattr(r, "person") and r.person else None
-        d["test_date"] = r.test_date
-        serialized.append(d)
-    return serialized
+@api.get("/results", response=PagedTestResultSchema)
+def get_test_results(request, pagination: KeysetPagination.Input = Query(...)):
+    return test_results_response(request, TestResult.objects.all(), pagination)
+
+
+class ResultBatchItem(Schema):
+    person_id: int
+    test_type: str
+    values: Dict[str, Any]
+
+
+class ResultBatchResponse(Schema):
+    person_id: int
+    test_type: str
+    success: bool
+    result: Optional[TestResultSchema] = None
+    error: Optional[str] = None
+
+
+# Registered before /results/{person_id}, which would match it too
+@api.post("/results/batch", response=List[ResultBatchResponse])
+def save_results_batch(request, items: List[ResultBatchItem]):
+    """
+    Save the raw values of any tests of many profiles at once, like the
+    single test endpoints do for one, reporting each item's outcome
+    """
+    from .result_batches import save_results
+
+    outcomes = save_results(
+        [(item.person_id, item.test_type, item.values) for item in items]
+    )
+    for outcome in outcomes:
+        test_result = outcome["result"]
+        if test_result is not None:
+            outcome["result"] = test_result_dict(test_result)
+    return outcomes
 
 
 @api.get("/results/{person_id}", response=List[TestResultSchema])
 def get_person_results(request, person_id: int):
-    return TestResult.objects.filter(person_id=person_id)
+    return test_results_response(
+        request, TestResult.objects.filter(person_id=person_id)
+    )
 
 
 @api.get("/teams", response=List[TeamSchema])
@@ -264,9 +387,13 @@ def get_teams(request):
     return Team.objects.all()
 
 
-@api.get("/team/{team_id}/results", response=List[TestResultSchema])
-def get_team_results(request, team_id: int):
-    return TestResult.objects.filter(person__team_id=team_id)
+@api.get("/team/{team_id}/results", response=PagedTestResultSchema)
+def get_team_results(
+    request, team_id: int, pagination: KeysetPagination.Input = Query(...)
+):
+    return test_results_response(
+        request, TestResult.objects.filter(person__team_id=team_id), pagination
+    )
 
 
 # Person endpoints
@@ -311,8 +438,12 @@ def create_test_result(request, test_result: TestResultSchema):
     )
 
 
-@api.put("/results/{result_id}", response=TestResultSchema)
-def update_test_result(request, result_id: int, test_result: TestResultSchema):
+# Shares its path with get_person_results, Django would route both methods to
+# whichever was registered first if the placeholders differed
+@api.put("/results/{person_id}", response=TestResultSchema)
+def update_test_result(
+    request, test_result: TestResultSchema, result_id: int = Path(..., alias="person_id")
+):
     result = get_object_or_404(TestResult, id=result_id)
     for key, value in test_result.dict(
         exclude_unset=True, exclude={"person_id"}
@@ -322,8 +453,8 @@ def update_test_result(request, result_id: int, test_result: TestResultSchema):
     return result
 
 
-@api.delete("/results/{result_id}")
-def delete_test_result(request, result_id: int):
+@api.delete("/results/{person_id}")
+def delete_test_result(request, result_id: int = Path(..., alias="person_id")):
     result = get_object_or_404(TestResult, id=result_id)
     result.delete()
     return {"success": True}
@@ -391,6 +522,7 @@ def get_person_aggregate_scores(request, person_id: int):
 
 # Active test management endpoints
 @api.get("/events", response=List[EventSchema])
+@paginate(KeysetPagination)
 def get_events(request):
     """Get all active tests, filtered by user's teams if not superuser"""
     if request.auth.is_superuser:
@@ -440,12 +572,13 @@ def delete_event(request, event_id: int):
 
 
 # User management endpoints
-@api.get("/users", response=List[UserSchema])
+@api.get("/users", response=List[UserListSchema])
+@paginate(KeysetPagination)
 def get_users(request):
     """Get all users - requires superuser"""
     if not request.auth.is_superuser:
-        return api.create_response(request, {"detail": "Not authorized"}, status=403)
-    return User.objects.all()
+        raise HttpError(403, "Not authorized")
+    return User.objects.prefetch_related("teams", "groups")
 
 
 @api.get("/users/adjudicators", response=List[UserSchema])
@@ -463,8 +596,8 @@ def get_current_user(request):
             username=user.username,
             is_active=user.is_active,
             is_superuser=user.is_superuser,
-            teams=[team.id for team in user.teams.all()],
-            groups=[group.name for group in user.groups.all()],
+            teams=user.team_ids,
+            groups=user.group_names,
         )
     return api.create_response(request, {"detail": "Not authenticated"}, status=401)
 
@@ -512,11 +645,15 @@ def delete_adjudicator(request, id: int):
 
 
 # Test type specific endpoints
-@api.get("/results/test-type/{test_type}", response=List[TestResultSchema])
-def get_results_by_test_type(request, test_type: str):
+@api.get("/results/test-type/{test_type}", response=PagedTestResultSchema)
+def get_results_by_test_type(
+    request, test_type: str, pagination: KeysetPagination.Input = Query(...)
+):
     """Get results filtered by test type"""
     field_name = f"{test_type}_score"
-    return TestResult.objects.exclude(**{field_name: None})
+    return test_results_response(
+        request, TestResult.objects.exclude(**{field_name: None}), pagination
+    )
 
 
 @api.get(
@@ -525,8 +662,11 @@ def get_results_by_test_type(request, test_type: str):
 def get_team_results_by_test_type(request, test_type: str, team_id: int):
     """Get team results filtered by test type"""
     field_name = f"{test_type}_score"
-    return TestResult.objects.filter(person__team_id=team_id).exclude(
-        **{field_name: None}
+    return test_results_response(
+        request,
+        TestResult.objects.filter(person__team_id=team_id).exclude(
+            **{field_name: None}
+        ),
     )
 
 
@@ -537,8 +677,9 @@ def get_team_results_by_test_type(request, test_type: str, team_id: int):
 def get_person_results_by_test_type(request, test_type: str, person_id: int):
     """Get profile results filtered by test type"""
     field_name = f"{test_type}_score"
-    return TestResult.objects.filter(person_id=person_id).exclude(
-        **{field_name: None}
+    return test_results_response(
+        request,
+        TestResult.objects.filter(person_id=person_id).exclude(**{field_name: None}),
     )
 
 
@@ -546,90 +687,31 @@ def get_person_results_by_test_type(request, test_type: str, person_id: int):
 @api.get("/statistics/team/{team_id}")
 def get_team_statistics(request, team_id: int):
     """Get statistical summary of all test results for a team"""
-    from django.db.models import Avg, Max, Min
-
-    test_types = [
-        "ladder",
-        "hexagon",
-        "y_test",
-        "brace",
-        "medicimbal",
-        "jet",
-        "triple_jump",
-        "beep_test",
-    ]
+    from .statistics import team_statistics
 
-    stats = {}
-    for test_type in test_types:
-        field_name = f"{test_type}_score"
-        results = TestResult.objects.filter(person__team_id=team_id).exclude(
-            **{field_name: None}
-        )
-        stats[test_type] = {
-            "avg_score": results.aggregate(Avg(field_name))[f"{field_name}__avg"],
-            "max_score": results.aggregate(Max(field_name))[f"{field_name}__max"],
-            "min_score": results.aggregate(Min(field_name))[f"{field_name}__min"],
-            "total_tests": results.count(),
-        }
+    return team_statistics(team_id)
 
-    # Add composite scores
-    composite_scores = ["strength", "speed", "endurance", "agility"]
-    for score_type in composite_scores:
-        field_name = f"{score_type}_score"
-        results = TestResult.objects.filter(person__team_id=team_id).exclude(
-            **{field_name: None}
-        )
-        stats[f"{score_type}_composite"] = {
-            "avg_score": results.aggregate(Avg(field_name))[f"{field_name}__avg"],
-            "max_score": results.aggregate(Max(field_name))[f"{field_name}__max"],
-            "min_score": results.aggregate(Min(field_name))[f"{field_name}__min"],
-        }
 
-    return stats
+@api.get("/statistics/team/{team_id}/progress")
+def get_team_progress(request, team_id: int):
+    """Get first, last and score series of every test for each team member"""
+    from .statistics import team_progress
+
+    return team_progress(team_id)
 
 
 @api.get("/statistics/person/{person_id}")
-def get_person_progress(request, person_id: int):
+def get_person_progress(
+    request,
+    person_id: int,
+    event_id: int | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+):
     """Get progress statistics for a profile across all test types"""
-    from django.db.models import F
+    from .statistics import person_progress
 
-    test_types = [
-        "ladder",
-        "hexagon",
-        "y_test",
-        "brace",
-        "medicimbal",
-        "jet",
-        "triple_jump",
-        "beep_test",
-    ]
-
-    progress = {}
-    for test_type in test_types:
-        field_name = f"{test_type}_score"
-        results = (
-            TestResult.objects.filter(person_id=person_id)
-            .exclude(**{field_name: None})
-            .order_by("test_date")
-            .values("test_date", field_name)
-        )
-
-        if len(results) >= 2:
-            first_score = results.first()[field_name]
-            last_score = results.last()[field_name]
-            progress[test_type] = {
-                "improvement": last_score - first_score,
-                "improvement_percentage": (
-                    ((last_score - first_score) / first_score * 100)
-                    if first_score
-                    else None
-                ),
-                "scores_over_time": [
-                    {"date": r["test_date"], "score": r[field_name]} for r in results
-                ],
-            }
-
-    return progress
+    return person_progress(person_id, event_id, date_from, date_to)
 
 # Add these new test-specific endpoints after the existing endpoints
 @api.post("/ladder-test/{person_id}", response=TestResultSchema)
@@ -656,17 +738,22 @@ def save_ladder_test(request, person_id: int, data: dict = Body(...)):
                 request, {"detail": "No active test found for this profile's team"}, status=400
             )
 
+        test_result = get_or_create_test_result(
+            person, event, test_name=event.name, test_date=date.today(), team=event.team
+        )
+
         # Check if person has required data for score calculation
-        if person.age is None or person.gender is None:
+        if test_result.age_at_test is None or person.gender is None:
             # Person doesn't have required data, save with score 0
             score = 0
         else:
             score = calculate_score(
-                person.age,
+                test_result.age_at_test,
                 person.gender,
                 "ladder",
                 data.get("ladder_time_1"),
-                data.get("ladder_time_2")
+                data.get("ladder_time_2"),
+                event=event
             )
             # print(f"Calculated score: {score}")
 
@@ -677,16 +764,9 @@ def save_ladder_test(request, person_id: int, data: dict = Body(...)):
                     status=422
                 )
 
-        test_result = get_or_create_test_result(
-            person,
-            event,
-            ladder_time_1=data.get("ladder_time_1"),
-            ladder_time_2=data.get("ladder_time_2"),
-            ladder_score=score,
-            test_name=event.name,
-            test_date=date.today(),
-            team=event.team,
-        )
+        test_result.ladder_time_1 = data.get("ladder_time_1")
+        test_result.ladder_time_2 = data.get("ladder_time_2")
+        test_result.ladder_score = score
 
         test_result.save()
         from django.forms.models import model_to_dict
@@ -712,6 +792,10 @@ def save_brace_test(request, person_id: int, data: dict = Body(...)):
         return api.create_response(
             request, {"detail": "No active test found for this profile's team"}, status=400
         )
+
+    test_result = get_or_create_test_result(
+        person, event, test_name=event.name, test_date=date.today(), team=event.team
+    )
     
     if (
         (data.get("brace_time_1") is not None and not isinstance(data.get("brace_time_1"), (int, float)))
@@ -723,16 +807,17 @@ def save_brace_test(request, person_id: int, data: dict = Body(...)):
         )
 
     # Check if person has required data for score calculation
-    if person.age is None or person.gender is None:
+    if test_result.age_at_test is None or person.gender is None:
         # Person doesn't have required data, save with score 0
         score = 0
     else:
         score = calculate_score(
-            person.age,
+            test_result.age_at_test,
             person.gender,
             "brace",
             data.get("brace_time_1"),
-            data.get("brace_time_2")
+            data.get("brace_time_2"),
+            event=event
         )
         if score is None:
             return api.create_response(
@@ -741,16 +826,9 @@ def save_brace_test(request, person_id: int, data: dict = Body(...)):
                 status=422
             )
 
-    test_result = get_or_create_test_result(
-        person,
-        event,
-        brace_time_1=data.get("brace_time_1"),
-        brace_time_2=data.get("brace_time_2"),
-        brace_score=score,
-        test_name=event.name,
-        test_date=date.today(),
-        team=event.team,
-    )
+    test_result.brace_time_1 = data.get("brace_time_1")
+    test_result.brace_time_2 = data.get("brace_time_2")
+    test_result.brace_score = score
     test_result.save()
     from django.forms.models import model_to_dict
     response_data = model_to_dict(test_result)
@@ -776,18 +854,23 @@ def save_hexagon_test(request, person_id: int, data: dict = Body(...)):
             return api.create_response(
                 request, {"detail": "No active test found for this profile's team"}, status=400
             )
+
+        test_result = get_or_create_test_result(
+            person, event, test_name=event.name, test_date=date.today(), team=event.team
+        )
         
         # Check if person has required data for score calculation
-        if person.age is None or person.gender is None:
+        if test_result.age_at_test is None or person.gender is None:
             # Person doesn't have required data, save with score 0
             score = 0
         else:
             score = calculate_score(
-                person.age,
+                test_result.age_at_test,
                 person.gender,
                 "hexagon",
                 data.get("hexagon_time_cw"),
-                data.get("hexagon_time_ccw")
+                data.get("hexagon_time_ccw"),
+                event=event
             )
             if score is None:
                 return api.create_response(
@@ -795,16 +878,9 @@ def save_hexagon_test(request, person_id: int, data: dict = Body(...)):
                     {"detail": "Invalid times - they must be within valid ranges for the athlete's age"},
                     status=422
                 )
-        test_result = get_or_create_test_result(
-            person,
-            event,
-            hexagon_time_cw=data.get("hexagon_time_cw"),
-            hexagon_time_ccw=data.get("hexagon_time_ccw"),
-            hexagon_score=score,
-            test_name=event.name,
-            test_date=date.today(),
-            team=event.team,
-        )
+        test_result.hexagon_time_cw = data.get("hexagon_time_cw")
+        test_result.hexagon_time_ccw = data.get("hexagon_time_ccw")
+        test_result.hexagon_score = score
         test_result.save()
         from django.forms.models import model_to_dict
         response_data = model_to_dict(test_result)
@@ -828,18 +904,22 @@ def save_y_test(request, person_id: int, data: dict = Body(...)):
             return api.create_response(
                 request, {"detail": "No active test found for this profile's team"}, status=400
             )
+
+        test_result = get_or_create_test_result(
+            person, event, test_name=event.name, test_date=date.today(), team=event.team
+        )
         
         # Check if person has required data for score calculation
-        if person.age is None or person.gender is None or person.latest_height is None:
+        if test_result.age_at_test is None or person.gender is None or test_result.height_at_test is None:
             # Person doesn't have required data, save with score 0
             y_test_score = 0
             y_test_index = 0
         else:
             y_test_score = calculate_score(
-                person.age,
+                test_result.age_at_test,
                 person.gender,
                 "y_test",
-                person.latest_height,
+                test_result.height_at_test,
                 data.get("y_test_ll_front"),
                 data.get("y_test_ll_left"),
                 data.get("y_test_ll_right"),
@@ -851,10 +931,11 @@ def save_y_test(request, person_id: int, data: dict = Body(...)):
                 data.get("y_test_la_back"),
                 data.get("y_test_ra_right"),
                 data.get("y_test_ra_front"),
-                data.get("y_test_ra_back")
+                data.get("y_test_ra_back"),
+                event=event
             )
             y_test_index = calculate_y_test_index(
-                person.latest_height,
+                test_result.height_at_test,
                 data.get("y_test_ll_front"),
                 data.get("y_test_ll_left"),
                 data.get("y_test_ll_right"),
@@ -874,27 +955,20 @@ def save_y_test(request, person_id: int, data: dict = Body(...)):
                     {"detail": "Invalid Y test values - check input data"},
                     status=422
                 )
-        test_result = get_or_create_test_result(
-            person,
-            event,
-            y_test_ll_front=data.get("y_test_ll_front"),
-            y_test_ll_left=data.get("y_test_ll_left"),
-            y_test_ll_right=data.get("y_test_ll_right"),
-            y_test_rl_front=data.get("y_test_rl_front"),
-            y_test_rl_left=data.get("y_test_rl_left"),
-            y_test_rl_right=data.get("y_test_rl_right"),
-            y_test_la_left=data.get("y_test_la_left"),
-            y_test_la_front=data.get("y_test_la_front"),
-            y_test_la_back=data.get("y_test_la_back"),
-            y_test_ra_right=data.get("y_test_ra_right"),
-            y_test_ra_front=data.get("y_test_ra_front"),
-            y_test_ra_back=data.get("y_test_ra_back"),
-            y_test_score=y_test_score,
-            y_test_index=y_test_index,
-            test_name=event.name,
-            test_date=date.today(),
-            team=event.team,
-        )
+        test_result.y_test_ll_front = data.get("y_test_ll_front")
+        test_result.y_test_ll_left = data.get("y_test_ll_left")
+        test_result.y_test_ll_right = data.get("y_test_ll_right")
+        test_result.y_test_rl_front = data.get("y_test_rl_front")
+        test_result.y_test_rl_left = data.get("y_test_rl_left")
+        test_result.y_test_rl_right = data.get("y_test_rl_right")
+        test_result.y_test_la_left = data.get("y_test_la_left")
+        test_result.y_test_la_front = data.get("y_test_la_front")
+        test_result.y_test_la_back = data.get("y_test_la_back")
+        test_result.y_test_ra_right = data.get("y_test_ra_right")
+        test_result.y_test_ra_front = data.get("y_test_ra_front")
+        test_result.y_test_ra_back = data.get("y_test_ra_back")
+        test_result.y_test_score = y_test_score
+        test_result.y_test_index = y_test_index
         test_result.save()
         from django.forms.models import model_to_dict
         response_data = model_to_dict(test_result)
@@ -924,19 +998,24 @@ def save_medicimbal_test(request, person_id: int, data: dict = Body(...)):
             return api.create_response(
                 request, {"detail": "No active test found for this profile's team"}, status=400
             )
+
+        test_result = get_or_create_test_result(
+            person, event, test_name=event.name, test_date=date.today(), team=event.team
+        )
         
         # Check if person has required data for score calculation
-        if person.age is None or person.gender is None:
+        if test_result.age_at_test is None or person.gender is None:
             # Person doesn't have required data, save with score 0
             score = 0
         else:
             score = calculate_score(
-                person.age,
+                test_result.age_at_test,
                 person.gender,
                 "medicimbal",
                 data.get("medicimbal_throw_1"),
                 data.get("medicimbal_throw_2"),
-                data.get("medicimbal_throw_3")
+                data.get("medicimbal_throw_3"),
+                event=event
             )
             if score is None:
                 return api.create_response(
@@ -944,17 +1023,10 @@ def save_medicimbal_test(request, person_id: int, data: dict = Body(...)):
                     {"detail": "Invalid throws - they must be within valid ranges for the athlete's age"},
                     status=422
                 )
-        test_result = get_or_create_test_result(
-            person,
-            event,
-            medicimbal_throw_1=data.get("medicimbal_throw_1"),
-            medicimbal_throw_2=data.get("medicimbal_throw_2"),
-            medicimbal_throw_3=data.get("medicimbal_throw_3"),
-            medicimbal_score=score,
-            test_name=event.name,
-            test_date=date.today(),
-            team=event.team,
-        )
+        test_result.medicimbal_throw_1 = data.get("medicimbal_throw_1")
+        test_result.medicimbal_throw_2 = data.get("medicimbal_throw_2")
+        test_result.medicimbal_throw_3 = data.get("medicimbal_throw_3")
+        test_result.medicimbal_score = score
         test_result.save()
         from django.forms.models import model_to_dict
         response_data = model_to_dict(test_result)
@@ -978,6 +1050,10 @@ def save_jet_test(request, person_id: int, data: dict = Body(...)):
             return api.create_response(
                 request, {"detail": "No active test found for this profile's team"}, status=400
             )
+
+        test_result = get_or_create_test_result(
+            person, event, test_name=event.name, test_date=date.today(), team=event.team
+        )
         # Always calculate distance from laps and sides
         jet_laps = data.get("jet_laps")
         jet_sides = data.get("jet_sides")
@@ -988,15 +1064,16 @@ def save_jet_test(request, person_id: int, data: dict = Body(...)):
         jet_distance = jet_laps * 40 + jet_sides * 10
         
         # Check if person has required data for score calculation
-        if person.age is None or person.gender is None:
+        if test_result.age_at_test is None or person.gender is None:
             # Person doesn't have required data, save with score 0
             score = 0
         else:
             score = calculate_score(
-                person.age,
+                test_result.age_at_test,
                 person.gender,
                 "jet",
-                jet_distance
+                jet_distance,
+                event=event
             )
             if score is None:
                 return api.create_response(
@@ -1004,17 +1081,10 @@ def save_jet_test(request, person_id: int, data: dict = Body(...)):
                     {"detail": "Invalid jet test values - check input data"},
                     status=422
                 )
-        test_result = get_or_create_test_result(
-            person,
-            event,
-            jet_laps=jet_laps,
-            jet_sides=jet_sides,
-            jet_distance=jet_distance,
-            jet_score=score,
-            test_name=event.name,
-            test_date=date.today(),
-            team=event.team,
-        )
+        test_result.jet_laps = jet_laps
+        test_result.jet_sides = jet_sides
+        test_result.jet_distance = jet_distance
+        test_result.jet_score = score
         test_result.save()
         from django.forms.models import model_to_dict
         response_data = model_to_dict(test_result)
@@ -1044,19 +1114,24 @@ def save_triple_jump_test(request, person_id: int, data: dict = Body(...)):
             return api.create_response(
                 request, {"detail": "No active test found for this profile's team"}, status=400
             )
+
+        test_result = get_or_create_test_result(
+            person, event, test_name=event.name, test_date=date.today(), team=event.team
+        )
         
         # Check if person has required data for score calculation
-        if person.age is None or person.gender is None:
+        if test_result.age_at_test is None or person.gender is None:
             # Person doesn't have required data, save with score 0
             score = 0
         else:
             score = calculate_score(
-                person.age,
+                test_result.age_at_test,
                 person.gender,
                 "triple_jump",
                 data.get("triple_jump_distance_1"),
                 data.get("triple_jump_distance_2"),
-                data.get("triple_jump_distance_3")
+                data.get("triple_jump_distance_3"),
+                event=event
             )
             if score is None:
                 return api.create_response(
@@ -1064,17 +1139,10 @@ def save_triple_jump_test(request, person_id: int, data: dict = Body(...)):
                     {"detail": "Invalid jump distances - they must be within valid ranges for the athlete's age"},
                     status=422
                 )
-        test_result = get_or_create_test_result(
-            person,
-            event,
-            triple_jump_distance_1=data.get("triple_jump_distance_1"),
-            triple_jump_distance_2=data.get("triple_jump_distance_2"),
-            triple_jump_distance_3=data.get("triple_jump_distance_3"),
-            triple_jump_score=score,
-            test_name=event.name,
-            test_date=date.today(),
-            team=event.team,
-        )
+        test_result.triple_jump_distance_1 = data.get("triple_jump_distance_1")
+        test_result.triple_jump_distance_2 = data.get("triple_jump_distance_2")
+        test_result.triple_jump_distance_3 = data.get("triple_jump_distance_3")
+        test_result.triple_jump_score = score
         test_result.save()
         from django.forms.models import model_to_dict
         response_data = model_to_dict(test_result)
@@ -1104,80 +1172,46 @@ class BeepTestBatchResponse(Schema):
 
 @api.post("/beep-test/batch", response=List[BeepTestBatchResponse])
 def save_beep_test_batch(request, items: List[BeepTestBatchItem]):
-    responses = []
-    for item in items:
-        try:
-            person = get_object_or_404(Person, id=item.person_id)
-            event = Event.objects.filter(is_active=True, team=person.team).first()
-            if not event:
-                responses.append(BeepTestBatchResponse(
-                    person_id=item.person_id,
-                    success=False,
-                    error="No active test found for this profile's team"
-                ))
-                continue
-            beep_test_total_laps = calculate_beep_test_total_laps(item.beep_test_level, item.beep_test_laps)
-            
-            # Check if person has required data for score calculation
-            if person.age is None or person.gender is None:
-                # Person doesn't have required data, save with score 0
-                beep_test_score = 0
-            else:
-                beep_test_score = calculate_score(
-                    person.age,
-                    person.gender,
-                    "beep_test",
-                    beep_test_total_laps
-                )
-                if beep_test_score is None:
-                    responses.append(BeepTestBatchResponse(
-                        person_id=item.person_id,
-                        success=False,
-                        error="Invalid beep test values - check input data"
-                    ))
-                    continue
-            test_result = get_or_create_test_result(
-                person,
-                event,
-                beep_test_level=item.beep_test_level,
-                beep_test_laps=item.beep_test_laps,
-                beep_test_total_laps=beep_test_total_laps,
-                beep_test_number=item.beep_test_number,
-                max_hr=item.max_hr,
-                beep_test_score=beep_test_score,
-                test_name=event.name,
-                test_date=date.today(),
-                team=event.team,
-            )
-            test_result.save()
-            from django.forms.models import model_to_dict
-            response_data = model_to_dict(test_result)
-            response_data["team"] = test_result.team.name if test_result.team else None
-            response_data["person_id"] = test_result.person.id
-            response_data["test_date"] = test_result.test_date
-            responses.append(BeepTestBatchResponse(
-                person_id=item.person_id,
-                success=True,
-                result=response_data
-            ))
-        except Exception as e:
-            responses.append(BeepTestBatchResponse(
-                person_id=item.person_id,
-                success=False,
-                error=str(e)
-            ))
-    return responses
-
-@api.post("/recalculate-scores")
-def recalculate_scores_api(request):
-    """Recalculate all scores for the current user's teams (or all if superuser)"""
-    from .recalculate_scores import recalculate_scores
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-    # request.auth is the username string from AuthBearer
-    user = User.objects.get(username=request.auth)
-    recalculate_scores(user)
-    return {"success": True, "message": "Scores recalculated successfully."}
+    """Save the beep tests of many profiles at once, reporting each item's outcome"""
+    from .result_batches import save_beep_tests
+
+    outcomes = save_beep_tests(items)
+    for outcome in outcomes:
+        test_result = outcome["result"]
+        if test_result is not None:
+            outcome["result"] = test_result_dict(test_result)
+    return outcomes
+
+@api.post("/recalculate-scores", response={202: JobSchema})
+def recalculate_scores_api(
+    request,
+    full: bool = False,
+    parallel: bool = False,
+    staged: bool = False,
+    in_database: bool = False,
+):
+    """Queue a recalculation of changed scores for the user's teams (every score if full)"""
+    from pydantic import ValidationError
+    from .jobs import enqueue_job
+
+    # Superusers recalculating many teams can spread them over worker processes,
+    # staged recalculations swap all new scores in at once at the end and
+    # in_database ones rescore in a single UPDATE without loading any result.
+    # Parallel workers do neither, so it can't be combined with the other two
+    try:
+        job = enqueue_job(
+            Job.RECALCULATE_SCORES,
+            request.auth,
+            full=full,
+            parallel=parallel,
+            staged=staged,
+            in_database=in_database,
+        )
+    except ValidationError as e:
+        return api.create_response(
+            request, {"detail": e.errors(include_url=False, include_context=False)}, status=400
+        )
+    return 202, job
 
 @api.get("/results/person/{person_id}/event/{event_id}", response=TestResultSchema)
 def get_person_event_result(request, person_id: int, event_id: int):
@@ -1232,47 +1266,52 @@ class ProfileIdsSchema(Schema):
 
 @api.post("/beep-test/has-results", response=dict)
 def beep_test_has_results(request, data: ProfileIdsSchema):
-    result = {}
-    for pid in data.profile_ids:
-        has_result = TestResult.objects.filter(
-            person_id=pid
-        ).exclude(beep_test_score=None).exists()
-        result[pid] = has_result
+    """Whether each profile has a beep test result, in one query"""
+    from django.db.models import Exists, OuterRef
+
+    has_results = (
+        Person.objects.filter(id__in=data.profile_ids)
+        .annotate(
+            has_result=Exists(
+                TestResult.objects.filter(person_id=OuterRef("pk")).exclude(
+                    beep_test_score=None
+                )
+            )
+        )
+        .values_list("id", "has_result")
+    )
+    result = dict.fromkeys(data.profile_ids, False)
+    result.update(has_results)
     return result
 
 @api.post("/beep-test/batch-latest", response=Dict[int, TestResultSchema | None])
 def beep_test_batch_latest(request, data: ProfileIdsSchema):
-    result = {}
-    for pid in data.profile_ids:
-        field_name = "beep_test_score"
-        latest = (
-            TestResult.objects.filter(person_id=pid)
-            .exclude(**{field_name: None})
-            .order_by("-test_date")
-            .first()
-        )
-        if latest:
-            from django.forms.models import model_to_dict
-            response_data = model_to_dict(latest)
-            response_data["team"] = latest.team.name if latest.team else None
-            response_data["person_id"] = latest.person.id
-            response_data["test_date"] = latest.test_date
-            result[pid] = response_data
-        else:
-            result[pid] = None
-    return result
+    """Latest beep test result of each profile, in one DISTINCT ON query"""
+    latest = test_result_rows(
+        TestResult.objects.filter(person_id__in=data.profile_ids)
+        .exclude(beep_test_score=None)
+        .order_by("person_id", "-test_date", "-id")
+        .distinct("person_id")
+    )
+    result = dict.fromkeys(data.profile_ids)
+    for row in latest:
+        row["team"] = row.pop("team_name")
+        result[row["person_id"]] = row
+    # The rows already have the schema's shape, see test_results_response
+    return api.create_response(request, result, status=200)
 
 def get_or_create_test_result(person, event=None, **kwargs):
     filters = {'person': person}
     if event is not None:
         filters['event'] = event
-    test_result, created = TestResult.objects.get_or_create(
-        **filters,
-        defaults=kwargs,
-    )
-    if not created:
-        for key, value in kwargs.items():
-            setattr(test_result, key, value)
+    try:
+        test_result = TestResult.objects.get(**filters)
+    except TestResult.DoesNotExist:
+        test_result = TestResult(**filters)
+    for key, value in kwargs.items():
+        setattr(test_result, key, value)
+    # The age and height on the test date to score with, save() keeps them
+    test_result.update_person_snapshot()
     return test_result
 
 
@@ -1438,3 +1477,63 @@ def collect_missing_data(request, person_id: int, data: PersonDataCollectionSche
         "success": True,
         "message": "Data collected successfully"
     }
+
+
+@api.post("/jobs", response={202: JobSchema})
+def create_job(request, data: JobCreateSchema):
+    """Queue a background job, poll it with GET /jobs/{job_id}"""
+    from pydantic import ValidationError
+    from .jobs import JOB_HANDLERS, enqueue_job
+
+    if data.kind not in JOB_HANDLERS:
+        return api.create_response(request, {"detail": "Unknown job kind"}, status=400)
+    if data.kind == Job.PDF_REPORT and not is_adjudicator(request.auth):
+        return api.create_response(request, {"detail": "Not authorized"}, status=403)
+    try:
+        job = enqueue_job(data.kind, request.auth, **data.params)
+    except ValidationError as e:
+        return api.create_response(
+            request, {"detail": e.errors(include_url=False, include_context=False)}, status=422
+        )
+    return 202, job
+
+
+@api.post("/reports/pdf", response={202: JobSchema})
+def create_pdf_report(request, person_id: Optional[int] = None):
+    """Queue a PDF report of all results (or a single person's)"""
+    from .jobs import enqueue_job
+
+    if not is_adjudicator(request.auth):
+        return api.create_response(request, {"detail": "Not authorized"}, status=403)
+    return 202, enqueue_job(Job.PDF_REPORT, request.auth, person_id=person_id)
+
+
+def _get_job(request, job_id, queryset=Job.objects.defer("output")):
+    job = get_object_or_404(queryset, id=job_id)
+    if job.created_by_id != request.auth.id and not request.auth.is_superuser:
+        return None
+    return job
+
+
+@api.get("/jobs/{job_id}", response=JobSchema)
+def get_job(request, job_id: int):
+    """Get the status and progress of a background job"""
+    job = _get_job(request, job_id)
+    if job is None:
+        return api.create_response(request, {"detail": "Not authorized"}, status=403)
+    return job
+
+
+@api.get("/jobs/{job_id}/output")
+def get_job_output(request, job_id: int):
+    """Download the file a finished report job generated"""
+    from django.http import HttpResponse
+
+    job = _get_job(request, job_id, Job.objects.all())
+    if job is None:
+        return api.create_response(request, {"detail": "Not authorized"}, status=403)
+    if job.status != Job.SUCCEEDED or job.output is None:
+        return api.create_response(request, {"detail": "No output available"}, status=404)
+    response = HttpResponse(bytes(job.output), content_type=job.result["content_type"])
+    response["Content-Disposition"] = f'attachment; filename="{job.result["filename"]}"'
+    return response
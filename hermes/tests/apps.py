@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class TestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tests'
+
+    def ready(self):
+        from . import auth_cache, statistics
+        from .score_table_registry import (
+            current_score_table_version,
+            get_score_engine,
+        )
+        from .score_tables import set_score_engine
+
+        # Score with the current season's tables unless an event says otherwise
+        set_score_engine(get_score_engine(current_score_table_version()))
+        # Drop cached API users and statistics when what they show changes
+        auth_cache.connect_signals()
+        statistics.connect_signals()
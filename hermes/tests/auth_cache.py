@@ -0,0 +1,115 @@
+"""
+Cache of the users behind API tokens, see AuthBearer.
+
+A token's user is loaded with their team ids and group names once and kept
+for AUTH_CACHE_TTL seconds in a per-process LRU of AUTH_CACHE_SIZE tokens,
+or in the Django cache AUTH_CACHE_BACKEND names so that all processes
+share it. Any change to users, groups, teams or their memberships drops
+every cached token (signals connected in TestsConfig.ready).
+"""
+
+import copy
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.cache import caches
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .models import Team
+
+# Shared cache key of the counter bumped to invalidate every token at once
+GENERATION_KEY = "auth_cache:generation"
+
+_tokens = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+_lock = threading.Lock()
+
+
+def _shared_cache():
+    if settings.AUTH_CACHE_BACKEND:
+        return caches[settings.AUTH_CACHE_BACKEND]
+    return None
+
+
+def _shared_key(cache, signature):
+    generation = cache.get_or_set(GENERATION_KEY, 0, timeout=None)
+    return f"auth_cache:{generation}:{signature}"
+
+
+def load_user(username):
+    """User with ``team_ids`` and ``group_names`` set in one query, or None"""
+    user = (
+        User.objects.filter(username=username)
+        .annotate(
+            team_id_list=ArrayAgg(
+                "teams__id", distinct=True, filter=Q(teams__isnull=False), default=[]
+            ),
+            group_name_list=ArrayAgg(
+                "groups__name",
+                distinct=True,
+                filter=Q(groups__isnull=False),
+                default=[],
+            ),
+        )
+        .first()
+    )
+    if user is None:
+        return None
+    user.team_ids = sorted(user.team_id_list)
+    user.group_names = sorted(user.group_name_list)
+    return user
+
+
+def get_user(signature, username):
+    """
+    The user a verified token with this signature belongs to, from the
+    cache or loaded with load_user. Each call gets its own copy, so a
+    request changing its user never touches the cached one.
+    """
+    cache = _shared_cache()
+    if cache is not None:
+        key = _shared_key(cache, signature)
+        user = cache.get(key)
+        if user is None:
+            user = load_user(username)
+            if user is not None:
+                cache.set(key, user, timeout=settings.AUTH_CACHE_TTL)
+        return user
+
+    with _lock:
+        user = _tokens.get(signature)
+    if user is None:
+        user = load_user(username)
+        if user is None:
+            return None
+        with _lock:
+            _tokens[signature] = user
+    return copy.copy(user)
+
+
+def invalidate(**kwargs):
+    """Drop every cached token, connected to the signals below"""
+    if kwargs.get("update_fields") == frozenset({"last_login"}):
+        # Logging in changes nothing a cached user is used for
+        return
+    with _lock:
+        _tokens.clear()
+    cache = _shared_cache()
+    if cache is not None:
+        cache.get_or_set(GENERATION_KEY, 0, timeout=None)
+        cache.incr(GENERATION_KEY)
+
+
+def connect_signals():
+    for model in (User, Group, Team):
+        post_save.connect(invalidate, sender=model, dispatch_uid=f"auth_cache_{model}")
+        post_delete.connect(
+            invalidate, sender=model, dispatch_uid=f"auth_cache_delete_{model}"
+        )
+    for through in (User.groups.through, Team.admins.through):
+        m2m_changed.connect(
+            invalidate, sender=through, dispatch_uid=f"auth_cache_{through}"
+        )
@@ -0,0 +1,182 @@
+import threading
+import traceback
+from datetime import timedelta
+from io import BytesIO
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from ninja import Schema
+from pydantic import model_validator
+
+from .models import Job, TestResult
+
+# Seconds between the heartbeats of a running job
+HEARTBEAT_INTERVAL = 30
+
+# A running job without a heartbeat for this long lost its worker and is
+# claimed again, at most MAX_ATTEMPTS times
+STALE_AFTER = timedelta(minutes=5)
+MAX_ATTEMPTS = 3
+
+
+class RecalculateScoresParams(Schema):
+    model_config = {"extra": "forbid"}
+
+    full: bool = False
+    parallel: bool = False
+    staged: bool = False
+    in_database: bool = False
+
+    @model_validator(mode="after")
+    def check_modes(self):
+        # Parallel workers score in memory and save as they go
+        if self.parallel and (self.staged or self.in_database):
+            raise ValueError("parallel can't be combined with staged or in_database")
+        return self
+
+
+class PdfReportParams(Schema):
+    model_config = {"extra": "forbid"}
+
+    person_id: int | None = None
+
+
+def enqueue_job(kind, user, /, **params):
+    """
+    Queue a job for run_hermes_worker. ``params`` are validated against the
+    kind's JOB_PARAMS schema, raising pydantic's ValidationError.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    params = JOB_PARAMS[kind].model_validate(params).model_dump()
+    return Job.objects.create(kind=kind, params=params, created_by=user)
+
+
+def claim_next_job():
+    """
+    Mark the oldest queued job as running and return it (or None).
+
+    The row is locked with ``SELECT ... FOR UPDATE SKIP LOCKED``, so any
+    number of workers can poll the queue without claiming a job twice or
+    waiting on each other. Running jobs whose heartbeat stopped for
+    STALE_AFTER are claimed again, or failed once they used up MAX_ATTEMPTS.
+    """
+    now = timezone.now()
+    stale = Q(status=Job.RUNNING, heartbeat_at__lt=now - STALE_AFTER)
+    with transaction.atomic():
+        Job.objects.filter(stale, attempts__gte=MAX_ATTEMPTS).update(
+            status=Job.FAILED,
+            error="The worker running the job stopped responding",
+            finished_at=now,
+        )
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Job.QUEUED) | stale)
+            .order_by("created_at", "pk")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.started_at = job.heartbeat_at = now
+        job.attempts += 1
+        job.save(update_fields=["status", "started_at", "heartbeat_at", "attempts"])
+    return job
+
+
+class _Heartbeat(threading.Thread):
+    """Touches a running job's heartbeat_at until stopped"""
+
+    def __init__(self, job):
+        super().__init__(daemon=True)
+        self.job_pk = job.pk
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL):
+                Job.objects.filter(pk=self.job_pk, status=Job.RUNNING).update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            # The thread's own connection
+            connection.close()
+
+
+def run_job(job):
+    """Run a claimed job and record its result or error"""
+    heartbeat = _Heartbeat(job)
+    heartbeat.start()
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except Exception:
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = Job.SUCCEEDED
+        job.progress = 1
+        job.result = result
+    finally:
+        heartbeat.stopped.set()
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def _progress_callback(job):
+    def progress(done, total):
+        job.progress = done / total if total else 1
+        Job.objects.filter(pk=job.pk).update(
+            progress=job.progress, heartbeat_at=timezone.now()
+        )
+
+    return progress
+
+
+def _recalculate_scores(job):
+    from .recalculate_scores import recalculate_scores, recalculate_scores_parallel
+
+    params = RecalculateScoresParams.model_validate(job.params)
+    if params.parallel and job.created_by.is_superuser:
+        return recalculate_scores_parallel(job.created_by, full=params.full)
+    updated = recalculate_scores(
+        job.created_by,
+        full=params.full,
+        progress=_progress_callback(job),
+        staged=params.staged,
+        in_database=params.in_database,
+    )
+    return {"updated": updated}
+
+
+def _pdf_report(job):
+    from .pdf_report_generator import generate_test_results_pdf
+
+    test_results = TestResult.objects.select_related("person__team").order_by(
+        "person__surname"
+    )
+    person_id = job.params.get("person_id")
+    if person_id is not None:
+        test_results = test_results.filter(person_id=person_id)
+        filename = f"test_results_{person_id}.pdf"
+    else:
+        filename = "all_test_results.pdf"
+
+    buffer = BytesIO()
+    generate_test_results_pdf(list(test_results), buffer, job.created_by)
+    job.output = buffer.getvalue()
+    return {"filename": filename, "content_type": "application/pdf"}
+
+
+# Functions running each kind of job, they return the job's JSON result
+JOB_HANDLERS = {
+    Job.RECALCULATE_SCORES: _recalculate_scores,
+    Job.PDF_REPORT: _pdf_report,
+}
+
+# Schemas of the params each kind of job takes
+JOB_PARAMS = {
+    Job.RECALCULATE_SCORES: RecalculateScoresParams,
+    Job.PDF_REPORT: PdfReportParams,
+}
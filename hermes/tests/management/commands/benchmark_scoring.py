@@ -0,0 +1,197 @@
+import json
+import platform
+import random
+import time
+from datetime import datetime
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from tests import score_tables
+from tests.score_tables import (
+    SCORE_TABLES,
+    calculate_beep_test_total_laps,
+    calculate_score,
+    calculate_y_test_index,
+    quick_calculate,
+    score_batch,
+)
+
+# Number of trial values calculate_score takes per test (after age, gender, test)
+TRIALS = {
+    "ladder": 2,
+    "brace": 2,
+    "hexagon": 2,
+    "medicimbal": 3,
+    "triple_jump": 3,
+    "jet": 1,
+    "beep_test": 1,
+}
+
+
+def _value_range(test):
+    thresholds = [
+        value
+        for gender_table in SCORE_TABLES[test].values()
+        for row in gender_table.values()
+        for value in row
+    ]
+    low, high = min(thresholds), max(thresholds)
+    margin = (high - low) * 0.1
+    return low - margin, high + margin
+
+
+def _sample_value(test, rng):
+    low, high = _value_range(test)
+    if test in ("jet", "beep_test"):
+        return rng.randint(int(low), int(high))
+    return round(rng.uniform(low, high), 2)
+
+
+def _sample_calls(test, count, rng):
+    calls = []
+    for _ in range(count):
+        age = rng.randint(5, 25)
+        gender = rng.choice(("M", "F"))
+        if test == "y_test":
+            height = round(rng.uniform(130, 190), 1)
+            index = rng.uniform(*_value_range(test))
+            reaches = [
+                round(index * height * rng.uniform(0.9, 1.1), 1) for _ in range(12)
+            ]
+            calls.append((age, gender, test, height, *reaches))
+        else:
+            values = [_sample_value(test, rng) for _ in range(TRIALS[test])]
+            calls.append((age, gender, test, *values))
+    return calls
+
+
+def _timed(function, repeat):
+    # Best of a few runs, the minimum is the least noisy estimate
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _result(seconds, calls):
+    return {
+        "ns_per_call": seconds / calls * 1e9,
+        "seconds_per_100k": seconds / calls * 100_000,
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark the score calculation and save the timings as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--calls",
+            type=int,
+            default=100_000,
+            help="Number of calls timed per function and test",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output",
+            default="scoring_benchmark.json",
+            help="File the timings are written to",
+        )
+        parser.add_argument(
+            "--compare",
+            help="Earlier benchmark JSON to compare the timings with",
+        )
+
+    def handle(self, *args, **options):
+        calls = options["calls"]
+        repeat = options["repeat"]
+        rng = random.Random(options["seed"])
+        timings = {}
+
+        for test in SCORE_TABLES:
+            sample = _sample_calls(test, calls, rng)
+
+            def run_calculate_score():
+                for call in sample:
+                    calculate_score(*call)
+
+            timings[f"calculate_score/{test}"] = _result(
+                _timed(run_calculate_score, repeat), calls
+            )
+
+            if test not in ("jet", "beep_test"):
+                if test == "y_test":
+                    quick_sample = [
+                        (call[0], call[1], test, calculate_y_test_index(*call[3:]))
+                        for call in sample
+                    ]
+                else:
+                    quick_sample = [call[:4] for call in sample]
+
+                def run_quick_calculate():
+                    for call in quick_sample:
+                        quick_calculate(*call)
+
+                timings[f"quick_calculate/{test}"] = _result(
+                    _timed(run_quick_calculate, repeat), calls
+                )
+
+            ages = np.array([call[0] for call in sample])
+            genders = np.array([call[1] for call in sample])
+            if test == "y_test":
+                values = np.array(
+                    [calculate_y_test_index(*call[3:]) for call in sample]
+                )
+            else:
+                values = np.array([call[3:] for call in sample], dtype=float)
+            timings[f"score_batch/{test}"] = _result(
+                _timed(lambda: score_batch(test, ages, genders, values), repeat),
+                calls,
+            )
+
+        y_test_sample = [call[3:] for call in _sample_calls("y_test", calls, rng)]
+
+        def run_y_test_index():
+            for call in y_test_sample:
+                calculate_y_test_index(*call)
+
+        timings["calculate_y_test_index"] = _result(
+            _timed(run_y_test_index, repeat), calls
+        )
+
+        beep_sample = [(rng.randint(1, 15), rng.randint(0, 12)) for _ in range(calls)]
+
+        def run_beep_test_total_laps():
+            for level, laps in beep_sample:
+                calculate_beep_test_total_laps(level, laps)
+
+        timings["calculate_beep_test_total_laps"] = _result(
+            _timed(run_beep_test_total_laps, repeat), calls
+        )
+
+        report = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "score_table_version": score_tables.score_engine.version,
+            "calls": calls,
+            "timings": timings,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2)
+
+        previous = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)["timings"]
+
+        for name, timing in timings.items():
+            line = f"{name:45} {timing['ns_per_call']:10.0f} ns/call"
+            if previous and name in previous:
+                ratio = previous[name]["ns_per_call"] / timing["ns_per_call"]
+                line += f"  {ratio:5.2f}x"
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(f"Saved to {options['output']}"))
@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tqdm import tqdm
+
+from tests.models import TestResult
+from tests.recalculate_scores import (
+    CHUNK_SIZE,
+    recalculate_chunk,
+    stale_test_results,
+)
+
+
+def _write_checkpoint(path, checkpoint):
+    # Replaced in one step so an interrupted write never leaves a torn file
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculate scores in constant memory, resuming from the last "
+        "checkpoint of an interrupted run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--team",
+            type=int,
+            action="append",
+            dest="teams",
+            help="Only recalculate the results of this team (repeatable)",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Recalculate every result, not only the ones whose inputs changed",
+        )
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument(
+            "--checkpoint",
+            default="recalculate_scores.checkpoint.json",
+            help="File the progress is saved to after every committed chunk",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and start from the beginning",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        checkpoint_path = Path(options["checkpoint"])
+        run = {"teams": sorted(options["teams"] or []), "full": options["full"]}
+
+        checkpoint = {"run": run, "last_pk": 0, "processed": 0, "updated": 0}
+        if checkpoint_path.exists() and not options["restart"]:
+            saved = json.loads(checkpoint_path.read_text())
+            if saved["run"] != run:
+                raise CommandError(
+                    f"{checkpoint_path} belongs to a run with other options, "
+                    "pass --restart to discard it"
+                )
+            checkpoint = saved
+            self.stdout.write(
+                f"Resuming after result {checkpoint['last_pk']} "
+                f"({checkpoint['processed']} already processed)"
+            )
+
+        test_results = TestResult.objects.all()
+        if run["teams"]:
+            test_results = test_results.filter(person__team_id__in=run["teams"])
+        if not run["full"]:
+            test_results = stale_test_results(test_results)
+        test_results = (
+            test_results.filter(pk__gt=checkpoint["last_pk"])
+            .select_related("person", "event")
+            .order_by("pk")
+        )
+
+        progress = tqdm(
+            total=checkpoint["processed"] + test_results.count(),
+            initial=checkpoint["processed"],
+            unit="results",
+            disable=options["verbosity"] == 0,
+        )
+        chunk = []
+        # A server-side cursor streams the rows, memory stays flat however
+        # many results there are
+        for test_result in test_results.iterator(chunk_size=chunk_size):
+            chunk.append(test_result)
+            if len(chunk) == chunk_size:
+                self._commit_chunk(chunk, checkpoint, checkpoint_path)
+                progress.update(len(chunk))
+                chunk = []
+        if chunk:
+            self._commit_chunk(chunk, checkpoint, checkpoint_path)
+            progress.update(len(chunk))
+        progress.close()
+
+        checkpoint_path.unlink(missing_ok=True)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recalculated {checkpoint['processed']} results, "
+                f"{checkpoint['updated']} changed"
+            )
+        )
+
+    def _commit_chunk(self, chunk, checkpoint, checkpoint_path):
+        with transaction.atomic():
+            checkpoint["updated"] += recalculate_chunk(chunk)
+        # Only written once the chunk is committed, a crash in between
+        # recalculates the chunk again which changes nothing
+        checkpoint["last_pk"] = chunk[-1].pk
+        checkpoint["processed"] += len(chunk)
+        _write_checkpoint(checkpoint_path, checkpoint)
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tests.jobs import claim_next_job, run_job
+from tests.models import Job
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (score recalculations, PDF reports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait before polling an empty queue again",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+                # Drop connections the database closed while we were idle
+                close_old_connections()
+                continue
+
+            self.stdout.write(f"Running {job}")
+            run_job(job)
+            if job.status == Job.FAILED:
+                self.stderr.write(self.style.ERROR(f"{job} failed:\n{job.error}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Finished {job}"))
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+import tests.score_table_registry
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0007_alter_person_date_of_birth_alter_person_gender'),
+    ]
+
+    operations = [
+        # Existing events were scored with the built-in tables
+        migrations.AddField(
+            model_name='event',
+            name='score_table_version',
+            field=models.CharField(default='builtin', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='score_table_version',
+            field=models.CharField(default=tests.score_table_registry.current_score_table_version, max_length=100),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0008_event_score_table_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testresult",
+            name="scored_table_version",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="testresult",
+            name="scores_dirty",
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+# Fills in the age and height on the test date of the existing results like
+# TestResult.update_person_snapshot, their scores are rescored with them by
+# the next recalculation
+BACKFILL_SQL = """
+UPDATE tests_testresult AS r
+SET age_at_test = date_part('year', age(r.test_date, p.date_of_birth))::int,
+    height_at_test = COALESCE(
+        (
+            SELECT m.height FROM tests_personmeasurement AS m
+            WHERE m.person_id = p.id AND m.measurement_date <= r.test_date
+            ORDER BY m.measurement_date DESC
+            LIMIT 1
+        ),
+        p.height
+    ),
+    scores_dirty = TRUE
+FROM tests_person AS p
+WHERE p.id = r.person_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0010_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testresult",
+            name="age_at_test",
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testresult",
+            name="height_at_test",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
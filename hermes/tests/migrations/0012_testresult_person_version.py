@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0011_testresult_age_at_test_height_at_test"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testresult",
+            name="person_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
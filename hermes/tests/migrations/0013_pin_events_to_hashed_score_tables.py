@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import migrations
+
+from tests.score_table_registry import BUILTIN_VERSION, HASHED_VERSION
+from tests.score_table_loader import compile_season
+
+
+def pin_hashed_versions(apps, schema_editor):
+    """
+    Events pinned to a bare season name were scored with its CSV as it is
+    now, pin them to that content so later edits leave them alone
+    """
+    Event = apps.get_model("tests", "Event")
+    seasons = (
+        Event.objects.exclude(score_table_version__in=["", BUILTIN_VERSION])
+        .values_list("score_table_version", flat=True)
+        .distinct()
+    )
+    for season in seasons:
+        path = settings.SCORE_TABLE_DIR / f"{season}.csv"
+        if HASHED_VERSION.match(season) or not path.exists():
+            continue
+        version = compile_season(path, settings.SCORE_TABLE_CACHE_DIR)
+        Event.objects.filter(score_table_version=season).update(
+            score_table_version=version
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0012_testresult_person_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(pin_hashed_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0014_job_heartbeat_at_attempts"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="testresult",
+            name="age_at_test",
+            field=models.SmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
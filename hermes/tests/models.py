@@ -1,6 +1,36 @@
 from django.db import models
 from datetime import date
 
+from .score_table_registry import current_score_table_version
+
+
+def age_on(date_of_birth, day):
+    """Age in whole years of someone born on ``date_of_birth`` on ``day``"""
+    return (
+        day.year
+        - date_of_birth.year
+        - ((day.month, day.day) < (date_of_birth.month, date_of_birth.day))
+    )
+
+
+def score_inputs_changed(instance, fields):
+    """Whether any of ``fields`` differs from the value loaded from the database"""
+    loaded = getattr(instance, "_loaded_values", {})
+    return any(
+        field in loaded and loaded[field] != getattr(instance, field)
+        for field in fields
+    )
+
+
+def mark_scores_dirty(test_results):
+    """
+    Flag results whose person's score inputs changed, bumping their
+    person_version so that a running staged recalculation leaves them out
+    """
+    test_results.update(
+        scores_dirty=True, person_version=models.F("person_version") + 1
+    )
+
 
 class Team(models.Model):
     name = models.CharField(max_length=100)
@@ -20,6 +50,10 @@ class Event(models.Model):
     created_by = models.ForeignKey(
         "auth.User", on_delete=models.SET_NULL, null=True, related_name="created_events"
     )
+    # Score tables the event's results are scored with, see score_table_registry
+    score_table_version = models.CharField(
+        max_length=100, default=current_score_table_version
+    )
 
     def __str__(self):
         return f"{self.name} ({'Active' if self.is_active else 'Inactive'})"
@@ -51,19 +85,28 @@ class Person(models.Model):
     gender_required = models.BooleanField(default=False)
     date_of_birth_required = models.BooleanField(default=False)
 
+    # Fields the scores of the person's results are calculated from
+    SCORE_INPUT_FIELDS = ("date_of_birth", "gender", "height")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        changed = not self._state.adding and score_inputs_changed(
+            self, self.SCORE_INPUT_FIELDS
+        )
+        super().save(*args, **kwargs)
+        if changed:
+            mark_scores_dirty(self.testresult_set.all())
+
     @property
     def age(self):
         if not self.date_of_birth:
             return None
-        today = date.today()
-        return (
-            today.year
-            - self.date_of_birth.year
-            - (
-                (today.month, today.day)
-                < (self.date_of_birth.month, self.date_of_birth.day)
-            )
-        )
+        return age_on(self.date_of_birth, date.today())
 
     def get_ladder_times(self):
         test_result = self.get_latest_test_result()
@@ -160,6 +203,17 @@ class Person(models.Model):
             return latest_measurement.height
         return self.height
 
+    def height_on(self, day):
+        """Height of the latest measurement on or before ``day``, fallback to the base height"""
+        measurement = (
+            self.measurements.filter(measurement_date__lte=day)
+            .order_by("-measurement_date")
+            .first()
+        )
+        if measurement:
+            return measurement.height
+        return self.height
+
     @property
     def latest_weight(self):
         """Get the latest weight from measurements, fallback to person's base weight"""
@@ -195,6 +249,15 @@ class PersonMeasurement(models.Model):
     def __str__(self):
         return f"{self.person.full_name} - {self.measurement_date} (H: {self.height}cm, W: {self.weight}kg)"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The latest height is the Y test's height
+        mark_scores_dirty(TestResult.objects.filter(person_id=self.person_id))
+
+    def delete(self, *args, **kwargs):
+        mark_scores_dirty(TestResult.objects.filter(person_id=self.person_id))
+        return super().delete(*args, **kwargs)
+
 
 class TestResult(models.Model):
     person = models.ForeignKey(Person, on_delete=models.CASCADE)
@@ -265,11 +328,108 @@ class TestResult(models.Model):
     beep_test_number = models.IntegerField(null=True, blank=True)
     max_hr = models.IntegerField(null=True, blank=True)
 
+    # Set when a score input changed since the last recalculation, see
+    # recalculate_scores.stale_test_results
+    scores_dirty = models.BooleanField(default=True, db_index=True)
+    # Bumped with every change of the person's birth date, gender or
+    # measurements, see mark_scores_dirty
+    person_version = models.PositiveIntegerField(default=0)
+    # Version of the score tables the scores were last recalculated with
+    scored_table_version = models.CharField(max_length=100, blank=True)
+    # The person's age and height on the test date the scores are calculated
+    # with, see update_person_snapshot
+    age_at_test = models.SmallIntegerField(null=True, blank=True, db_index=True)
+    height_at_test = models.FloatField(null=True, blank=True)
+
+    # Raw values the scores are calculated from
+    SCORE_INPUT_FIELDS = (
+        "person_id",
+        "event_id",
+        # The age and height are taken on the test date
+        "test_date",
+        "ladder_time_1",
+        "ladder_time_2",
+        "hexagon_time_cw",
+        "hexagon_time_ccw",
+        "y_test_ll_front",
+        "y_test_ll_left",
+        "y_test_ll_right",
+        "y_test_rl_front",
+        "y_test_rl_right",
+        "y_test_rl_left",
+        "y_test_la_left",
+        "y_test_la_front",
+        "y_test_la_back",
+        "y_test_ra_right",
+        "y_test_ra_front",
+        "y_test_ra_back",
+        "brace_time_1",
+        "brace_time_2",
+        "medicimbal_throw_1",
+        "medicimbal_throw_2",
+        "medicimbal_throw_3",
+        "jet_laps",
+        "jet_sides",
+        "triple_jump_distance_1",
+        "triple_jump_distance_2",
+        "triple_jump_distance_3",
+        "beep_test_level",
+        "beep_test_laps",
+    )
+
     def __str__(self):
         return f"{self.person.surname} {self.person.name} - {self._meta.model_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
+        if self._state.adding or score_inputs_changed(self, self.SCORE_INPUT_FIELDS):
+            self.scores_dirty = True
+            # Unless it was just taken to score with, see get_or_create_test_result
+            if self.__dict__.pop("_snapshot_of", None) != self.snapshot_key():
+                self.update_person_snapshot()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {
+                    *kwargs["update_fields"],
+                    "scores_dirty",
+                    "age_at_test",
+                    "height_at_test",
+                }
         # Calculate composite scores before saving
+        self.update_composite_scores()
+        super().save(*args, **kwargs)
+
+    def update_person_snapshot(self, measurements=None):
+        """
+        Store the person's age and height on the test date.
+
+        ``measurements`` are the person's ``(measurement_date, height)``
+        pairs sorted by date, they are queried when not given.
+        """
+        test_date = self.test_date or date.today()
+        person = self.person
+        self._snapshot_of = self.snapshot_key()
+        self.age_at_test = (
+            age_on(person.date_of_birth, test_date) if person.date_of_birth else None
+        )
+        if measurements is None:
+            self.height_at_test = person.height_on(test_date)
+            return
+        self.height_at_test = person.height
+        for measurement_date, height in measurements:
+            if measurement_date > test_date:
+                break
+            self.height_at_test = height
+
+    def snapshot_key(self):
+        """The person and test date the snapshot depends on"""
+        return self.person_id, self.test_date or date.today()
+
+    def update_composite_scores(self):
         if self.medicimbal_score is not None and self.triple_jump_score is not None:
             self.strength_score = (self.medicimbal_score + self.triple_jump_score) / 2
         if self.ladder_score is not None and self.hexagon_score is not None:
@@ -278,4 +438,50 @@ class TestResult(models.Model):
             self.endurance_score = (self.beep_test_score + self.jet_score) / 2
         if self.brace_score is not None and self.y_test_score is not None:
             self.agility_score = (self.brace_score + self.y_test_score) / 2
-        super().save(*args, **kwargs)
+
+
+class Job(models.Model):
+    """Long running work queued for run_hermes_worker, see jobs.py"""
+
+    RECALCULATE_SCORES = "recalculate_scores"
+    PDF_REPORT = "pdf_report"
+    KIND_CHOICES = [
+        (RECALCULATE_SCORES, "Recalculate scores"),
+        (PDF_REPORT, "PDF report"),
+    ]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    # Share of the work done, from 0 to 1
+    progress = models.FloatField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    # Generated file of report jobs
+    output = models.BinaryField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(
+        "auth.User", on_delete=models.CASCADE, related_name="jobs"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Kept fresh by the worker running the job, see jobs.claim_next_job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.status})"
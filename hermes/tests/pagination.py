@@ -0,0 +1,117 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, List
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from ninja import Field, Schema
+from ninja.errors import HttpError
+from ninja.pagination import PaginationBase
+
+# Items per page when the client does not pass a limit, and the most it may ask for
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(values):
+    """Opaque cursor for the ordering values of the last item of a page"""
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, ordering, model):
+    """
+    Ordering values of a cursor, converted to the types of the ``ordering``
+    fields of ``model``. A cursor that isn't one answers 400.
+    """
+    try:
+        data = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except ValueError:
+        raise HttpError(400, "Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise HttpError(400, "Invalid cursor")
+    try:
+        values = [
+            ordering_field(model, field).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (ValidationError, ValueError, TypeError):
+        raise HttpError(400, "Invalid cursor")
+    # after_cursor can't compare with NULL
+    if None in values:
+        raise HttpError(400, "Invalid cursor")
+    return values
+
+
+def ordering_field(model, field):
+    """Model field of an ordering field such as ``-person__surname``"""
+    *relations, name = field.lstrip("-").split(LOOKUP_SEP)
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def after_cursor(ordering, values):
+    """
+    Filter for the rows after ``values`` in ``ordering``, compared as a
+    tuple: the first field past its value, or equal to it and the next one
+    past its value, and so on.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPagination(PaginationBase):
+    """
+    Cursor pagination over a stable ordering, ``@paginate(KeysetPagination)``.
+
+    Pages are found by filtering on the ordering values of the previous
+    page's last item instead of an OFFSET, so every page costs the same
+    index range scan however deep it is, and rows inserted meanwhile never
+    shift a page. The last ``ordering`` field must be unique (``id`` by
+    default). The response is ``{"items": [...], "next": <url or null>}``.
+    """
+
+    class Input(Schema):
+        cursor: str | None = None
+        limit: int = Field(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT)
+
+    class Output(Schema):
+        items: List[Any]
+        next: str | None
+
+    def __init__(self, *, ordering=("id",), **kwargs):
+        self.ordering = ordering
+        super().__init__(**kwargs)
+
+    def paginate_queryset(self, queryset, pagination, request, **params):
+        queryset = queryset.order_by(*self.ordering)
+        if pagination.cursor:
+            values = decode_cursor(pagination.cursor, self.ordering, queryset.model)
+            queryset = queryset.filter(after_cursor(self.ordering, values))
+
+        # One row past the page tells whether there is a next one
+        items = list(queryset[: pagination.limit + 1])
+        next_url = None
+        if len(items) > pagination.limit:
+            items = items[: pagination.limit]
+            query = request.GET.copy()
+            query["cursor"] = encode_cursor(
+                [self._value(items[-1], field) for field in self.ordering]
+            )
+            next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+        return {"items": items, "next": next_url}
+
+    @staticmethod
+    def _value(item, field):
+        name = field.lstrip("-")
+        return item[name] if isinstance(item, dict) else getattr(item, name)
@@ -17,9 +17,9 @@ from PIL import Image as PILImage
 from .models import TestResult
 
 
-def get_best_test_scores(person, active_test, team):
+def get_best_test_scores(person, event, team):
     test_results = TestResult.objects.filter(
-        person=person, active_test=active_test, team=team
+        person=person, event=event, team=team
     )
     if not test_results:
         return None
@@ -111,12 +111,12 @@ def generate_test_results_pdf(test_results, output, adjudicator):
         ],
     ]
 
-    # Get unique people and active test from filtered test results
+    # Get unique people and the event from filtered test results
     people = {result.person for result in test_results}
-    active_test = test_results[0].active_test if test_results else None
+    event = test_results[0].event if test_results else None
 
     for person in people:
-        best_scores = get_best_test_scores(person, active_test, person.team)
+        best_scores = get_best_test_scores(person, event, person.team)
         if best_scores:
             best_results_data.append(
                 [
@@ -198,7 +198,7 @@ def generate_test_results_pdf(test_results, output, adjudicator):
         last_three_results = list(
             TestResult.objects.filter(
                 person=test_result.person,
-                active_test=test_result.active_test,
+                event=test_result.event,
                 team=test_result.team,
             ).order_by("-test_date")[:3]
         )
@@ -1,227 +1,513 @@
-from .models import TestResult
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Q
+
+from . import score_tables
+from .models import Event, PersonMeasurement, TestResult
+from .score_table_registry import (
+    BUILTIN_VERSION,
+    engine_for_event,
+    get_score_engine,
+)
 from .score_tables import (
     calculate_beep_test_total_laps,
     calculate_score,
     calculate_y_test_index,
 )
+from .statistics import invalidate_all_statistics
 
 
 from django.contrib import messages
 from django.shortcuts import redirect
 
+# Results loaded, scored and written back per round trip
+CHUNK_SIZE = 1000
+
+# Temporary table recalculate_test_results_staged collects the new scores in
+STAGING_TABLE = "recalculated_test_results"
+
+# Columns a recalculation writes, everything else is left untouched
+RECALCULATED_FIELDS = [
+    "ladder_score",
+    "brace_score",
+    "hexagon_score",
+    "medicimbal_score",
+    "jet_score",
+    "jet_distance",
+    "y_test_score",
+    "y_test_index",
+    "beep_test_score",
+    "beep_test_total_laps",
+    "triple_jump_score",
+    "strength_score",
+    "speed_score",
+    "endurance_score",
+    "agility_score",
+    "scores_dirty",
+    "scored_table_version",
+    "age_at_test",
+    "height_at_test",
+]
+
+Y_TEST_FIELDS = [
+    "y_test_ll_front",
+    "y_test_ll_left",
+    "y_test_ll_right",
+    "y_test_rl_front",
+    "y_test_rl_right",
+    "y_test_rl_left",
+    "y_test_la_left",
+    "y_test_la_front",
+    "y_test_la_back",
+    "y_test_ra_right",
+    "y_test_ra_front",
+    "y_test_ra_back",
+]
+
 
-def recalculate_scores(user):
+def recalculate_scores(
+    user, full=False, progress=None, staged=False, in_database=False
+):
     # Get all TestResult objects for the user's team
     user_teams = user.teams.all()
     test_results = TestResult.objects.filter(person__team__in=user_teams)
+    if not full:
+        test_results = stale_test_results(test_results)
+    if in_database:
+        # Imported here, score_table_sql imports this module
+        from .score_table_sql import rescore_in_database
 
-    # Recalculate scores for each test result
-    for test_result in test_results:
-        # Recalculate ladder score
-        if test_result.ladder_time_1 and test_result.ladder_time_2:
-            age = test_result.person.age
-            gender = test_result.person.gender
-            time_1 = test_result.ladder_time_1
-            time_2 = test_result.ladder_time_2
-            if age is not None and gender is not None:
-                test_result.ladder_score = calculate_score(
-                    age, gender, "ladder", time_1, time_2
-                )
-            else:
-                test_result.ladder_score = 0
-
-        # Recalculate brace score
-        if test_result.brace_time_1 and test_result.brace_time_2:
-            age = test_result.person.age
-            gender = test_result.person.gender
-            time_1 = test_result.brace_time_1
-            time_2 = test_result.brace_time_2
-            if age is not None and gender is not None:
-                test_result.brace_score = calculate_score(
-                    age, gender, "brace", time_1, time_2
-                )
-            else:
-                test_result.brace_score = 0
-
-        # Recalculate hexagon score
-        if test_result.hexagon_time_cw and test_result.hexagon_time_ccw:
-            age = test_result.person.age
-            gender = test_result.person.gender
-            time_cw = test_result.hexagon_time_cw
-            time_ccw = test_result.hexagon_time_ccw
-            if age is not None and gender is not None:
-                test_result.hexagon_score = calculate_score(
-                    age, gender, "hexagon", time_cw, time_ccw
-                )
-            else:
-                test_result.hexagon_score = 0
-
-        # Recalculate medicimbal score
-        if (
-            test_result.medicimbal_throw_1
-            and test_result.medicimbal_throw_2
-            and test_result.medicimbal_throw_3
-        ):
-            age = test_result.person.age
-            gender = test_result.person.gender
-            throw_1 = test_result.medicimbal_throw_1
-            throw_2 = test_result.medicimbal_throw_2
-            throw_3 = test_result.medicimbal_throw_3
-            if age is not None and gender is not None:
-                test_result.medicimbal_score = calculate_score(
-                    age, gender, "medicimbal", throw_1, throw_2, throw_3
-                )
-            else:
-                test_result.medicimbal_score = 0
-
-        # Recalculate jet score
-        if test_result.jet_laps and test_result.jet_sides:
-            age = test_result.person.age
-            gender = test_result.person.gender
-            laps = test_result.jet_laps
-            sides = test_result.jet_sides
-            jet_distance = laps * 40 + sides * 10
-            if age is not None and gender is not None:
-                test_result.jet_score = calculate_score(age, gender, "jet", jet_distance)
-            else:
-                test_result.jet_score = 0
-            test_result.jet_distance = jet_distance
-
-        # Recalculate y-test score and index
-        if (
-            test_result.y_test_ll_front
-            and test_result.y_test_ll_left
-            and test_result.y_test_ll_right
-            and test_result.y_test_rl_front
-            and test_result.y_test_rl_right
-            and test_result.y_test_rl_left
-            and test_result.y_test_la_left
-            and test_result.y_test_la_front
-            and test_result.y_test_la_back
-            and test_result.y_test_ra_right
-            and test_result.y_test_ra_front
-            and test_result.y_test_ra_back
-        ):
-            age = test_result.person.age
-            gender = test_result.person.gender
-            height = test_result.person.latest_height
-            ll_front = test_result.y_test_ll_front
-            ll_left = test_result.y_test_ll_left
-            ll_right = test_result.y_test_ll_right
-            rl_front = test_result.y_test_rl_front
-            rl_right = test_result.y_test_rl_right
-            rl_left = test_result.y_test_rl_left
-            la_left = test_result.y_test_la_left
-            la_front = test_result.y_test_la_front
-            la_back = test_result.y_test_la_back
-            ra_right = test_result.y_test_ra_right
-            ra_front = test_result.y_test_ra_front
-            ra_back = test_result.y_test_ra_back
-
-            if age is not None and gender is not None and height is not None:
-                test_result.y_test_score = calculate_score(
-                    age,
-                    gender,
-                    "y_test",
-                    height,
-                    ll_front,
-                    ll_left,
-                    ll_right,
-                    rl_front,
-                    rl_right,
-                    rl_left,
-                    la_left,
-                    la_front,
-                    la_back,
-                    ra_right,
-                    ra_front,
-                    ra_back,
-                )
-                test_result.y_test_index = calculate_y_test_index(
-                    height,
-                    ll_front,
-                    ll_left,
-                    ll_right,
-                    rl_front,
-                    rl_right,
-                    rl_left,
-                    la_left,
-                    la_front,
-                    la_back,
-                    ra_right,
-                    ra_front,
-                    ra_back,
-                )
-            else:
-                test_result.y_test_score = 0
-                test_result.y_test_index = 0
-
-        # Recalculate beep test score
-        if test_result.beep_test_laps and test_result.beep_test_level:
-            age = test_result.person.age
-            gender = test_result.person.gender
-            laps = test_result.beep_test_laps
-            level = test_result.beep_test_level
-            total_laps = calculate_beep_test_total_laps(level, laps)
-            if age is not None and gender is not None:
-                test_result.beep_test_score = calculate_score(
-                    age, gender, "beep_test", total_laps
+        return rescore_in_database(test_results)
+    if staged:
+        return recalculate_test_results_staged(test_results, progress=progress)
+    return recalculate_test_results(test_results, progress=progress)
+
+
+def recalculate_scores_parallel(user, workers=None, shard_by="team", full=False):
+    """
+    Recalculate the scores of the user's teams in a pool of worker processes.
+
+    The results are split into one shard per team (``shard_by="team"``) or
+    per event (``shard_by="event"``, results without an event form one
+    more shard). Every worker opens its own database connection and commits
+    each shard in its own transaction. Returns ``{"updated": <total>,
+    "shards": [{<shard filter>, "updated": <count>}, ...]}``.
+    """
+    team_ids = list(user.teams.values_list("id", flat=True))
+    if shard_by == "team":
+        shards = [{"person__team_id": team_id} for team_id in team_ids]
+    elif shard_by == "event":
+        event_ids = (
+            TestResult.objects.filter(person__team_id__in=team_ids)
+            .values_list("event_id", flat=True)
+            .distinct()
+        )
+        shards = [{"event_id": event_id} for event_id in event_ids]
+    else:
+        raise ValueError(f"Unknown shard_by '{shard_by}'")
+
+    workers = min(workers or settings.RECALCULATION_WORKERS, len(shards))
+    if workers <= 1:
+        counts = [_recalculate_shard(team_ids, shard, full) for shard in shards]
+    else:
+        # Forked workers must not inherit the open connection, each one
+        # connects on its own
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+            counts = list(
+                executor.map(
+                    _recalculate_shard,
+                    [team_ids] * len(shards),
+                    shards,
+                    [full] * len(shards),
                 )
-            else:
-                test_result.beep_test_score = 0
-            test_result.beep_test_total_laps = total_laps
-
-        # Recalculate triple jump score
-        if (
-            test_result.triple_jump_distance_1
-            and test_result.triple_jump_distance_2
-            and test_result.triple_jump_distance_3
-        ):
-            age = test_result.person.age
-            gender = test_result.person.gender
-            jump_1 = test_result.triple_jump_distance_1
-            jump_2 = test_result.triple_jump_distance_2
-            jump_3 = test_result.triple_jump_distance_3
-            if age is not None and gender is not None:
-                test_result.triple_jump_score = calculate_score(
-                    age, gender, "triple_jump", jump_1, jump_2, jump_3
+            )
+
+    return {
+        "updated": sum(counts),
+        "shards": [{**shard, "updated": count} for shard, count in zip(shards, counts)],
+    }
+
+
+def _init_worker():
+    # Spawned workers (the default outside Linux) start with Django unconfigured
+    django.setup()
+
+
+def _recalculate_shard(team_ids, shard, full):
+    test_results = TestResult.objects.filter(person__team_id__in=team_ids, **shard)
+    if not full:
+        test_results = stale_test_results(test_results)
+    with transaction.atomic():
+        return recalculate_test_results(test_results)
+
+
+def stale_test_results(test_results):
+    """
+    Narrow a TestResult queryset to the results whose scores may be out of date.
+
+    That is results marked ``scores_dirty`` (a trial value, the person's birth
+    date, gender or height changed, see the models' ``save``) and results last
+    scored with other tables than their event is pinned to, which also catches
+    an edited season CSV as its content hash is part of the version.
+    """
+    default_version = score_tables.score_engine.version
+    stale = Q(scores_dirty=True) | (
+        Q(event__isnull=True) & ~Q(scored_table_version=default_version)
+    )
+    versions = (
+        Event.objects.filter(pk__in=test_results.values("event_id"))
+        .values_list("score_table_version", flat=True)
+        .distinct()
+    )
+    for version in versions:
+        stale |= Q(event__score_table_version=version) & ~Q(
+            scored_table_version=get_score_engine(version or BUILTIN_VERSION).version
+        )
+    return test_results.filter(stale)
+
+
+def recalculate_test_results(test_results, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Recalculate the scores of a TestResult queryset.
+
+    Results are streamed in primary key order, ``chunk_size`` at a time, with
+    the person and event joined and the measured heights of the chunk's people
+    fetched in one query. Each chunk is scored in memory and written back with
+    a single ``bulk_update`` of the ``RECALCULATED_FIELDS``, so a chunk costs
+    three queries however many results it holds. Only results whose scores
+    or flags actually changed are written, their number is returned.
+
+    ``progress`` is called with the number of results processed so far and
+    their total after every chunk.
+    """
+    test_results = test_results.select_related("person", "event").order_by("pk")
+    total = test_results.count() if progress else None
+    processed = 0
+    updated = 0
+    last_pk = 0
+    while True:
+        chunk = list(test_results.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return updated
+
+        updated += recalculate_chunk(chunk)
+        last_pk = chunk[-1].pk
+        processed += len(chunk)
+        if progress:
+            progress(processed, total)
+
+
+def recalculate_chunk(chunk):
+    """
+    Score a list of results (with their person and event loaded) in memory
+    and write the changed ones back in one query, returns how many changed.
+    """
+    changed = score_chunk(chunk)
+    if changed:
+        TestResult.objects.bulk_update(
+            changed, RECALCULATED_FIELDS, batch_size=len(chunk)
+        )
+        invalidate_all_statistics()
+    return len(changed)
+
+
+def score_chunk(chunk):
+    """Score a list of results in memory and return the ones that changed"""
+    histories = measurement_histories({test_result.person_id for test_result in chunk})
+    changed = []
+    for test_result in chunk:
+        before = [getattr(test_result, field) for field in RECALCULATED_FIELDS]
+        test_result.update_person_snapshot(histories[test_result.person_id])
+        recalculate_test_result(test_result)
+        if [getattr(test_result, field) for field in RECALCULATED_FIELDS] != before:
+            changed.append(test_result)
+    return changed
+
+
+def recalculate_test_results_staged(test_results, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Recalculate like ``recalculate_test_results`` without holding row locks.
+
+    New scores are collected chunk by chunk in a temporary staging table
+    keyed by result id and applied at the end with a single ``UPDATE ...
+    FROM`` in one short transaction, so readers see either all old or all
+    new scores and live submissions never wait on the recalculation. A
+    result whose trial values or person changed while the recalculation ran
+    is left out of the swap, it stays dirty for the next run. Returns the
+    number of results updated.
+    """
+    opts = TestResult._meta
+    quote = connection.ops.quote_name
+    staged = ["id", *RECALCULATED_FIELDS]
+    # The result's own inputs and the version of its person's, see
+    # mark_scores_dirty
+    input_fields = [*TestResult.SCORE_INPUT_FIELDS, "person_version"]
+    inputs = [opts.get_field(field).column for field in input_fields]
+    staging_table = quote(STAGING_TABLE)
+    result_table = quote(opts.db_table)
+
+    test_results = test_results.select_related("person", "event").order_by("pk")
+    total = test_results.count() if progress else None
+    processed = 0
+    last_pk = 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging_table} AS "
+            f"SELECT {', '.join(map(quote, staged + inputs))} "
+            f"FROM {result_table} WITH NO DATA"
+        )
+        try:
+            while True:
+                chunk = list(test_results.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    break
+                # Scored before the COPY starts, the connection can't run the
+                # height queries while it is copying
+                changed = score_chunk(chunk)
+                with cursor.copy(
+                    f"COPY {staging_table} "
+                    f"({', '.join(map(quote, staged + inputs))}) FROM STDIN"
+                ) as copy:
+                    for test_result in changed:
+                        copy.write_row(
+                            [getattr(test_result, field) for field in staged]
+                            + [getattr(test_result, field) for field in input_fields]
+                        )
+                last_pk = chunk[-1].pk
+                processed += len(chunk)
+                if progress:
+                    progress(processed, total)
+
+            assignments = ", ".join(
+                f"{quote(column)} = staged.{quote(column)}"
+                for column in RECALCULATED_FIELDS
+            )
+            unchanged = " AND ".join(
+                f"result.{quote(column)} IS NOT DISTINCT FROM staged.{quote(column)}"
+                for column in inputs
+            )
+            with transaction.atomic():
+                cursor.execute(
+                    f"UPDATE {result_table} AS result SET {assignments} "
+                    f"FROM {staging_table} AS staged "
+                    f"WHERE result.id = staged.id AND {unchanged}"
                 )
-            else:
-                test_result.triple_jump_score = 0
-
-        # Calculate composite scores
-        # Strength score
-        if (
-            test_result.medicimbal_score is not None
-            and test_result.triple_jump_score is not None
-        ):
-            test_result.strength_score = (
-                test_result.medicimbal_score + test_result.triple_jump_score
-            ) / 2
-
-        # Speed score
-        if (
-            test_result.ladder_score is not None
-            and test_result.hexagon_score is not None
-        ):
-            test_result.speed_score = (
-                test_result.ladder_score + test_result.hexagon_score
-            ) / 2
-
-        # Endurance score
-        if (
-            test_result.beep_test_score is not None
-            and test_result.jet_score is not None
-        ):
-            test_result.endurance_score = (
-                test_result.beep_test_score + test_result.jet_score
-            ) / 2
-
-        # Agility score
-        if test_result.brace_score is not None and test_result.y_test_score is not None:
-            test_result.agility_score = (
-                test_result.brace_score + test_result.y_test_score
-            ) / 2
-
-        test_result.save()
+                invalidate_all_statistics()
+                return cursor.rowcount
+        finally:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+
+
+def measurement_histories(person_ids):
+    """Map person ids to their ``(measurement_date, height)`` pairs in date order"""
+    histories = defaultdict(list)
+    measurements = (
+        PersonMeasurement.objects.filter(person_id__in=person_ids)
+        .order_by("person_id", "measurement_date")
+        .values_list("person_id", "measurement_date", "height")
+    )
+    for person_id, measurement_date, height in measurements:
+        histories[person_id].append((measurement_date, height))
+    return histories
+
+
+def recalculate_test_result(test_result):
+    """
+    Score a result in memory with the person's age and height on the test
+    date, see TestResult.update_person_snapshot
+    """
+    # Recalculate ladder score
+    if test_result.ladder_time_1 and test_result.ladder_time_2:
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        time_1 = test_result.ladder_time_1
+        time_2 = test_result.ladder_time_2
+        if age is not None and gender is not None:
+            test_result.ladder_score = calculate_score(
+                age, gender, "ladder", time_1, time_2, event=test_result.event
+            )
+        else:
+            test_result.ladder_score = 0
+
+    # Recalculate brace score
+    if test_result.brace_time_1 and test_result.brace_time_2:
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        time_1 = test_result.brace_time_1
+        time_2 = test_result.brace_time_2
+        if age is not None and gender is not None:
+            test_result.brace_score = calculate_score(
+                age, gender, "brace", time_1, time_2, event=test_result.event
+            )
+        else:
+            test_result.brace_score = 0
+
+    # Recalculate hexagon score
+    if test_result.hexagon_time_cw and test_result.hexagon_time_ccw:
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        time_cw = test_result.hexagon_time_cw
+        time_ccw = test_result.hexagon_time_ccw
+        if age is not None and gender is not None:
+            test_result.hexagon_score = calculate_score(
+                age, gender, "hexagon", time_cw, time_ccw, event=test_result.event
+            )
+        else:
+            test_result.hexagon_score = 0
+
+    # Recalculate medicimbal score
+    if (
+        test_result.medicimbal_throw_1
+        and test_result.medicimbal_throw_2
+        and test_result.medicimbal_throw_3
+    ):
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        throw_1 = test_result.medicimbal_throw_1
+        throw_2 = test_result.medicimbal_throw_2
+        throw_3 = test_result.medicimbal_throw_3
+        if age is not None and gender is not None:
+            test_result.medicimbal_score = calculate_score(
+                age,
+                gender,
+                "medicimbal",
+                throw_1,
+                throw_2,
+                throw_3,
+                event=test_result.event,
+            )
+        else:
+            test_result.medicimbal_score = 0
+
+    # Recalculate jet score
+    if test_result.jet_laps and test_result.jet_sides:
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        laps = test_result.jet_laps
+        sides = test_result.jet_sides
+        jet_distance = laps * 40 + sides * 10
+        if age is not None and gender is not None:
+            test_result.jet_score = calculate_score(
+                age, gender, "jet", jet_distance, event=test_result.event
+            )
+        else:
+            test_result.jet_score = 0
+        test_result.jet_distance = jet_distance
+
+    # Recalculate y-test score and index
+    if (
+        test_result.y_test_ll_front
+        and test_result.y_test_ll_left
+        and test_result.y_test_ll_right
+        and test_result.y_test_rl_front
+        and test_result.y_test_rl_right
+        and test_result.y_test_rl_left
+        and test_result.y_test_la_left
+        and test_result.y_test_la_front
+        and test_result.y_test_la_back
+        and test_result.y_test_ra_right
+        and test_result.y_test_ra_front
+        and test_result.y_test_ra_back
+    ):
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        ll_front = test_result.y_test_ll_front
+        ll_left = test_result.y_test_ll_left
+        ll_right = test_result.y_test_ll_right
+        rl_front = test_result.y_test_rl_front
+        rl_right = test_result.y_test_rl_right
+        rl_left = test_result.y_test_rl_left
+        la_left = test_result.y_test_la_left
+        la_front = test_result.y_test_la_front
+        la_back = test_result.y_test_la_back
+        ra_right = test_result.y_test_ra_right
+        ra_front = test_result.y_test_ra_front
+        ra_back = test_result.y_test_ra_back
+        height = test_result.height_at_test
+
+        if age is not None and gender is not None and height is not None:
+            test_result.y_test_score = calculate_score(
+                age,
+                gender,
+                "y_test",
+                height,
+                ll_front,
+                ll_left,
+                ll_right,
+                rl_front,
+                rl_right,
+                rl_left,
+                la_left,
+                la_front,
+                la_back,
+                ra_right,
+                ra_front,
+                ra_back,
+                event=test_result.event,
+            )
+            test_result.y_test_index = calculate_y_test_index(
+                height,
+                ll_front,
+                ll_left,
+                ll_right,
+                rl_front,
+                rl_right,
+                rl_left,
+                la_left,
+                la_front,
+                la_back,
+                ra_right,
+                ra_front,
+                ra_back,
+            )
+        else:
+            test_result.y_test_score = 0
+            test_result.y_test_index = 0
+
+    # Recalculate beep test score
+    if test_result.beep_test_laps and test_result.beep_test_level:
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        laps = test_result.beep_test_laps
+        level = test_result.beep_test_level
+        total_laps = calculate_beep_test_total_laps(level, laps)
+        if age is not None and gender is not None:
+            test_result.beep_test_score = calculate_score(
+                age, gender, "beep_test", total_laps, event=test_result.event
+            )
+        else:
+            test_result.beep_test_score = 0
+        test_result.beep_test_total_laps = total_laps
+
+    # Recalculate triple jump score
+    if (
+        test_result.triple_jump_distance_1
+        and test_result.triple_jump_distance_2
+        and test_result.triple_jump_distance_3
+    ):
+        age = test_result.age_at_test
+        gender = test_result.person.gender
+        jump_1 = test_result.triple_jump_distance_1
+        jump_2 = test_result.triple_jump_distance_2
+        jump_3 = test_result.triple_jump_distance_3
+        if age is not None and gender is not None:
+            test_result.triple_jump_score = calculate_score(
+                age,
+                gender,
+                "triple_jump",
+                jump_1,
+                jump_2,
+                jump_3,
+                event=test_result.event,
+            )
+        else:
+            test_result.triple_jump_score = 0
 
+    test_result.update_composite_scores()
+    test_result.scores_dirty = False
+    test_result.scored_table_version = engine_for_event(test_result.event).version
@@ -0,0 +1,23 @@
+import orjson
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Renders responses with orjson, several times faster than the json module
+    on large lists. Types orjson does not know (Decimal, pydantic URLs, ...)
+    fall back to django-ninja's own encoder.
+
+    Dates and times are passed to that encoder too: it writes UTC as "Z"
+    and cuts microseconds to milliseconds, which orjson has no options for.
+    """
+
+    media_type = "application/json"
+
+    def render(self, request, data, *, response_status):
+        return orjson.dumps(
+            data,
+            default=NinjaJSONEncoder().default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
@@ -0,0 +1,380 @@
+"""
+Saving the results of many people at once, see /results/batch and
+/beep-test/batch.
+
+A batch is loaded with a fixed number of queries whatever its size: the
+people, the active event of their teams, the results already saved for
+those events and the people's measurements. It is scored with score_batch,
+one array per test and score table version, and written with a single
+bulk_create and bulk_update in one transaction. Every item still gets its
+own outcome, an item that can't be saved doesn't stop the others.
+"""
+
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Event, Person, TestResult, score_inputs_changed
+from .recalculate_scores import Y_TEST_FIELDS, measurement_histories
+from .score_table_registry import engine_for_event
+from .score_tables import (
+    GENDERS,
+    calculate_beep_test_total_laps,
+    calculate_y_test_index_batch,
+)
+from .statistics import invalidate_team_statistics
+
+# Raw values an item of each test submits
+TEST_FIELDS = {
+    "ladder": ["ladder_time_1", "ladder_time_2"],
+    "brace": ["brace_time_1", "brace_time_2"],
+    "hexagon": ["hexagon_time_cw", "hexagon_time_ccw"],
+    "medicimbal": ["medicimbal_throw_1", "medicimbal_throw_2", "medicimbal_throw_3"],
+    "triple_jump": [
+        "triple_jump_distance_1",
+        "triple_jump_distance_2",
+        "triple_jump_distance_3",
+    ],
+    "jet": ["jet_laps", "jet_sides"],
+    "y_test": Y_TEST_FIELDS,
+    "beep_test": ["beep_test_level", "beep_test_laps", "beep_test_number", "max_hr"],
+}
+
+# Columns computed from them
+COMPUTED_FIELDS = {
+    "jet": ["jet_distance"],
+    "y_test": ["y_test_index"],
+    "beep_test": ["beep_test_total_laps"],
+}
+
+# Error of values that can't be scored, as the single test endpoints word it
+OUT_OF_RANGE = "Invalid {} - they must be within valid ranges for the athlete's age"
+INVALID_VALUES = {
+    "ladder": OUT_OF_RANGE.format("times"),
+    "brace": OUT_OF_RANGE.format("times"),
+    "hexagon": OUT_OF_RANGE.format("times"),
+    "medicimbal": OUT_OF_RANGE.format("throws"),
+    "triple_jump": OUT_OF_RANGE.format("jump distances"),
+    "jet": "Invalid jet test values - check input data",
+    "y_test": "Invalid Y test values - check input data",
+    "beep_test": "Invalid beep test values - check input data",
+}
+
+INTEGER_FIELDS = {
+    field.name
+    for field in TestResult._meta.fields
+    if field.get_internal_type() == "IntegerField"
+}
+
+COMPOSITE_FIELDS = ["strength_score", "speed_score", "endurance_score", "agility_score"]
+
+# Columns a batch sets on the results besides the tests' own
+BATCH_FIELDS = [
+    "test_name",
+    "test_date",
+    "team",
+    "scores_dirty",
+    "age_at_test",
+    "height_at_test",
+    *COMPOSITE_FIELDS,
+]
+
+
+def active_events(team_ids):
+    """
+    First active event of each team, by team id, in one query. People
+    without a team get the active event without one (key None).
+    """
+    condition = Q(team_id__in={team_id for team_id in team_ids if team_id})
+    if None in team_ids:
+        condition |= Q(team__isnull=True)
+    events = {}
+    for event in (
+        Event.objects.filter(condition, is_active=True)
+        .select_related("team")
+        .order_by("pk")
+    ):
+        events.setdefault(event.team_id, event)
+    return events
+
+
+def existing_results(people, pairs):
+    """Saved results of ``(person id, event id)`` pairs in one query"""
+    results = defaultdict(list)
+    test_results = TestResult.objects.filter(
+        person_id__in={person_id for person_id, _ in pairs},
+        event_id__in={event_id for _, event_id in pairs},
+    ).order_by("pk")
+    for test_result in test_results:
+        pair = (test_result.person_id, test_result.event_id)
+        if pair in pairs:
+            test_result.person = people[test_result.person_id]
+            results[pair].append(test_result)
+    return results
+
+
+def outcome(person_id, test_type, result=None, error=None):
+    return {
+        "person_id": person_id,
+        "test_type": test_type,
+        "success": error is None,
+        "result": result,
+        "error": error,
+    }
+
+
+def validate_values(test_type, values):
+    """The error of an item's raw values, None when they can be saved"""
+    if test_type not in TEST_FIELDS:
+        return f"Unknown test '{test_type}'"
+    for name, value in values.items():
+        if name not in TEST_FIELDS[test_type]:
+            return f"Unknown value '{name}' for the {test_type} test"
+        if value is None:
+            continue
+        if name in INTEGER_FIELDS:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if not valid:
+            kind = "a whole number" if name in INTEGER_FIELDS else "a number"
+            return f"{name} must be {kind} or null"
+
+    if test_type == "jet":
+        if values.get("jet_laps") is None or values.get("jet_sides") is None:
+            return "jet_laps and jet_sides are required"
+    elif test_type == "beep_test":
+        level, laps = values.get("beep_test_level"), values.get("beep_test_laps")
+        if laps is None or calculate_beep_test_total_laps(level, laps) is None:
+            return INVALID_VALUES[test_type]
+    elif test_type == "y_test":
+        if any(values.get(field) is None for field in Y_TEST_FIELDS):
+            return INVALID_VALUES[test_type]
+    return None
+
+
+def set_values(test_result, test_type, values):
+    """Set a test's raw values, the ones an item leaves out are cleared"""
+    for field in TEST_FIELDS[test_type]:
+        setattr(test_result, field, values.get(field))
+    if test_type == "jet":
+        test_result.jet_distance = (
+            test_result.jet_laps * 40 + test_result.jet_sides * 10
+        )
+    elif test_type == "beep_test":
+        test_result.beep_test_total_laps = calculate_beep_test_total_laps(
+            test_result.beep_test_level, test_result.beep_test_laps
+        )
+
+
+def save_results(items):
+    """
+    Save ``(person id, test type, raw values)`` items to the active event of
+    each person's team.
+
+    Returns one outcome per item in order, ``{"person_id", "test_type",
+    "success", "result", "error"}`` with the saved TestResult as result.
+    Items of the same person end up in the same result, of the same test
+    the last one wins.
+    """
+    people = Person.objects.in_bulk({person_id for person_id, _, _ in items})
+    events = active_events({person.team_id for person in people.values()})
+    pairs = {
+        (person.pk, events[person.team_id].pk)
+        for person in people.values()
+        if person.team_id in events
+    }
+    existing = existing_results(people, pairs)
+
+    outcomes = []
+    results = {}
+    tests = defaultdict(dict)
+    for person_id, test_type, values in items:
+        error = validate_values(test_type, values)
+        if error is not None:
+            outcomes.append(outcome(person_id, test_type, error=error))
+            continue
+        person = people.get(person_id)
+        if person is None:
+            outcomes.append(
+                outcome(
+                    person_id, test_type, error="No Person matches the given query."
+                )
+            )
+            continue
+        event = events.get(person.team_id)
+        if event is None:
+            outcomes.append(
+                outcome(
+                    person_id,
+                    test_type,
+                    error="No active test found for this profile's team",
+                )
+            )
+            continue
+        if person.gender not in (None, *GENDERS):
+            outcomes.append(
+                outcome(person_id, test_type, error=INVALID_VALUES[test_type])
+            )
+            continue
+
+        pair = (person.pk, event.pk)
+        test_result = results.get(pair)
+        if test_result is None:
+            found = existing.get(pair, [])
+            if len(found) > 1:
+                outcomes.append(
+                    outcome(
+                        person_id,
+                        test_type,
+                        error="More than one result of this profile in the test",
+                    )
+                )
+                continue
+            test_result = found[0] if found else TestResult(person=person)
+            test_result.event = event
+            results[pair] = test_result
+        set_values(test_result, test_type, values)
+        test_result.test_name = event.name
+        test_result.test_date = date.today()
+        test_result.team = event.team
+        tests[test_type][pair] = test_result
+        outcomes.append(outcome(person_id, test_type, result=test_result))
+
+    if results:
+        score_results(
+            list(results.values()),
+            {test_type: list(scored.values()) for test_type, scored in tests.items()},
+        )
+        fields = [
+            field
+            for test_type in tests
+            for field in (
+                *TEST_FIELDS[test_type],
+                *COMPUTED_FIELDS.get(test_type, []),
+                f"{test_type}_score",
+            )
+        ]
+        try:
+            write_results(list(results.values()), fields)
+        except Exception as e:
+            for item_outcome in outcomes:
+                if item_outcome["success"]:
+                    item_outcome.update(
+                        outcome(
+                            item_outcome["person_id"],
+                            item_outcome["test_type"],
+                            error=str(e),
+                        )
+                    )
+    return outcomes
+
+
+def save_beep_tests(items):
+    """Save BeepTestBatchItems, see save_results"""
+    return save_results(
+        [
+            (
+                item.person_id,
+                "beep_test",
+                {
+                    "beep_test_level": item.beep_test_level,
+                    "beep_test_laps": item.beep_test_laps,
+                    "beep_test_number": item.beep_test_number,
+                    "max_hr": item.max_hr,
+                },
+            )
+            for item in items
+        ]
+    )
+
+
+def _trials(test_results, fields):
+    # Rows of trial values with NaN for the missing ones, score_batch scores
+    # the best trial of each row and 0 for a row without any
+    return [
+        [
+            (
+                np.nan
+                if getattr(test_result, field) is None
+                else getattr(test_result, field)
+            )
+            for field in fields
+        ]
+        for test_result in test_results
+    ]
+
+
+def score_results(test_results, tests):
+    """
+    Score the submitted tests of results with the person's age and height
+    on the test date, one score_batch per test and score table version.
+    ``tests`` maps each test type to the results it was submitted for.
+    Results of people without a birth date or gender score 0, like Y tests
+    without a height.
+    """
+    histories = measurement_histories(
+        {test_result.person_id for test_result in test_results}
+    )
+    for test_result in test_results:
+        # Like TestResult.save, which bulk_create and bulk_update skip
+        if test_result._state.adding or score_inputs_changed(
+            test_result, TestResult.SCORE_INPUT_FIELDS
+        ):
+            test_result.scores_dirty = True
+        test_result.update_person_snapshot(histories[test_result.person_id])
+
+    for test_type, submitted in tests.items():
+        by_engine = defaultdict(list)
+        for test_result in submitted:
+            setattr(test_result, f"{test_type}_score", 0)
+            if test_type == "y_test":
+                test_result.y_test_index = 0
+            if (
+                test_result.age_at_test is None
+                or not test_result.person.gender
+                or (test_type == "y_test" and test_result.height_at_test is None)
+            ):
+                continue
+            by_engine[engine_for_event(test_result.event)].append(test_result)
+
+        for engine, scored in by_engine.items():
+            if test_type == "y_test":
+                values = calculate_y_test_index_batch(
+                    [test_result.height_at_test for test_result in scored],
+                    _trials(scored, Y_TEST_FIELDS),
+                )
+                for test_result, index in zip(scored, values):
+                    test_result.y_test_index = float(index)
+            elif test_type in COMPUTED_FIELDS:
+                field = COMPUTED_FIELDS[test_type][0]
+                values = [getattr(test_result, field) for test_result in scored]
+            else:
+                values = _trials(scored, TEST_FIELDS[test_type])
+            scores = engine.score_batch(
+                test_type,
+                [test_result.age_at_test for test_result in scored],
+                [test_result.person.gender for test_result in scored],
+                values,
+            )
+            for test_result, score in zip(scored, scores):
+                setattr(test_result, f"{test_type}_score", int(score))
+
+    for test_result in test_results:
+        test_result.update_composite_scores()
+
+
+def write_results(test_results, fields):
+    """Insert the new and update the saved results in one transaction"""
+    new = [test_result for test_result in test_results if test_result._state.adding]
+    saved = [test_result for test_result in test_results if test_result.pk]
+    with transaction.atomic():
+        TestResult.objects.bulk_create(new)
+        TestResult.objects.bulk_update(saved, [*fields, *BATCH_FIELDS])
+        # The statistics signals don't fire for bulk writes
+        invalidate_team_statistics(
+            *{test_result.person.team_id for test_result in test_results}
+        )
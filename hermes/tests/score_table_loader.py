@@ -0,0 +1,241 @@
+import csv
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .score_tables import (
+    GENDERS,
+    HIGHER_IS_BETTER,
+    LOWER_IS_BETTER,
+    MAX_AGE,
+    MIN_AGE,
+    SCORE_TABLES,
+    ScoreEngine,
+)
+
+# Section titles used in the season CSVs, matched by their start
+SECTION_TESTS = {
+    "žebřík": "ladder",
+    "3skok": "triple_jump",
+    "hexagon": "hexagon",
+    "ytest": "y_test",
+    "pavlík": "brace",
+    "medicimbal": "medicimbal",
+    "stíhačka": "jet",
+    "beep test": "beep_test",
+}
+
+# Gender of the "Věk <gender>" header rows
+GENDER_LABELS = {"M": "M", "Ž": "F", "F": "F"}
+
+# Order of the axes in a compiled table array
+COMPILED_TESTS = tuple(SCORE_TABLES)
+AGES = tuple(range(MIN_AGE, MAX_AGE + 1))
+
+
+def _number(cell):
+    # The sheets are exported with decimal commas
+    return float(cell.strip().replace(",", "."))
+
+
+def parse_season_csv(content):
+    """
+    Parse a season CSV into ``{test: {gender: {age: thresholds}}}``.
+
+    Each section starts with the test name ("Žebřík", "Hexagon", ...) and
+    holds one block per gender headed by "Věk M" / "Věk Ž" and the point
+    values of the columns. Columns may run from 20 points down to 1 (the
+    ladder does), so every row is reordered to start at 1 point like the
+    tables in ``score_tables``. Cells are separated by semicolons or commas
+    and numbers may use decimal commas.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+    content = content.lstrip("\ufeff")
+    lines = content.splitlines()
+    # A bare section title has no cells to tell the delimiter by
+    first_row = next((line for line in lines if ";" in line or "," in line), "")
+    delimiter = ";" if ";" in first_row else ","
+
+    tables = {}
+    test = None
+    points = None
+    gender = None
+    for line_number, row in enumerate(
+        csv.reader(io.StringIO(content), delimiter=delimiter), start=1
+    ):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            gender = None
+            continue
+
+        label = cells[0]
+        if label.lower().startswith("věk"):
+            if test is None:
+                raise ValueError(f"Line {line_number}: age header outside a section")
+            gender_label = label[3:].strip()
+            if gender_label not in GENDER_LABELS:
+                raise ValueError(f"Line {line_number}: unknown gender '{gender_label}'")
+            gender = GENDER_LABELS[gender_label]
+            points = [int(_number(cell)) for cell in cells[1:] if cell]
+            if sorted(points) != list(range(1, len(points) + 1)):
+                raise ValueError(f"Line {line_number}: invalid point columns")
+            tables[test][gender] = {}
+            continue
+
+        if label.isdigit():
+            if gender is None:
+                raise ValueError(f"Line {line_number}: row outside an age block")
+            cells = cells[1 : len(points) + 1]
+            if len(cells) != len(points) or not all(cells):
+                raise ValueError(f"Line {line_number}: expected {len(points)} values")
+            try:
+                values = [_number(cell) for cell in cells]
+            except ValueError:
+                raise ValueError(f"Line {line_number}: invalid value") from None
+            by_points = sorted(zip(points, values))
+            tables[test][gender][int(label)] = [value for _, value in by_points]
+            continue
+
+        for title, section_test in SECTION_TESTS.items():
+            if label.lower().startswith(title):
+                test = section_test
+                tables[test] = {}
+                gender = None
+                break
+        else:
+            if label[:1].isdigit():
+                raise ValueError(f"Line {line_number}: malformed age '{label}'")
+            raise ValueError(f"Line {line_number}: unknown section '{label}'")
+
+    validate_tables(tables)
+    return tables
+
+
+def validate_tables(tables):
+    """Check that a table set is complete and every row is monotonic"""
+    for test in COMPILED_TESTS:
+        if test not in tables:
+            raise ValueError(f"Missing table for {test}")
+        for gender in GENDERS:
+            table = tables[test].get(gender)
+            if table is None:
+                raise ValueError(f"Missing {gender} table for {test}")
+            for age in AGES:
+                row = table.get(age)
+                if row is None:
+                    raise ValueError(f"Missing age {age} in {gender} table for {test}")
+                if len(row) != len(tables[test]["M"][MIN_AGE]):
+                    raise ValueError(
+                        f"Row for {test} ({gender}, age {age}) has wrong length"
+                    )
+                if test in LOWER_IS_BETTER:
+                    # More points for a faster time
+                    monotonic = all(a >= b for a, b in zip(row, row[1:]))
+                else:
+                    monotonic = all(a <= b for a, b in zip(row, row[1:]))
+                if not monotonic:
+                    raise ValueError(
+                        f"Score table row for {test} ({gender}, age {age}) is not monotonic"
+                    )
+    unknown = set(tables) - set(LOWER_IS_BETTER) - set(HIGHER_IS_BETTER)
+    if unknown:
+        raise ValueError(f"Unknown tests in table set: {', '.join(sorted(unknown))}")
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def compile_tables(tables):
+    """Stack a table set into one (test, gender, age, points) float array"""
+    return np.array(
+        [
+            [[tables[test][gender][age] for age in AGES] for gender in GENDERS]
+            for test in COMPILED_TESTS
+        ],
+        dtype=float,
+    )
+
+
+def write_compiled(array, path):
+    # Written to a temporary file first so concurrent workers never map a
+    # half written artifact
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".npy")
+    try:
+        # mkstemp creates the file readable by its owner only, workers running
+        # as other users share the cache
+        umask = os.umask(0)
+        os.umask(umask)
+        os.fchmod(fd, 0o644 & ~umask)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def engine_from_compiled(array, version=None):
+    """
+    Build a ScoreEngine straight on ``array``: the scalar lookups search its
+    rows and the batch matrices are views into it, nothing is copied out of
+    a memory-mapped array.
+    """
+    rows = {}
+    matrices = {}
+    for t, test in enumerate(COMPILED_TESTS):
+        for g, gender in enumerate(GENDERS):
+            matrix = array[t, g]
+            if test in LOWER_IS_BETTER:
+                # Time rows run from the slowest time down, the engine's
+                # rows are ascending
+                matrix = matrix[:, ::-1]
+            matrices[(test, gender)] = matrix
+            for a, age in enumerate(AGES):
+                rows[(test, gender, age)] = matrix[a]
+    engine = ScoreEngine.from_rows(rows, version=version)
+    for (test, gender), matrix in matrices.items():
+        engine.set_matrix(test, gender, matrix)
+    return engine
+
+
+def compile_season(path, cache_dir):
+    """
+    Compile a season CSV into ``<season>-<content hash>.npy`` in
+    ``cache_dir`` unless it already is there, returns that version.
+    """
+    path = Path(path)
+    content = path.read_bytes()
+    version = f"{path.stem}-{content_hash(content)}"
+    compiled_path = Path(cache_dir) / f"{version}.npy"
+    if not compiled_path.exists():
+        write_compiled(compile_tables(parse_season_csv(content)), compiled_path)
+    return version
+
+
+def load_compiled(version, cache_dir):
+    """
+    Memory-map the compiled tables of a version from ``cache_dir``. Raises
+    FileNotFoundError if they were never compiled there.
+    """
+    array = np.load(Path(cache_dir) / f"{version}.npy", mmap_mode="r")
+    return engine_from_compiled(array, version=version)
+
+
+def load_season(path, cache_dir):
+    """
+    Load the score tables of a season CSV.
+
+    The CSV is compiled once into ``cache_dir`` and memory-mapped from there
+    afterwards, so processes starting against an unchanged CSV never parse
+    it. The engine's version is ``<season>-<content hash>``, the compiled
+    tables of earlier contents stay in ``cache_dir`` under their own.
+    """
+    return load_compiled(compile_season(path, cache_dir), cache_dir)
@@ -0,0 +1,77 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import score_tables
+from .score_table_loader import compile_season, load_compiled, load_season
+
+# Version of the tables built into score_tables.py
+BUILTIN_VERSION = "builtin"
+
+# Number of table versions kept compiled in memory per process
+CACHED_VERSIONS = 8
+
+# A season's tables pinned by content, "<season>-<content hash>"
+HASHED_VERSION = re.compile(r"^(?P<season>.+)-[0-9a-f]{16}$")
+
+
+def season_csv_path(season):
+    return settings.SCORE_TABLE_DIR / f"{season}.csv"
+
+
+def current_score_table_version():
+    """
+    Version new events are pinned to, the content-hashed version of the
+    current season's CSV so that editing it later doesn't rescore them
+    """
+    season = getattr(settings, "SCORE_TABLE_SEASON", None)
+    if not season:
+        return BUILTIN_VERSION
+    return compile_season(season_csv_path(season), settings.SCORE_TABLE_CACHE_DIR)
+
+
+@lru_cache(maxsize=CACHED_VERSIONS)
+def get_score_engine(version):
+    """
+    Compiled score tables of a version: "builtin", a hashed season version
+    or a bare season name for the season CSV as it is now.
+
+    Hashed versions are mapped from their compiled artifact in
+    SCORE_TABLE_CACHE_DIR, which outlives edits of the CSV. Raises
+    LookupError if neither the artifact nor a CSV with that content exist.
+    """
+    if version == BUILTIN_VERSION:
+        engine = score_tables.ScoreEngine(version=BUILTIN_VERSION)
+    elif match := HASHED_VERSION.match(version):
+        try:
+            engine = load_compiled(version, settings.SCORE_TABLE_CACHE_DIR)
+        except FileNotFoundError:
+            # Not compiled in this cache yet, the CSV may still be the same
+            path = season_csv_path(match["season"])
+            if (
+                not path.exists()
+                or compile_season(path, settings.SCORE_TABLE_CACHE_DIR) != version
+            ):
+                raise LookupError(f"Score tables {version} are not available")
+            engine = load_compiled(version, settings.SCORE_TABLE_CACHE_DIR)
+    else:
+        engine = load_season(season_csv_path(version), settings.SCORE_TABLE_CACHE_DIR)
+    if getattr(settings, "SCORE_LOOKUP_TABLES", False):
+        engine.build_lookup_tables()
+    return engine
+
+
+def engine_for_event(event):
+    """
+    Score engine an event's results are scored with.
+
+    Events are pinned to the content-hashed version of the tables that were
+    current when they were created, so neither publishing a new season nor
+    editing the current one changes the scores of earlier events. Events
+    without a pin are scored with the built-in tables, results without an
+    event with the current ones.
+    """
+    if event is None:
+        return score_tables.score_engine
+    return get_score_engine(event.score_table_version or BUILTIN_VERSION)
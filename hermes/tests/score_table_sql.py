@@ -0,0 +1,264 @@
+from django.db import connection
+
+from . import score_tables
+from .models import Event, Person, PersonMeasurement, TestResult
+from .recalculate_scores import Y_TEST_FIELDS
+from .score_table_registry import BUILTIN_VERSION, get_score_engine
+from .score_tables import GENDERS, LOWER_IS_BETTER, MAX_AGE, MIN_AGE, SCORE_TABLES
+from .statistics import invalidate_all_statistics
+
+# Time tests with their two trial columns, scored by the faster one
+TIME_TRIALS = {
+    "ladder": ("ladder_time_1", "ladder_time_2"),
+    "brace": ("brace_time_1", "brace_time_2"),
+    "hexagon": ("hexagon_time_cw", "hexagon_time_ccw"),
+}
+
+# Distance tests with their three trial columns, scored by the longest one
+DISTANCE_TRIALS = {
+    "medicimbal": ("medicimbal_throw_1", "medicimbal_throw_2", "medicimbal_throw_3"),
+    "triple_jump": (
+        "triple_jump_distance_1",
+        "triple_jump_distance_2",
+        "triple_jump_distance_3",
+    ),
+}
+
+# Laps to add to the laps of a beep test level, see calculate_beep_test_total_laps
+BEEP_TEST_LEVEL_LAPS = {
+    level: score_tables.calculate_beep_test_total_laps(level, 0)
+    for level in range(1, 16)
+}
+
+# Key of the tables used for results without an event
+DEFAULT_VERSION = ""
+
+
+def compile_thresholds(engines):
+    """
+    Compile score engines into rows of a SQL lookup table.
+
+    ``engines`` maps a version key to a ScoreEngine. Every (test, gender,
+    age) row becomes ``(version, test, gender, age, size, ascending,
+    negated)``: the ascending thresholds and, for the distance tests, the
+    negated thresholds in ascending order. Postgres' ``width_bucket`` on
+    these arrays is a binary search counting the thresholds at or below a
+    value, which is exactly the ``bisect`` the ScoreEngine does in Python.
+    """
+    rows = []
+    for version, engine in engines.items():
+        for test in SCORE_TABLES:
+            for gender in GENDERS:
+                for age in range(MIN_AGE, MAX_AGE + 1):
+                    ascending = list(engine.thresholds(test, gender, age))
+                    negated = [-threshold for threshold in reversed(ascending)]
+                    rows.append(
+                        (version, test, gender, age, len(ascending), ascending, negated)
+                    )
+    return rows
+
+
+def points_sql(test, value):
+    """
+    SQL expression for the points of ``value`` in the ``thresholds`` row of
+    ``test``, mirroring ScoreEngine's bisect based scoring.
+    """
+    if test == "y_test":
+        # Highest threshold the index reaches, counted from 1 point up
+        return f"GREATEST(1, width_bucket(({value})::float8, th.ascending))"
+    if test in LOWER_IS_BETTER:
+        # Number of thresholds slower than the time
+        rank = f"th.size - width_bucket(({value})::float8, th.ascending)"
+    else:
+        # Number of thresholds shorter than the distance
+        rank = f"th.size - width_bucket(-({value})::float8, th.negated)"
+    # Minimum 1 point, also for values beyond the table
+    return f"CASE WHEN {rank} = th.size THEN 1 ELSE GREATEST(1, {rank}) END"
+
+
+def _score_sql(test, value, condition, current):
+    # Rescored only when all trials are filled in like recalculate_test_result,
+    # 0 points without the person's age or gender
+    lookup = (
+        f"(SELECT {points_sql(test, value)} FROM thresholds AS th "
+        f"WHERE th.version = k.version AND th.test = '{test}' "
+        f"AND th.gender = p.gender AND th.age = k.age)"
+    )
+    return (
+        f"CASE WHEN {condition} THEN "
+        f"CASE WHEN k.age IS NULL OR p.gender IS NULL THEN 0 ELSE {lookup} END "
+        f"ELSE r.{current} END"
+    )
+
+
+def _filled(*columns):
+    # Python truthiness of the trial values, None and 0 both count as missing
+    return " AND ".join(f"COALESCE(r.{column}, 0) <> 0" for column in columns)
+
+
+def rescoring_sql():
+    """
+    SELECT list computing every recalculated column of a result ``r`` of
+    person ``p`` with the height ``m`` last measured by the test date and
+    the age on the test date, clamped age and table version ``k``.
+    """
+    columns = {}
+    for test, trials in TIME_TRIALS.items():
+        columns[f"{test}_score"] = _score_sql(
+            test,
+            f"LEAST({', '.join(f'r.{trial}' for trial in trials)})",
+            _filled(*trials),
+            f"{test}_score",
+        )
+    for test, trials in DISTANCE_TRIALS.items():
+        columns[f"{test}_score"] = _score_sql(
+            test,
+            f"GREATEST({', '.join(f'r.{trial}' for trial in trials)})",
+            _filled(*trials),
+            f"{test}_score",
+        )
+
+    jet_distance = "(r.jet_laps * 40 + r.jet_sides * 10)"
+    jet_filled = _filled("jet_laps", "jet_sides")
+    columns["jet_score"] = _score_sql("jet", jet_distance, jet_filled, "jet_score")
+    columns["jet_distance"] = (
+        f"CASE WHEN {jet_filled} THEN {jet_distance} ELSE r.jet_distance END"
+    )
+
+    total_laps = (
+        "(r.beep_test_laps + CASE r.beep_test_level "
+        + " ".join(
+            f"WHEN {level} THEN {laps}" for level, laps in BEEP_TEST_LEVEL_LAPS.items()
+        )
+        + " END)"
+    )
+    beep_filled = _filled("beep_test_laps", "beep_test_level")
+    columns["beep_test_score"] = _score_sql(
+        "beep_test", total_laps, beep_filled, "beep_test_score"
+    )
+    columns["beep_test_total_laps"] = (
+        f"CASE WHEN {beep_filled} THEN {total_laps} ELSE r.beep_test_total_laps END"
+    )
+
+    # Summed one reach at a time like calculate_y_test_index, so the floating
+    # point result is identical
+    reach_sum = "0"
+    for field in Y_TEST_FIELDS:
+        reach_sum = f"({reach_sum} + r.{field})"
+    height = "COALESCE(m.height, p.height)"
+    columns["age_at_test"] = "k.age_at_test"
+    columns["height_at_test"] = height
+    index = f"(floor({reach_sum} / {height} / 12 * 100) / 100.0)"
+    y_filled = _filled(*Y_TEST_FIELDS)
+    columns["y_test_score"] = (
+        f"CASE WHEN {y_filled} THEN CASE WHEN {height} IS NULL THEN 0 ELSE "
+        f"{_score_sql('y_test', index, 'TRUE', 'y_test_score')} END "
+        "ELSE r.y_test_score END"
+    )
+    columns["y_test_index"] = (
+        f"CASE WHEN {y_filled} THEN CASE WHEN k.age IS NULL OR p.gender IS NULL "
+        f"OR {height} IS NULL THEN 0 ELSE {index} END ELSE r.y_test_index END"
+    )
+    columns["scored_table_version"] = "k.scored_table_version"
+    return columns
+
+
+def rescore_in_database(test_results):
+    """
+    Rescore a TestResult queryset with a single ``UPDATE`` statement.
+
+    The score tables of every version the results use are inlined into the
+    statement as a ``thresholds`` lookup table, the best trials, ages
+    (clamped to the tables), latest heights and composite scores are all
+    computed by Postgres, so no result travels through Django. Returns the
+    number of results rescored.
+    """
+    engines = {
+        DEFAULT_VERSION: score_tables.score_engine,
+        BUILTIN_VERSION: get_score_engine(BUILTIN_VERSION),
+    }
+    versions = (
+        Event.objects.filter(pk__in=test_results.values("event_id"))
+        .exclude(score_table_version="")
+        .values_list("score_table_version", flat=True)
+        .distinct()
+    )
+    for version in versions:
+        engines[version] = get_score_engine(version)
+
+    rows = compile_thresholds(engines)
+    thresholds = ", ".join(
+        ["(%s, %s, %s, %s, %s, %s::float8[], %s::float8[])"] * len(rows)
+    )
+    scored_versions = ", ".join(["(%s, %s)"] * len(engines))
+    columns = rescoring_sql()
+    composites = {
+        "strength_score": ("medicimbal_score", "triple_jump_score"),
+        "speed_score": ("ladder_score", "hexagon_score"),
+        "endurance_score": ("beep_test_score", "jet_score"),
+        "agility_score": ("brace_score", "y_test_score"),
+    }
+    assignments = [f"{column} = new.{column}" for column in columns] + [
+        f"{column} = (new.{first} + new.{second})::float8 / 2"
+        for column, (first, second) in composites.items()
+    ]
+    assignments.append("scores_dirty = FALSE")
+    ids_sql, ids_params = test_results.values("pk").query.sql_with_params()
+
+    sql = f"""
+        WITH thresholds (version, test, gender, age, size, ascending, negated) AS (
+            VALUES {thresholds}
+        ),
+        versions (version, scored_table_version) AS (VALUES {scored_versions})
+        UPDATE {TestResult._meta.db_table} AS result
+        SET {", ".join(assignments)}
+        FROM (
+            SELECT r.id, {", ".join(f"{sql} AS {column}" for column, sql in columns.items())}
+            FROM {TestResult._meta.db_table} AS r
+            JOIN {Person._meta.db_table} AS p ON p.id = r.person_id
+            LEFT JOIN {Event._meta.db_table} AS e ON e.id = r.event_id
+            LEFT JOIN LATERAL (
+                SELECT height FROM {PersonMeasurement._meta.db_table}
+                WHERE person_id = p.id AND measurement_date <= r.test_date
+                ORDER BY measurement_date DESC
+                LIMIT 1
+            ) AS m ON TRUE
+            CROSS JOIN LATERAL (
+                SELECT
+                    a.age_at_test,
+                    -- LEAST and GREATEST skip NULLs, people without a birth
+                    -- date have no age
+                    CASE WHEN a.age_at_test IS NOT NULL THEN
+                        LEAST(GREATEST(a.age_at_test, {MIN_AGE}), {MAX_AGE})
+                    END AS age,
+                    v.version,
+                    v.scored_table_version
+                FROM versions AS v
+                CROSS JOIN (
+                    SELECT date_part(
+                        'year', age(r.test_date, p.date_of_birth)
+                    )::int AS age_at_test
+                ) AS a
+                -- Like engine_for_event: the current tables without an
+                -- event, the built-in ones for an event without a pin
+                WHERE v.version = CASE
+                    WHEN e.id IS NULL THEN %s
+                    ELSE COALESCE(NULLIF(e.score_table_version, ''), %s)
+                END
+            ) AS k
+            WHERE r.id IN ({ids_sql})
+        ) AS new
+        WHERE result.id = new.id
+    """
+    params = [value for row in rows for value in row]
+    params += [
+        value
+        for version, engine in engines.items()
+        for value in (version, engine.version)
+    ]
+    params += [DEFAULT_VERSION, BUILTIN_VERSION, *ids_params]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rescored = cursor.rowcount
+    invalidate_all_statistics()
+    return rescored
@@ -1,4 +1,7 @@
 import math
+from bisect import bisect_left, bisect_right
+
+import numpy as np
 
 
 ladder_score_table_m = {
@@ -258,199 +261,450 @@ beep_test_score_table_f = {
 }
 
 
-def calculate_score(age, gender, test, *args):
-    if age < 10:
-        age = 10
-    elif age > 20:
-        age = 20
-
-    match test:
-        case "ladder":
-            test_score_table_m = ladder_score_table_m
-            test_score_table_f = ladder_score_table_f
-        case "brace":
-            test_score_table_m = brace_score_table_m
-            test_score_table_f = brace_score_table_f
-        case "hexagon":
-            test_score_table_m = hexagon_score_table_m
-            test_score_table_f = hexagon_score_table_f
-        case "medicimbal":
-            test_score_table_m = medicimbal_score_table_m
-            test_score_table_f = medicimbal_score_table_f
-        case "triple_jump":
-            test_score_table_m = triple_jump_score_table_m
-            test_score_table_f = triple_jump_score_table_f
-        case "jet":
-            test_score_table_m = jet_score_table_m
-            test_score_table_f = jet_score_table_f
-        case "beep_test":
-            test_score_table_m = beep_test_score_table_m
-            test_score_table_f = beep_test_score_table_f
-        case "y_test":
-            test_score_table_m = y_test_score_table_m
-            test_score_table_f = y_test_score_table_f
-        case _:
-            return  # TODO: add exception handling here
+# Tests whose tables run from the slowest time down to the fastest one
+LOWER_IS_BETTER = ("ladder", "brace", "hexagon")
+# Tests whose tables run from the shortest distance (or lowest index) upwards
+HIGHER_IS_BETTER = ("medicimbal", "triple_jump", "jet", "beep_test", "y_test")
+
+SCORE_TABLES = {
+    "ladder": {"M": ladder_score_table_m, "F": ladder_score_table_f},
+    "brace": {"M": brace_score_table_m, "F": brace_score_table_f},
+    "hexagon": {"M": hexagon_score_table_m, "F": hexagon_score_table_f},
+    "medicimbal": {"M": medicimbal_score_table_m, "F": medicimbal_score_table_f},
+    "triple_jump": {"M": triple_jump_score_table_m, "F": triple_jump_score_table_f},
+    "jet": {"M": jet_score_table_m, "F": jet_score_table_f},
+    "beep_test": {"M": beep_test_score_table_m, "F": beep_test_score_table_f},
+    "y_test": {"M": y_test_score_table_m, "F": y_test_score_table_f},
+}
 
-    # Get the scores for the given age and test
-    if gender == "M":
-        age_scores = test_score_table_m.get(age)
-    elif gender == "F":
-        age_scores = test_score_table_f.get(age)
-    else:
-        return  # TODO: add exception handling here
-
-    if test == "ladder" or test == "brace" or test == "hexagon":
-        if args[0] is None and args[1] is None:
-            return 0
-        elif args[0] is None:
-            time_best = args[1]
-        elif args[1] is None:
-            time_best = args[0]
-        else:
-            time_best = min(args[0], args[1])
-
-        for i, score in enumerate(age_scores):
-            if time_best >= score:
-                return max(1, i)  # Ensure minimum 1 point
-        # If score is lower than the lowest score in the table
-        return 1  # Minimum 1 point for values below minimum
-
-    elif test == "medicimbal" or test == "triple_jump":
-        if args[0] is None and args[1] is None and args[2] is None:
-            return 0
-        elif args[0] is None and args[1] is None:
-            distance_best = args[2]
-        elif args[0] is None and args[2] is None:
-            distance_best = args[1]
-        elif args[1] is None and args[2] is None:
-            distance_best = args[0]
-        elif args[0] is None:
-            distance_best = max(args[1], args[2])
-        elif args[1] is None:
-            distance_best = max(args[0], args[2])
-        elif args[2] is None:
-            distance_best = max(args[0], args[1])
-        else:
-            distance_best = max(args[0], args[1], args[2])
-
-        for i, score in enumerate(age_scores):
-            if distance_best <= score:
-                return max(1, i)  # Ensure minimum 1 point
-        # If score is higher than the highest score in the table
-        return 1  # Minimum 1 point for values above maximum
-
-    elif test == "jet" or test == "beep_test":
-        distance_best = args[0]
-
-        for i, score in enumerate(age_scores):
-            if distance_best <= score:
-                return max(1, i)  # Ensure minimum 1 point
-        # If score is higher than the highest score in the table
-        return 1  # Minimum 1 point for values above maximum
-
-    elif test == "y_test":
-        height = args[0]
-        sum_reach = 0
-        for i in range(1, 13):
-            sum_reach += args[i]
-
-        index = math.floor(sum_reach / height / 12 * 100) / 100.0
-        for i, score in enumerate(reversed(age_scores)):
-            if index > score:
-                return max(1, len(age_scores) - i)  # Ensure minimum 1 point
-            elif index == score:
-                return max(1, len(age_scores) - i)  # Ensure minimum 1 point
-        # If score is higher than the highest score in the table
-        return 1  # Minimum 1 point for values above maximum
-
-    return  # TODO: error handling here
-
-
-# score = calculate_score(12, "M", "y_test", 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1)
-# print(score)
-
-
-def quick_calculate(age, gender, test, *args):
-    if age < 10:
-        age = 10
-    elif age > 20:
-        age = 20
-
-    match test:
-        case "ladder":
-            test_score_table_m = ladder_score_table_m
-            test_score_table_f = ladder_score_table_f
-        case "brace":
-            test_score_table_m = brace_score_table_m
-            test_score_table_f = brace_score_table_f
-        case "hexagon":
-            test_score_table_m = hexagon_score_table_m
-            test_score_table_f = hexagon_score_table_f
-        case "medicimbal":
-            test_score_table_m = medicimbal_score_table_m
-            test_score_table_f = medicimbal_score_table_f
-        case "triple_jump":
-            test_score_table_m = triple_jump_score_table_m
-            test_score_table_f = triple_jump_score_table_f
-        case "jet":
-            test_score_table_m = jet_score_table_m
-            test_score_table_f = jet_score_table_f
-        case "beep_test":
-            test_score_table_m = beep_test_score_table_m
-            test_score_table_f = beep_test_score_table_f
-        case "y_test":
-            test_score_table_m = y_test_score_table_m
-            test_score_table_f = y_test_score_table_f
-        case _:
-            return  # TODO: add exception handling here
+GENDERS = ("M", "F")
+
+MIN_AGE = 10
+MAX_AGE = 20
+
+# Resolution of the measured values as steps per unit: times, distances and
+# the Y test index to 0.01, beep test laps and jet distance to 1
+LOOKUP_SCALES = {
+    "ladder": 100,
+    "brace": 100,
+    "hexagon": 100,
+    "medicimbal": 100,
+    "triple_jump": 100,
+    "y_test": 100,
+    "jet": 1,
+    "beep_test": 1,
+}
 
-    # Get the scores for the given age and test
-    if gender == "M":
-        age_scores = test_score_table_m.get(age)
-    elif gender == "F":
-        age_scores = test_score_table_f.get(age)
-    else:
-        return  # TODO: add exception handling here
+# How ScoreEngine.score reduces the trial values of each test to one value
+FASTER_TIME, LONGEST_DISTANCE, SINGLE_VALUE, Y_TEST_INDEX = range(4)
+REDUCTIONS = {
+    "ladder": FASTER_TIME,
+    "brace": FASTER_TIME,
+    "hexagon": FASTER_TIME,
+    "medicimbal": LONGEST_DISTANCE,
+    "triple_jump": LONGEST_DISTANCE,
+    "jet": SINGLE_VALUE,
+    "beep_test": SINGLE_VALUE,
+    "y_test": Y_TEST_INDEX,
+}
 
-    if test == "ladder" or test == "brace" or test == "hexagon":
-        time = args[0]
-        for i, score in enumerate(age_scores):
-            if time >= score:
-                return max(1, i)  # Ensure minimum 1 point
-        # If score is lower than the lowest score in the table
-        return 1  # Minimum 1 point for values below minimum
 
-    elif test == "medicimbal" or test == "triple_jump":
-        distance = args[0]
+def clamp_age(age):
+    if age < MIN_AGE:
+        return MIN_AGE
+    if age > MAX_AGE:
+        return MAX_AGE
+    return age
 
-        for i, score in enumerate(age_scores):
-            if distance <= score:
-                return max(1, i)  # Ensure minimum 1 point
-        # If score is higher than the highest score in the table
-        return 1  # Minimum 1 point for values above maximum
 
-    # elif test == "jet" or test == "beep_test":
-    #     distance_best = args[0]
+def _search_points(test, lower_is_better, row, values):
+    # Array version of ScoreEngine.points for one ascending row
+    size = len(row)
+    if test == "y_test":
+        return np.maximum(1, np.searchsorted(row, values, side="right"))
+    if lower_is_better:
+        rank = size - np.searchsorted(row, values, side="right")
+    else:
+        rank = np.searchsorted(row, values, side="left")
+    return np.where(rank == size, 1, np.maximum(1, rank))
 
-    #     for i, score in enumerate(age_scores):
-    #         if distance_best <= score:
-    #             return i
-    #     # If score is higher than the highest score in the table
-    #     return len(age_scores)
 
-    elif test == "y_test":
-        index = args[0]
+def _bisect_points(test, compiled, value):
+    # Points of a value in a row compiled by ScoreEngine._compile_row
+    lower_is_better, row = compiled
+    size = len(row)
 
-        for i, score in enumerate(reversed(age_scores)):
-            if index > score:
-                return max(1, len(age_scores) - i)  # Ensure minimum 1 point
-            elif index == score:
-                return max(1, len(age_scores) - i)  # Ensure minimum 1 point
-        # If score is higher than the highest score in the table
-        return 1  # Minimum 1 point for values above maximum
+    if test == "y_test":
+        # Highest threshold the index reaches, counted from 1 point up
+        return max(1, bisect_right(row, value))
 
-    return  # TODO: error handling here
+    if lower_is_better:
+        # Number of thresholds slower than the time
+        rank = size - bisect_right(row, value)
+    else:
+        # Number of thresholds shorter than the distance
+        rank = bisect_left(row, value)
+
+    if rank == size:
+        return 1  # Minimum 1 point for values beyond the table
+    return max(1, rank)  # Ensure minimum 1 point
+
+
+def _searchsorted_points(test, compiled, value):
+    # _bisect_points for rows that are numpy arrays, such as the views into a
+    # memory-mapped table set of ScoreEngine.from_rows
+    lower_is_better, row = compiled
+    return int(_search_points(test, lower_is_better, row, value))
+
+
+class ScoreEngine:
+    """
+    Scores results against the score tables using binary search.
+
+    Every (test, gender, age) row is compiled once into an ascending tuple of
+    thresholds, so a lookup is a single ``bisect`` instead of a linear scan.
+    The returned points are identical to the original table scans, including
+    their quirks (a value beyond the best threshold falls back to 1 point).
+
+    With ``lookup_tables`` every row is also expanded into a dense table of
+    points per measurable value (see ``LOOKUP_SCALES``), which turns scoring
+    into a single index for values on that resolution.
+    """
+
+    def __init__(self, tables=None, version="builtin", lookup_tables=False):
+        if tables is None:
+            tables = SCORE_TABLES
+        self.version = version
+        self._search = _bisect_points
+        self._rows = {}
+        self._matrices = {}
+        self._lookups = {}
+        for test, gender_tables in tables.items():
+            if test in LOWER_IS_BETTER:
+                lower_is_better = True
+            elif test in HIGHER_IS_BETTER:
+                lower_is_better = False
+            else:
+                raise ValueError(f"Unknown test '{test}' in score tables")
+            for gender, table in gender_tables.items():
+                for age, thresholds in table.items():
+                    self._rows[(test, gender, age)] = self._compile_row(
+                        test, gender, age, thresholds, lower_is_better
+                    )
+        # What score needs of each row in one tuple: the reduction, the
+        # ascending tuple and its length
+        self._scorers = {
+            key: (REDUCTIONS[key[0]], row, len(row))
+            for key, (_, row) in self._rows.items()
+        }
+        if lookup_tables:
+            self.build_lookup_tables()
+
+    @classmethod
+    def from_rows(cls, rows, version):
+        """
+        Engine over already validated rows, ``{(test, gender, age): row}``
+        with every row an ascending numpy array. The rows are used as they
+        are, views into a memory-mapped table set stay mapped, and searched
+        with ``np.searchsorted``.
+        """
+        engine = cls({}, version=version)
+        engine._search = _searchsorted_points
+        # _scorers stays empty, numpy rows are searched through _points as
+        # bisecting them element by element is slow
+        engine._rows = {
+            key: (key[0] in LOWER_IS_BETTER, row) for key, row in rows.items()
+        }
+        return engine
+
+    @staticmethod
+    def _compile_row(test, gender, age, thresholds, lower_is_better):
+        thresholds = tuple(thresholds)
+        # Time tables are stored from the slowest time down, flip them so
+        # every compiled row is ascending and can be bisected
+        row = tuple(reversed(thresholds)) if lower_is_better else thresholds
+        if any(a > b for a, b in zip(row, row[1:])):
+            raise ValueError(
+                f"Score table row for {test} ({gender}, age {age}) is not monotonic"
+            )
+        return lower_is_better, row
+
+    def thresholds(self, test, gender, age):
+        """Return the ascending thresholds for a test, gender and age (or None)"""
+        compiled = self._rows.get((test, gender, clamp_age(age)))
+        return compiled[1] if compiled else None
+
+    def build_lookup_tables(self):
+        """
+        Precompute the points of every measurable value for each test and gender.
+
+        Each (test, gender) gets an (ages, values) table covering one step
+        below its lowest threshold up to one step above its highest, values
+        outside of it or off the resolution fall back to the binary search.
+        Every entry is checked against the binary search, a mismatch raises
+        ValueError.
+        """
+        lookups = {}
+        for test, gender in {(test, gender) for test, gender, _ in self._rows}:
+            scale = LOOKUP_SCALES[test]
+            lower_is_better = test in LOWER_IS_BETTER
+            rows = [
+                self._rows[(test, gender, age)][1]
+                for age in range(MIN_AGE, MAX_AGE + 1)
+            ]
+            low = math.floor(min(row[0] for row in rows) * scale) - 1
+            high = math.ceil(max(row[-1] for row in rows) * scale) + 1
+            values = np.arange(low, high + 1) / scale
+            table = np.array(
+                [
+                    _search_points(test, lower_is_better, np.array(row), values)
+                    for row in rows
+                ]
+            )
+            for age, points in enumerate(table.tolist(), start=MIN_AGE):
+                compiled = self._rows[(test, gender, age)]
+                if points != [
+                    self._search(test, compiled, value) for value in values.tolist()
+                ]:
+                    raise ValueError(
+                        f"Lookup table for {test} ({gender}, age {age}) does not "
+                        "match the score table"
+                    )
+            lookups[(test, gender)] = (low, scale, table.tolist(), table)
+        self._lookups = lookups
+        # Score through _points, which indexes the lookup tables
+        self._scorers = {}
+
+    def points(self, age, gender, test, value):
+        """Score a single already reduced value (best time, distance or index)"""
+        # Inlined like in _score_trials, previews score on every keystroke
+        if age < MIN_AGE:
+            age = MIN_AGE
+        elif age > MAX_AGE:
+            age = MAX_AGE
+        scorer = self._scorers.get((test, gender, age))
+        if scorer is None:
+            compiled = self._rows.get((test, gender, age))
+            if compiled is None:
+                return None
+            return self._points(test, gender, age, compiled, value)
+
+        reduction, row, size = scorer
+        if reduction == Y_TEST_INDEX:
+            points = bisect_right(row, value)
+            return points if points > 1 else 1
+        if reduction == FASTER_TIME:
+            rank = size - bisect_right(row, value)
+        else:
+            rank = bisect_left(row, value)
+        if rank == size or rank < 1:
+            return 1
+        return rank
+
+    def _points(self, test, gender, age, compiled, value):
+        if self._lookups:
+            lookup = self._lookups.get((test, gender))
+            if lookup is not None and math.isfinite(value):
+                low, scale, table, _ = lookup
+                step = round(value * scale)
+                if step / scale == value and 0 <= step - low < len(table[0]):
+                    return table[age - MIN_AGE][step - low]
+        return self._search(test, compiled, value)
+
+    def score(self, age, gender, test, *args):
+        """Score the raw trial values of a test, see ``calculate_score``"""
+        return self._score_trials(age, gender, test, args)
+
+    def _score_trials(self, age, gender, test, args):
+        # score with the trials as a tuple, so calculate_score passes its own
+        # on instead of unpacking and packing them again. clamp_age is
+        # inlined, this is the hot path of every recalculation
+        if age < MIN_AGE:
+            age = MIN_AGE
+        elif age > MAX_AGE:
+            age = MAX_AGE
+        scorer = self._scorers.get((test, gender, age))
+        if scorer is None:
+            return self._score_compiled(age, gender, test, args)
+
+        # _bisect_points inlined too, each Python call costs about as much
+        # as the search itself
+        reduction, row, size = scorer
+        if reduction == FASTER_TIME:
+            value, second = args[0], args[1]
+            if value is None:
+                if second is None:
+                    return 0
+                value = second
+            elif second is not None and second < value:
+                value = second
+            rank = size - bisect_right(row, value)
+        elif reduction == SINGLE_VALUE:
+            rank = bisect_left(row, args[0])
+        elif reduction == LONGEST_DISTANCE:
+            value = None
+            for trial in args[0], args[1], args[2]:
+                if trial is not None and (value is None or trial > value):
+                    value = trial
+            if value is None:
+                return 0
+            rank = bisect_left(row, value)
+        else:
+            points = bisect_right(row, calculate_y_test_index(*args[:13]))
+            return points if points > 1 else 1
+        if rank == size or rank < 1:
+            return 1
+        return rank
+
+    def _score_compiled(self, age, gender, test, args):
+        # _score_trials of engines without scorers (numpy rows, lookup
+        # tables) and of unknown tests or genders
+        compiled = self._rows.get((test, gender, age))
+        if compiled is None:
+            return None
+
+        if test == "y_test":
+            value = calculate_y_test_index(*args[:13])
+        elif test == "jet" or test == "beep_test":
+            value = args[0]
+        elif compiled[0]:
+            # Faster of the two times
+            first, second = args[0], args[1]
+            if first is None:
+                if second is None:
+                    return 0
+                value = second
+            elif second is None:
+                value = first
+            else:
+                value = min(first, second)
+        else:
+            # Longest of the three distances
+            value = None
+            for trial in args[0], args[1], args[2]:
+                if trial is not None and (value is None or trial > value):
+                    value = trial
+            if value is None:
+                return 0
+
+        return self._points(test, gender, age, compiled, value)
+
+    def _matrix(self, test, gender):
+        # Rows for every age between MIN_AGE and MAX_AGE stacked into one
+        # array, built on first use since only the batch path needs them
+        key = (test, gender)
+        if key not in self._matrices:
+            rows = [
+                self._rows[(test, gender, age)][1]
+                for age in range(MIN_AGE, MAX_AGE + 1)
+            ]
+            self._matrices[key] = np.array(rows, dtype=float)
+        return self._matrices[key]
+
+    def set_matrix(self, test, gender, matrix):
+        """Use a prebuilt (ages, points) ascending matrix for the batch path"""
+        self._matrices[(test, gender)] = matrix
+
+    def score_batch(self, test, ages, genders, values):
+        """
+        Score many results of one test at once.
+
+        ``values`` holds one already reduced value per result, or one row of
+        trials per result (use NaN for a missing trial), which is reduced to
+        the best trial like ``calculate_score`` does. Y test values are
+        indexes, see ``calculate_y_test_index_batch``. Results without any
+        trial and results with an unknown gender score 0.
+        """
+        if test not in LOWER_IS_BETTER and test not in HIGHER_IS_BETTER:
+            raise ValueError(f"Unknown test '{test}'")
+        lower_is_better = test in LOWER_IS_BETTER
+
+        ages = np.clip(np.asarray(ages, dtype=int), MIN_AGE, MAX_AGE)
+        genders = np.asarray(genders)
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 2:
+            if lower_is_better:
+                values = np.fmin.reduce(values, axis=1)
+            else:
+                values = np.fmax.reduce(values, axis=1)
+
+        scores = np.zeros(values.shape, dtype=int)
+        scored = ~np.isnan(values)
+        for gender in GENDERS:
+            in_gender = scored & (genders == gender)
+            if not in_gender.any():
+                continue
+            lookup = self._lookups.get((test, gender))
+            if lookup is not None:
+                # Score everything on the lookup table's resolution with a
+                # single index, only the rest goes through the search below
+                low, scale, _, table = lookup
+                selected = np.flatnonzero(in_gender)
+                steps = np.rint(values[selected] * scale)
+                in_table = (
+                    (steps / scale == values[selected])
+                    & (steps >= low)
+                    & (steps < low + table.shape[1])
+                )
+                hits = selected[in_table]
+                scores[hits] = table[
+                    ages[hits] - MIN_AGE, steps[in_table].astype(int) - low
+                ]
+                in_gender[hits] = False
+
+            matrix = self._matrix(test, gender)
+            for age in np.unique(ages[in_gender]):
+                selected = in_gender & (ages == age)
+                scores[selected] = _search_points(
+                    test, lower_is_better, matrix[age - MIN_AGE], values[selected]
+                )
+        return scores
+
+
+score_engine = ScoreEngine()
+
+
+def set_score_engine(engine):
+    """Replace the engine used by calculate_score, quick_calculate and score_batch"""
+    global score_engine
+    score_engine = engine
+
+
+def _engine(event):
+    if event is None:
+        return score_engine
+    from .score_table_registry import engine_for_event
+
+    return engine_for_event(event)
+
+
+def calculate_score(age, gender, test, *args, event=None):
+    """
+    Score a test from its raw values.
+
+    Time tests (ladder, brace, hexagon) take two times and score the faster
+    one, medicimbal and triple jump take three distances and score the
+    longest, jet and beep test take the distance or total laps, and the Y test
+    takes the height followed by the 12 reaches. Returns None for an unknown
+    test or gender. Results of an event are scored with the score tables the
+    event is pinned to.
+    """
+    engine = score_engine if event is None else _engine(event)
+    return engine._score_trials(age, gender, test, args)
+
+
+def quick_calculate(age, gender, test, *args, event=None):
+    """Score a single time, distance or Y test index"""
+    # Jet and beep test have no single value preview
+    if test == "jet" or test == "beep_test":
+        return None
+    engine = score_engine if event is None else _engine(event)
+    return engine.points(age, gender, test, args[0])
+
+
+def score_batch(test, ages, genders, values, event=None):
+    """Score whole arrays of results of one test, see ``ScoreEngine.score_batch``"""
+    return _engine(event).score_batch(test, ages, genders, values)
 
 
 def calculate_y_test_index(height, *args):
@@ -495,3 +749,14 @@ def calculate_beep_test_total_laps(level, laps):
             return laps + 157
         case _:
             return  # TODO: error handling here
+
+
+def calculate_y_test_index_batch(heights, reaches):
+    """Y test indexes for an array of heights and an (n, 12) array of reaches"""
+    reaches = np.asarray(reaches, dtype=float)
+    # Summed column by column in the same order as calculate_y_test_index so
+    # the floored indexes match it exactly
+    sum_reach = reaches[:, 0].copy()
+    for i in range(1, 12):
+        sum_reach += reaches[:, i]
+    return np.floor(sum_reach / np.asarray(heights, dtype=float) / 12 * 100) / 100.0
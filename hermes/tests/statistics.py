@@ -0,0 +1,236 @@
+"""
+Statistics over test results for the dashboards.
+
+Team statistics and progress are cached in the default cache. They are
+dropped when a result or a person of the team is saved or deleted (signals
+connected in TestsConfig.ready) and when a recalculation rewrites scores in
+bulk (invalidate_all_statistics), after the transaction commits so a
+concurrent request can't cache the old numbers again.
+
+The default cache is per process unless settings.CACHES names a shared
+backend, other processes then keep serving what they cached for up to
+STATISTICS_CACHE_TTL.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, RowRange, Window
+from django.db.models.functions import FirstValue, LastValue
+from django.db.models.signals import post_delete, post_save
+
+from .models import Person, TestResult
+
+TEST_TYPES = [
+    "ladder",
+    "hexagon",
+    "y_test",
+    "brace",
+    "medicimbal",
+    "jet",
+    "triple_jump",
+    "beep_test",
+]
+COMPOSITE_SCORES = ["strength", "speed", "endurance", "agility"]
+
+# Cache key of the counter bumped to drop the statistics of every team
+GENERATION_KEY = "statistics:generation"
+
+
+def _team_key(team_id, name=""):
+    generation = cache.get_or_set(GENERATION_KEY, 0, timeout=None)
+    return f"statistics:{generation}:team:{team_id}{name}"
+
+
+def team_statistics(team_id):
+    """
+    Average, best and worst score of every test and composite over the
+    team's results, in a single query. Aggregates skip NULL scores, so each
+    one only covers the results that have the score, like filtering them
+    out per test did.
+    """
+    key = _team_key(team_id)
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    aggregates = {}
+    for test_type in TEST_TYPES:
+        field_name = f"{test_type}_score"
+        aggregates[f"{test_type}__avg"] = Avg(field_name)
+        aggregates[f"{test_type}__max"] = Max(field_name)
+        aggregates[f"{test_type}__min"] = Min(field_name)
+        aggregates[f"{test_type}__count"] = Count(field_name)
+    for score_type in COMPOSITE_SCORES:
+        field_name = f"{score_type}_score"
+        aggregates[f"{score_type}_composite__avg"] = Avg(field_name)
+        aggregates[f"{score_type}_composite__max"] = Max(field_name)
+        aggregates[f"{score_type}_composite__min"] = Min(field_name)
+    values = TestResult.objects.filter(person__team_id=team_id).aggregate(**aggregates)
+
+    stats = {}
+    for test_type in TEST_TYPES:
+        stats[test_type] = {
+            "avg_score": values[f"{test_type}__avg"],
+            "max_score": values[f"{test_type}__max"],
+            "min_score": values[f"{test_type}__min"],
+            "total_tests": values[f"{test_type}__count"],
+        }
+    for score_type in COMPOSITE_SCORES:
+        name = f"{score_type}_composite"
+        stats[name] = {
+            "avg_score": values[f"{name}__avg"],
+            "max_score": values[f"{name}__max"],
+            "min_score": values[f"{name}__min"],
+        }
+    cache.set(key, stats, timeout=settings.STATISTICS_CACHE_TTL)
+    return stats
+
+
+def person_progress(person_id, event_id=None, date_from=None, date_to=None):
+    """
+    Score history and improvement from the first to the last result of every
+    test the person did at least twice, optionally of one event or within a
+    date range. All results are fetched in one query and pivoted per test.
+    """
+    test_results = TestResult.objects.filter(person_id=person_id)
+    if event_id is not None:
+        test_results = test_results.filter(event_id=event_id)
+    if date_from is not None:
+        test_results = test_results.filter(test_date__gte=date_from)
+    if date_to is not None:
+        test_results = test_results.filter(test_date__lte=date_to)
+    fields = [f"{test_type}_score" for test_type in TEST_TYPES]
+    rows = list(test_results.order_by("test_date", "id").values("test_date", *fields))
+
+    progress = {}
+    for test_type, field_name in zip(TEST_TYPES, fields):
+        scores = [{"date": row["test_date"], "score": row[field_name]} for row in rows]
+        if len(scores) >= 2:
+            first_score = scores[0]["score"]
+            last_score = scores[-1]["score"]
+            progress[test_type] = {
+                "improvement": last_score - first_score,
+                "improvement_percentage": (
+                    ((last_score - first_score) / first_score * 100)
+                    if first_score
+                    else None
+                ),
+                "scores_over_time": scores,
+            }
+    return progress
+
+
+def team_progress(team_id):
+    """
+    First and last score, their delta and the score series of every test for
+    every member of the team with results, in a single query. The first and
+    last scores are window functions over each person's results in test date
+    order, so nothing is computed per person.
+    """
+    key = _team_key(team_id, ":progress")
+    progress = cache.get(key)
+    if progress is not None:
+        return progress
+
+    window = {
+        "partition_by": [F("person_id")],
+        "order_by": [F("test_date").asc(), F("id").asc()],
+        "frame": RowRange(start=None, end=None),
+    }
+    annotations = {}
+    for test_type in TEST_TYPES:
+        field_name = f"{test_type}_score"
+        annotations[f"{test_type}__first"] = Window(FirstValue(field_name), **window)
+        annotations[f"{test_type}__last"] = Window(LastValue(field_name), **window)
+    fields = [f"{test_type}_score" for test_type in TEST_TYPES]
+    rows = (
+        TestResult.objects.filter(person__team_id=team_id)
+        .annotate(**annotations)
+        .order_by("person__surname", "person__name", "person_id", "test_date", "id")
+        .values(
+            "person_id",
+            "person__name",
+            "person__surname",
+            "event_id",
+            "test_date",
+            *fields,
+            *annotations,
+        )
+    )
+
+    people = {}
+    for row in rows:
+        person = people.get(row["person_id"])
+        if person is None:
+            person = people[row["person_id"]] = {
+                "person_id": row["person_id"],
+                "name": row["person__name"],
+                "surname": row["person__surname"],
+                "tests": {
+                    test_type: {
+                        "first_score": row[f"{test_type}__first"],
+                        "last_score": row[f"{test_type}__last"],
+                        "delta": row[f"{test_type}__last"] - row[f"{test_type}__first"],
+                        "scores_over_time": [],
+                    }
+                    for test_type in TEST_TYPES
+                },
+            }
+        for test_type, field_name in zip(TEST_TYPES, fields):
+            person["tests"][test_type]["scores_over_time"].append(
+                {
+                    "date": row["test_date"],
+                    "event_id": row["event_id"],
+                    "score": row[field_name],
+                }
+            )
+
+    progress = {"team_id": team_id, "people": list(people.values())}
+    cache.set(key, progress, timeout=settings.STATISTICS_CACHE_TTL)
+    return progress
+
+
+def invalidate_team_statistics(*team_ids):
+    team_ids = {team_id for team_id in team_ids if team_id is not None}
+    if team_ids:
+        transaction.on_commit(
+            lambda: cache.delete_many(
+                [_team_key(team_id) for team_id in team_ids]
+                + [_team_key(team_id, ":progress") for team_id in team_ids]
+            )
+        )
+
+
+def invalidate_all_statistics():
+    def bump():
+        cache.get_or_set(GENERATION_KEY, 0, timeout=None)
+        cache.incr(GENERATION_KEY)
+
+    transaction.on_commit(bump)
+
+
+def _test_result_changed(instance, **kwargs):
+    # Most saves come with the person loaded, only look its team up if not
+    if TestResult.person.is_cached(instance):
+        team_id = instance.person.team_id
+    else:
+        team_id = (
+            Person.objects.filter(pk=instance.person_id)
+            .values_list("team_id", flat=True)
+            .first()
+        )
+    invalidate_team_statistics(team_id)
+
+
+def _person_changed(instance, **kwargs):
+    # A person moving teams changes the statistics of both
+    loaded = getattr(instance, "_loaded_values", {})
+    invalidate_team_statistics(instance.team_id, loaded.get("team_id"))
+
+
+def connect_signals():
+    post_save.connect(_test_result_changed, sender=TestResult)
+    post_delete.connect(_test_result_changed, sender=TestResult)
+    post_save.connect(_person_changed, sender=Person)
+    post_delete.connect(_person_changed, sender=Person)
@@ -1,3 +1,1984 @@
-from django.test import TestCase
+import json
+import math
+import os
+import random
+import stat
+from datetime import UTC, date, datetime, time, timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+import jwt
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from .jobs import (
+    JOB_HANDLERS,
+    MAX_ATTEMPTS,
+    STALE_AFTER,
+    claim_next_job,
+    enqueue_job,
+    run_job,
+)
+from .models import Event, Job, Person, PersonMeasurement, Team, TestResult
+from .recalculate_scores import (
+    RECALCULATED_FIELDS,
+    Y_TEST_FIELDS,
+    recalculate_chunk,
+    recalculate_scores,
+    recalculate_scores_parallel,
+    recalculate_test_results,
+    recalculate_test_results_staged,
+    score_chunk,
+    stale_test_results,
+)
+from .api import test_result_dict
+from .pagination import encode_cursor
+from .renderers import ORJSONRenderer
+from .result_batches import TEST_FIELDS
+from .score_table_loader import (
+    compile_tables,
+    content_hash,
+    engine_from_compiled,
+    load_season,
+    parse_season_csv,
+    validate_tables,
+    write_compiled,
+)
+from .score_table_registry import (
+    BUILTIN_VERSION,
+    current_score_table_version,
+    engine_for_event,
+    get_score_engine,
+)
+from .score_table_sql import rescore_in_database
+from .score_tables import (
+    MAX_AGE,
+    MIN_AGE,
+    SCORE_TABLES,
+    ScoreEngine,
+    calculate_beep_test_total_laps,
+    calculate_score,
+    calculate_y_test_index,
+    calculate_y_test_index_batch,
+    quick_calculate,
+    score_batch,
+)
+
+GENDERS = ("M", "F", "X")
+# Well outside the tables on both sides, ages are clamped to them
+AGES = range(5, 26)
+TIME_TESTS = ("ladder", "brace", "hexagon")
+
+
+def legacy_points(age, gender, test, value):
+    """
+    Points of a single value as the original table scans computed them.
+
+    Kept frozen as the reference the scoring code is checked against, do not
+    "fix" its quirks here.
+    """
+    age = min(max(age, 10), 20)
+    if test not in SCORE_TABLES or gender not in ("M", "F"):
+        return None
+    age_scores = SCORE_TABLES[test][gender][age]
+
+    if test == "y_test":
+        for i, score in enumerate(reversed(age_scores)):
+            if value >= score:
+                return max(1, len(age_scores) - i)
+        return 1
+
+    for i, score in enumerate(age_scores):
+        if value >= score if test in TIME_TESTS else value <= score:
+            return max(1, i)
+    return 1
+
+
+def legacy_calculate_score(age, gender, test, *args):
+    if test not in SCORE_TABLES or gender not in ("M", "F"):
+        return None
+    if test in TIME_TESTS:
+        if args[0] is None and args[1] is None:
+            return 0
+        value = min(arg for arg in args[:2] if arg is not None)
+    elif test in ("medicimbal", "triple_jump"):
+        if args[0] is None and args[1] is None and args[2] is None:
+            return 0
+        value = max(arg for arg in args[:3] if arg is not None)
+    elif test == "y_test":
+        value = math.floor(sum(args[1:13]) / args[0] / 12 * 100) / 100.0
+    else:
+        value = args[0]
+    return legacy_points(age, gender, test, value)
+
+
+def sweep_values(test):
+    """Every threshold of a test, its neighbours and values beyond the tables"""
+    thresholds = {
+        value
+        for gender_table in SCORE_TABLES[test].values()
+        for row in gender_table.values()
+        for value in row
+    }
+    values = set()
+    for threshold in thresholds:
+        for offset in (0, 0.01, -0.01, 1e-9, -1e-9):
+            values.add(round(threshold + offset, 12))
+    values.update((0, min(thresholds) / 2, max(thresholds) * 2))
+    if test in ("jet", "beep_test"):
+        values = {int(value) for value in values}
+    return sorted(values)
+
+
+class ScoringEquivalenceMixin:
+    """
+    Compares a scorer against the frozen legacy scans over every table.
+
+    Subclasses provide ``score`` and ``points`` so the same sweep checks the
+    module functions, lookup table engines and the batch scoring.
+    """
+
+    def score(self, age, gender, test, *args):
+        return calculate_score(age, gender, test, *args)
+
+    def points(self, age, gender, test, value):
+        return quick_calculate(age, gender, test, value)
+
+    def assertMatchesLegacy(self, function, reference, *args):
+        try:
+            expected = reference(*args)
+        except Exception as e:
+            with self.assertRaises(type(e), msg=args):
+                function(*args)
+            return
+        self.assertEqual(function(*args), expected, msg=args)
+
+    def test_points_match_legacy(self):
+        for test in SCORE_TABLES:
+            if test in ("jet", "beep_test"):
+                continue
+            for value in sweep_values(test):
+                for gender in GENDERS:
+                    for age in AGES:
+                        self.assertMatchesLegacy(
+                            self.points, legacy_points, age, gender, test, value
+                        )
+
+    def test_trials_match_legacy(self):
+        for test in SCORE_TABLES:
+            if test == "y_test":
+                continue
+            values = sweep_values(test)[::7]
+            if test in TIME_TESTS:
+                trials = [(value, values[-1 - i]) for i, value in enumerate(values)]
+                trials += [(None, None), (values[0], None), (None, values[1])]
+            elif test in ("medicimbal", "triple_jump"):
+                trials = [
+                    (value, None, values[-1 - i]) for i, value in enumerate(values)
+                ]
+                trials += [(None, None, None), (None, values[2], None)]
+            else:
+                trials = [(value,) for value in values] + [(None,)]
+            for args in trials:
+                for gender in GENDERS:
+                    for age in (9, 12, 17, 21):
+                        self.assertMatchesLegacy(
+                            self.score, legacy_calculate_score, age, gender, test, *args
+                        )
+
+    def test_y_test_matches_legacy(self):
+        for height in (130.0, 152.5, 171.0, 194.3):
+            for index in sweep_values("y_test")[::5]:
+                reaches = [round(index * height, 1)] * 12
+                for gender in ("M", "F"):
+                    for age in (8, 14, 20):
+                        self.assertMatchesLegacy(
+                            self.score,
+                            legacy_calculate_score,
+                            age,
+                            gender,
+                            "y_test",
+                            height,
+                            *reaches,
+                        )
+
+    def test_unknown_test(self):
+        self.assertIsNone(self.score(14, "M", "sprint", 1.0))
+        self.assertIsNone(self.points(14, "M", "sprint", 1.0))
+
+
+class CalculateScoreTests(ScoringEquivalenceMixin, SimpleTestCase):
+    pass
+
+
+class LookupTableTests(ScoringEquivalenceMixin, SimpleTestCase):
+    def setUp(self):
+        self.engine = ScoreEngine(lookup_tables=True)
+
+    def score(self, age, gender, test, *args):
+        return self.engine.score(age, gender, test, *args)
+
+    def points(self, age, gender, test, value):
+        return self.engine.points(age, gender, test, value)
+
+
+class ScoreBatchTests(ScoringEquivalenceMixin, SimpleTestCase):
+    """Batch scoring scores None as 0 where the scalar functions return None"""
+
+    def score(self, age, gender, test, *args):
+        if test == "y_test":
+            values = [calculate_y_test_index(*args)]
+        elif test in ("jet", "beep_test"):
+            values = [np.nan if args[0] is None else args[0]]
+        else:
+            values = [[np.nan if arg is None else arg for arg in args]]
+        points = self.batch(test, [age], [gender], values)
+        if points == 0 and test in ("jet", "beep_test"):
+            # Scored 0 where the scalar functions raise on the missing value
+            raise TypeError("Missing value")
+        return points
+
+    def points(self, age, gender, test, value):
+        return self.batch(test, [age], [gender], [value])
+
+    def batch(self, test, ages, genders, values):
+        if test not in SCORE_TABLES:
+            with self.assertRaises(ValueError):
+                score_batch(test, ages, genders, values)
+            return None
+        points = int(score_batch(test, ages, genders, values)[0])
+        if genders[0] not in ("M", "F"):
+            self.assertEqual(points, 0)
+            return None
+        return points
+
+    def test_whole_table_in_one_batch(self):
+        for test in SCORE_TABLES:
+            values = sweep_values(test)
+            ages = np.repeat(list(AGES), len(values))
+            tiled = np.tile(values, len(AGES))
+            for gender in ("M", "F"):
+                genders = np.full(len(ages), gender)
+                expected = [
+                    legacy_points(age, gender, test, value)
+                    for age, value in zip(ages.tolist(), tiled.tolist())
+                ]
+                self.assertEqual(
+                    score_batch(test, ages, genders, tiled).tolist(), expected
+                )
+
+    def test_y_test_index_batch(self):
+        rng = np.random.default_rng(0)
+        heights = np.round(rng.uniform(120, 200, 500), 1)
+        reaches = np.round(rng.uniform(50, 150, (500, 12)), 1)
+        expected = [
+            calculate_y_test_index(height, *row)
+            for height, row in zip(heights.tolist(), reaches.tolist())
+        ]
+        self.assertEqual(
+            calculate_y_test_index_batch(heights, reaches).tolist(), expected
+        )
+
+
+# Section titles the season sheets use for each test
+SEASON_TITLES = {
+    "ladder": "Žebřík",
+    "triple_jump": "3skok",
+    "hexagon": "Hexagon",
+    "y_test": "Ytest",
+    "brace": "Pavlík",
+    "medicimbal": "Medicimbal",
+    "jet": "Stíhačka",
+    "beep_test": "Beep test",
+}
+
+
+def season_csv(tables, delimiter=";", decimal=","):
+    """A season sheet of ``tables`` like the exported ones, time columns from 20 points down"""
+    lines = []
+    for test, title in SEASON_TITLES.items():
+        lines.append(title)
+        for gender, label in (("M", "M"), ("F", "Ž")):
+            size = len(tables[test][gender][MIN_AGE])
+            points = list(range(1, size + 1))
+            if test in TIME_TESTS:
+                points.reverse()
+            lines.append(delimiter.join([f"Věk {label}", *map(str, points)]))
+            for age, row in tables[test][gender].items():
+                values = [row[point - 1] for point in points]
+                lines.append(
+                    delimiter.join(
+                        [str(age)]
+                        + [str(value).replace(".", decimal) for value in values]
+                    )
+                )
+            lines.append(delimiter * size)
+    return "\n".join(lines)
+
+
+def float_tables(tables):
+    return {
+        test: {
+            gender: {age: [float(value) for value in row] for age, row in table.items()}
+            for gender, table in gender_tables.items()
+        }
+        for test, gender_tables in tables.items()
+    }
+
+
+class ScoreTableLoaderTests(SimpleTestCase):
+    def test_parse_semicolons_and_decimal_commas(self):
+        tables = parse_season_csv(season_csv(SCORE_TABLES).encode("utf-8-sig"))
+        self.assertEqual(tables, float_tables(SCORE_TABLES))
+
+    def test_parse_commas(self):
+        tables = parse_season_csv(season_csv(SCORE_TABLES, ",", "."))
+        self.assertEqual(tables, float_tables(SCORE_TABLES))
+
+    def test_parse_the_exported_2024_sheet(self):
+        root = Path(settings.BASE_DIR).parent
+        (exported,) = root.glob("Fyzick*_testy_2024.csv")
+        self.assertEqual(
+            parse_season_csv(exported.read_bytes()),
+            parse_season_csv((settings.SCORE_TABLE_DIR / "2024.csv").read_bytes()),
+        )
+
+    def test_parse_errors(self):
+        content = season_csv(SCORE_TABLES)
+        for broken, message in [
+            (content.replace("Věk Ž", "Věk X", 1), "unknown gender 'X'"),
+            (content.replace("Hexagon", "Sprint"), "unknown section 'Sprint'"),
+            (content.replace("\n12;", "\n12;;", 1), "expected 20 values"),
+            (content.replace("\n12;", "\n12: [", 1), "malformed age '12: ["),
+            (content.replace(";3,", ";3.o", 1), "invalid value"),
+        ]:
+            with self.assertRaisesMessage(ValueError, message):
+                parse_season_csv(broken)
+
+    def test_validate_tables(self):
+        tables = float_tables(SCORE_TABLES)
+        validate_tables(tables)
+
+        tables["medicimbal"]["F"][14][5] = 0.1
+        with self.assertRaisesMessage(
+            ValueError, "medicimbal (F, age 14) is not monotonic"
+        ):
+            validate_tables(tables)
+
+        tables = float_tables(SCORE_TABLES)
+        del tables["jet"]["M"][MAX_AGE]
+        with self.assertRaisesMessage(
+            ValueError, f"Missing age {MAX_AGE} in M table for jet"
+        ):
+            validate_tables(tables)
+
+        tables = float_tables(SCORE_TABLES)
+        del tables["brace"]
+        with self.assertRaisesMessage(ValueError, "Missing table for brace"):
+            validate_tables(tables)
+
+    def test_load_season_versions_and_cache(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "2030.csv"
+            cache_dir = Path(tmp) / "cache"
+            path.write_text(season_csv(SCORE_TABLES), encoding="utf-8")
+            engine = load_season(path, cache_dir)
+            self.assertEqual(engine.version, f"2030-{content_hash(path.read_bytes())}")
+            self.assertEqual(len(list(cache_dir.iterdir())), 1)
+
+            # An unchanged sheet is mapped from the compiled artifact
+            with mock.patch(
+                "tests.score_table_loader.parse_season_csv",
+                side_effect=AssertionError("parsed again"),
+            ):
+                self.assertEqual(load_season(path, cache_dir).version, engine.version)
+
+            # An edited sheet is a new version next to the old one
+            tables = float_tables(SCORE_TABLES)
+            tables["ladder"]["M"][12][0] = 3.9
+            path.write_text(season_csv(tables), encoding="utf-8")
+            edited = load_season(path, cache_dir)
+            self.assertNotEqual(edited.version, engine.version)
+            self.assertEqual(len(list(cache_dir.iterdir())), 2)
+            self.assertEqual(edited.thresholds("ladder", "M", 12)[-1], 3.9)
+
+    def test_compiled_artifacts_are_readable_by_other_users(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "tables.npy"
+            umask = os.umask(0o022)
+            try:
+                write_compiled(compile_tables(SCORE_TABLES), path)
+            finally:
+                os.umask(umask)
+            self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o644)
+
+
+class CompiledEngineTests(ScoringEquivalenceMixin, SimpleTestCase):
+    """An engine over a memory-mapped compiled table set scores like the tables"""
+
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "tables.npy"
+        write_compiled(compile_tables(SCORE_TABLES), path)
+        self.array = np.load(path, mmap_mode="r")
+        self.engine = engine_from_compiled(self.array, version="compiled")
+
+    def score(self, age, gender, test, *args):
+        return self.engine.score(age, gender, test, *args)
+
+    def points(self, age, gender, test, value):
+        return self.engine.points(age, gender, test, value)
+
+    def test_rows_are_views_into_the_map(self):
+        for test in SCORE_TABLES:
+            row = self.engine.thresholds(test, "F", 15)
+            self.assertTrue(np.shares_memory(row, self.array))
+
+
+def shifted_tables(seconds):
+    """SCORE_TABLES with the ladder times of 12 year old boys ``seconds`` slower"""
+    tables = float_tables(SCORE_TABLES)
+    tables["ladder"]["M"][12] = [
+        round(value + seconds, 2) for value in tables["ladder"]["M"][12]
+    ]
+    return tables
+
+
+class ScoreTableRegistryTests(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        settings_override = override_settings(
+            SCORE_TABLE_DIR=self.dir,
+            SCORE_TABLE_CACHE_DIR=self.dir / "cache",
+            SCORE_TABLE_SEASON="2030",
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_score_engine.cache_clear()
+        self.addCleanup(get_score_engine.cache_clear)
+        self.write_season("2030", shifted_tables(0.5))
+
+    def write_season(self, season, tables):
+        path = self.dir / f"{season}.csv"
+        path.write_text(season_csv(tables), encoding="utf-8")
+        return f"{season}-{content_hash(path.read_bytes())}"
+
+    def test_get_score_engine(self):
+        self.assertEqual(get_score_engine(BUILTIN_VERSION).version, BUILTIN_VERSION)
+        version = current_score_table_version()
+        self.assertRegex(version, r"^2030-[0-9a-f]{16}$")
+        self.assertEqual(get_score_engine(version).version, version)
+        self.assertEqual(get_score_engine("2030").version, version)
+        with self.assertRaises(LookupError):
+            get_score_engine("2030-0123456789abcdef")
+
+    def test_hashed_version_outlives_an_edited_csv(self):
+        version = current_score_table_version()
+        edited = self.write_season("2030", shifted_tables(1))
+        self.assertNotEqual(edited, version)
+        scores = [
+            get_score_engine(v).score(12, "M", "ladder", 3.5, None)
+            for v in (version, edited)
+        ]
+        self.assertEqual(
+            scores,
+            [
+                ScoreEngine(shifted_tables(seconds)).score(12, "M", "ladder", 3.5, None)
+                for seconds in (0.5, 1)
+            ],
+        )
+        self.assertNotEqual(*scores)
+
+    def test_pinned_event_keeps_its_scores(self):
+        event = Event.objects.create(name="2030")
+        self.assertEqual(event.score_table_version, current_score_table_version())
+        person = Person.objects.create(
+            name="Test",
+            surname="Test",
+            date_of_birth=date(date.today().year - 12, 1, 1),
+            gender="M",
+        )
+        result = TestResult.objects.create(
+            person=person, event=event, ladder_time_1=3.5, ladder_time_2=3.6
+        )
+        recalculate_test_results(TestResult.objects.all())
+        result.refresh_from_db()
+        score = ScoreEngine(shifted_tables(0.5)).score(12, "M", "ladder", 3.5, None)
+        self.assertNotEqual(score, calculate_score(12, "M", "ladder", 3.5, None))
+        self.assertEqual(result.ladder_score, score)
+
+        # A new season is published and the old one's CSV edited
+        self.write_season("2030", shifted_tables(1))
+        self.write_season("2031", SCORE_TABLES)
+        get_score_engine.cache_clear()
+        with override_settings(SCORE_TABLE_SEASON="2031"):
+            self.assertEqual(engine_for_event(event).version, event.score_table_version)
+            recalculate_test_results(TestResult.objects.all())
+        result.refresh_from_db()
+        self.assertEqual(result.ladder_score, score)
+        self.assertEqual(result.scored_table_version, event.score_table_version)
+
+    def test_unpinned_event_uses_builtin_tables(self):
+        event = Event(name="Unpinned", score_table_version="")
+        self.assertEqual(engine_for_event(event).version, BUILTIN_VERSION)
+
+
+class ScoreTableMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("tests", target)])
+        return executor.loader.project_state([("tests", target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes("tests"))
+
+    def test_existing_events_are_pinned_to_builtin(self):
+        apps = self.migrate("0007_alter_person_date_of_birth_alter_person_gender")
+        apps.get_model("tests", "Event").objects.create(name="Old")
+        apps = self.migrate("0008_event_score_table_version")
+        event = apps.get_model("tests", "Event").objects.get()
+        self.assertEqual(event.score_table_version, BUILTIN_VERSION)
+
+    def test_season_pins_get_hashed(self):
+        apps = self.migrate("0012_testresult_person_version")
+        Event = apps.get_model("tests", "Event")
+        for version in ["2024", BUILTIN_VERSION, "", "1999"]:
+            Event.objects.create(name=version, score_table_version=version)
+        with TemporaryDirectory() as tmp:
+            with override_settings(SCORE_TABLE_CACHE_DIR=Path(tmp)):
+                apps = self.migrate("0013_pin_events_to_hashed_score_tables")
+        content = (settings.SCORE_TABLE_DIR / "2024.csv").read_bytes()
+        self.assertEqual(
+            dict(
+                apps.get_model("tests", "Event").objects.values_list(
+                    "name", "score_table_version"
+                )
+            ),
+            {
+                "2024": f"2024-{content_hash(content)}",
+                BUILTIN_VERSION: BUILTIN_VERSION,
+                "": "",
+                # No CSV to pin it to
+                "1999": "1999",
+            },
+        )
+
+
+class RecalculateScoresTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.team = Team.objects.create(name="Team")
+        self.team.admins.add(self.user)
+        self.people = [
+            Person.objects.create(
+                name=f"Person {i}",
+                surname="Test",
+                date_of_birth=date(2010 + i % 5, 1, 1),
+                gender="MF"[i % 2],
+                height=150,
+                team=self.team,
+            )
+            for i in range(6)
+        ]
+        # The measured height wins over the base height
+        PersonMeasurement.objects.create(
+            person=self.people[0],
+            measurement_date=date(2024, 1, 1),
+            height=140,
+            weight=40,
+        )
+        PersonMeasurement.objects.create(
+            person=self.people[0],
+            measurement_date=date(2024, 6, 1),
+            height=160,
+            weight=45,
+        )
+        for person in self.people:
+            for i in range(3):
+                TestResult.objects.create(
+                    person=person,
+                    ladder_time_1=3.0 + i / 10,
+                    ladder_time_2=3.1,
+                    medicimbal_throw_1=6.5,
+                    medicimbal_throw_2=7.0 + i,
+                    medicimbal_throw_3=5.0,
+                    jet_laps=20 + i,
+                    jet_sides=2,
+                    beep_test_level=6,
+                    beep_test_laps=i + 1,
+                    **{field: 90.0 + i for field in Y_TEST_FIELDS},
+                )
+
+    def test_scores_match_calculate_score(self):
+        recalculate_scores(self.user)
+
+        for result in TestResult.objects.select_related("person"):
+            person = result.person
+            height = 160 if person == self.people[0] else 150
+            reaches = [getattr(result, field) for field in Y_TEST_FIELDS]
+            self.assertEqual(
+                result.ladder_score,
+                calculate_score(
+                    person.age,
+                    person.gender,
+                    "ladder",
+                    result.ladder_time_1,
+                    result.ladder_time_2,
+                ),
+            )
+            self.assertEqual(result.jet_distance, result.jet_laps * 40 + 20)
+            self.assertEqual(
+                result.y_test_score,
+                calculate_score(person.age, person.gender, "y_test", height, *reaches),
+            )
+            self.assertEqual(
+                result.y_test_index, calculate_y_test_index(height, *reaches)
+            )
+            self.assertEqual(
+                result.strength_score,
+                (result.medicimbal_score + result.triple_jump_score) / 2,
+            )
+
+    def test_query_count_per_chunk(self):
+        # Select, latest heights and bulk update for each of the 5 chunks,
+        # plus the final empty select
+        with self.assertNumQueries(5 * 3 + 1):
+            updated = recalculate_test_results(TestResult.objects.all(), chunk_size=4)
+        self.assertEqual(updated, 18)
+
+    def test_incremental_recalculation(self):
+        recalculate_scores(self.user)
+        self.assertFalse(TestResult.objects.filter(scores_dirty=True).exists())
+        self.assertEqual(recalculate_scores(self.user), 0)
+
+        person = Person.objects.get(pk=self.people[1].pk)
+        person.date_of_birth = date(2000, 1, 1)
+        person.save()
+        self.assertEqual(
+            set(TestResult.objects.filter(scores_dirty=True)),
+            set(person.testresult_set.all()),
+        )
+        # Only the changed person's results are rescored and written
+        self.assertEqual(recalculate_scores(self.user), 3)
+        for result in person.testresult_set.all():
+            self.assertEqual(
+                result.medicimbal_score,
+                calculate_score(
+                    person.age,
+                    person.gender,
+                    "medicimbal",
+                    result.medicimbal_throw_1,
+                    result.medicimbal_throw_2,
+                    result.medicimbal_throw_3,
+                ),
+            )
+
+    def test_unchanged_scores_are_not_written(self):
+        recalculate_scores(self.user)
+        result = TestResult.objects.get(pk=TestResult.objects.first().pk)
+        result.test_name = "Renamed"
+        result.save()
+        self.assertFalse(TestResult.objects.get(pk=result.pk).scores_dirty)
+
+        PersonMeasurement.objects.create(
+            person=self.people[2],
+            measurement_date=date(2024, 1, 1),
+            height=150,
+            weight=40,
+        )
+        # Same height as before, only the dirty flags are cleared
+        scores = list(
+            TestResult.objects.order_by("pk").values_list(
+                "y_test_score", "agility_score"
+            )
+        )
+        with self.assertNumQueries(5):
+            self.assertEqual(recalculate_scores(self.user), 3)
+        self.assertEqual(
+            list(
+                TestResult.objects.order_by("pk").values_list(
+                    "y_test_score", "agility_score"
+                )
+            ),
+            scores,
+        )
+
+    def test_command_resumes_from_checkpoint(self):
+        checkpoint = Path(self.enterContext(TemporaryDirectory())) / "checkpoint"
+        calls = []
+
+        def interrupted(chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return recalculate_chunk(chunk)
+
+        options = {"chunk_size": 4, "checkpoint": checkpoint, "verbosity": 0}
+        with mock.patch(
+            "tests.management.commands.recalculate_scores.recalculate_chunk",
+            interrupted,
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("recalculate_scores", **options)
+        saved = json.loads(checkpoint.read_text())
+        self.assertEqual(saved["last_pk"], calls[0][-1].pk)
+        self.assertEqual(saved["processed"], 4)
+
+        stdout = StringIO()
+        call_command("recalculate_scores", stdout=stdout, **options)
+        self.assertIn("Recalculated 18 results, 18 changed", stdout.getvalue())
+        self.assertFalse(checkpoint.exists())
+        self.assertFalse(TestResult.objects.filter(scores_dirty=True).exists())
+
+    def test_in_database_recalculation(self):
+        person = Person.objects.get(pk=self.people[1].pk)
+        person.date_of_birth = date(2000, 1, 1)
+        person.save()
+        recalculate_test_results(TestResult.objects.exclude(person=person))
+
+        # Only the stale results are rescored, in one statement after looking
+        # up the events' table versions for the stale filter and the tables
+        with self.assertNumQueries(3):
+            self.assertEqual(recalculate_scores(self.user, in_database=True), 3)
+        self.assertFalse(TestResult.objects.filter(scores_dirty=True).exists())
+        for result in person.testresult_set.all():
+            self.assertEqual(
+                result.medicimbal_score,
+                calculate_score(
+                    person.age,
+                    person.gender,
+                    "medicimbal",
+                    result.medicimbal_throw_1,
+                    result.medicimbal_throw_2,
+                    result.medicimbal_throw_3,
+                ),
+            )
+
+    def test_staged_recalculation(self):
+        recalculate_test_results(TestResult.objects.all())
+        scores = list(
+            TestResult.objects.order_by("pk").values_list(*RECALCULATED_FIELDS)
+        )
+        TestResult.objects.update(ladder_score=0, speed_score=None, scores_dirty=True)
+
+        # A submission while the recalculation runs is not overwritten
+        submitted = TestResult.objects.order_by("pk").last()
+
+        def submit_during(chunk):
+            changed = score_chunk(chunk)
+            if chunk[-1].pk == submitted.pk:
+                TestResult.objects.filter(pk=submitted.pk).update(ladder_time_1=2.5)
+            return changed
+
+        with mock.patch("tests.recalculate_scores.score_chunk", submit_during):
+            updated = recalculate_test_results_staged(
+                TestResult.objects.all(), chunk_size=5
+            )
+        self.assertEqual(updated, 17)
+        self.assertEqual(
+            list(TestResult.objects.order_by("pk").values_list(*RECALCULATED_FIELDS))[
+                :-1
+            ],
+            scores[:-1],
+        )
+        submitted.refresh_from_db()
+        self.assertEqual(submitted.ladder_score, 0)
+        self.assertTrue(submitted.scores_dirty)
+
+    def test_staged_recalculation_person_change(self):
+        TestResult.objects.update(ladder_score=0, scores_dirty=True)
+        # A person changed after their results were staged keeps them dirty
+        person = Person.objects.get(pk=self.people[0].pk)
+
+        def change_person_during(chunk):
+            changed = score_chunk(chunk)
+            if chunk[0].pk == TestResult.objects.order_by("pk").first().pk:
+                person.gender = "F"
+                person.save()
+            return changed
+
+        with mock.patch("tests.recalculate_scores.score_chunk", change_person_during):
+            updated = recalculate_test_results_staged(
+                TestResult.objects.all(), chunk_size=5
+            )
+        self.assertEqual(updated, 15)
+        for result in person.testresult_set.all():
+            self.assertEqual(result.ladder_score, 0)
+            self.assertTrue(result.scores_dirty)
+        self.assertFalse(
+            TestResult.objects.exclude(person=person).filter(scores_dirty=True).exists()
+        )
+
+        # The next run scores them with the new gender
+        recalculate_test_results(TestResult.objects.filter(scores_dirty=True))
+        for result in person.testresult_set.all():
+            self.assertEqual(
+                result.ladder_score,
+                calculate_score(
+                    result.age_at_test,
+                    "F",
+                    "ladder",
+                    result.ladder_time_1,
+                    result.ladder_time_2,
+                ),
+            )
+
+    def test_new_score_table_version(self):
+        recalculate_scores(self.user)
+        TestResult.objects.update(scored_table_version="outdated")
+        self.assertEqual(recalculate_scores(self.user), 18)
+        self.assertEqual(recalculate_scores(self.user), 0)
+
+
+class ParallelRecalculationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("admin", is_superuser=True)
+        for t in range(3):
+            team = Team.objects.create(name=f"Team {t}")
+            team.admins.add(self.user)
+            event = Event.objects.create(name=f"Event {t}", team=team)
+            for i in range(4):
+                person = Person.objects.create(
+                    name=f"Person {i}",
+                    surname="Test",
+                    date_of_birth=date(2008 + i, 1, 1),
+                    gender="MF"[i % 2],
+                    team=team,
+                )
+                TestResult.objects.create(
+                    person=person,
+                    event=event if i % 2 else None,
+                    ladder_time_1=2.9 + t / 10,
+                    ladder_time_2=3.0,
+                    beep_test_level=5 + i,
+                    beep_test_laps=3,
+                )
+
+    def scores(self):
+        return list(
+            TestResult.objects.order_by("pk").values_list(
+                "ladder_score", "beep_test_score", "speed_score", "endurance_score"
+            )
+        )
+
+    def test_matches_serial_recalculation(self):
+        summary = recalculate_scores_parallel(self.user, workers=2)
+        self.assertEqual(summary["updated"], 12)
+        self.assertEqual(
+            sorted(shard["updated"] for shard in summary["shards"]), [4, 4, 4]
+        )
+        scores = self.scores()
+
+        TestResult.objects.update(ladder_score=0, beep_test_score=0)
+        recalculate_scores(self.user, full=True)
+        self.assertEqual(self.scores(), scores)
+
+    def test_shard_by_event(self):
+        summary = recalculate_scores_parallel(self.user, workers=2, shard_by="event")
+        # One shard per event and one for the results without an event
+        self.assertEqual(len(summary["shards"]), 4)
+        self.assertEqual(summary["updated"], 12)
+        self.assertFalse(TestResult.objects.filter(scores_dirty=True).exists())
+
+
+class ScoresOnTestDateTests(TestCase):
+    def setUp(self):
+        self.person = Person.objects.create(
+            name="Test",
+            surname="Person",
+            date_of_birth=date(2014, 3, 5),
+            gender="M",
+            height=140,
+        )
+        PersonMeasurement.objects.create(
+            person=self.person,
+            measurement_date=date(2025, 1, 1),
+            height=150,
+            weight=40,
+        )
+
+    def test_snapshot_on_create(self):
+        result = TestResult.objects.create(person=self.person)
+        self.assertEqual(result.age_at_test, self.person.age)
+        self.assertEqual(result.height_at_test, 150)
+
+    def test_scores_use_age_and_height_on_test_date(self):
+        result = TestResult.objects.create(
+            person=self.person,
+            medicimbal_throw_1=4.5,
+            medicimbal_throw_2=5,
+            medicimbal_throw_3=5.5,
+            **{field: 80 for field in Y_TEST_FIELDS},
+        )
+        # The athlete turned 11 and grew after the test
+        TestResult.objects.filter(pk=result.pk).update(test_date=date(2025, 3, 4))
+        PersonMeasurement.objects.create(
+            person=self.person,
+            measurement_date=date(2025, 6, 1),
+            height=160,
+            weight=45,
+        )
+        recalculate_test_results(TestResult.objects.all())
+
+        result.refresh_from_db()
+        self.assertEqual(result.age_at_test, 10)
+        self.assertEqual(result.height_at_test, 150)
+        self.assertEqual(
+            result.medicimbal_score,
+            calculate_score(10, "M", "medicimbal", 4.5, 5, 5.5),
+        )
+        self.assertEqual(result.y_test_index, calculate_y_test_index(150, *[80] * 12))
+
+        # Later measurements and birthdays leave the result as it is
+        self.assertEqual(recalculate_test_results(TestResult.objects.all()), 0)
+
+    def test_editing_the_test_date_rescores(self):
+        user = User.objects.create_superuser("admin")
+        result = TestResult.objects.create(
+            person=self.person,
+            test_name="Spring",
+            ladder_time_1=3.4,
+            ladder_time_2=3.5,
+        )
+        TestResult.objects.filter(pk=result.pk).update(test_date=date(2024, 6, 1))
+        recalculate_test_results(TestResult.objects.all())
+        result.refresh_from_db()
+        self.assertEqual(result.age_at_test, 10)
+        self.assertEqual(result.height_at_test, 140)
+
+        # The test was actually taken after the athlete's 11th birthday
+        data = test_result_dict(result)
+        data["test_date"] = "2025-06-01"
+        response = self.client.put(
+            f"/api/results/{result.pk}",
+            data,
+            content_type="application/json",
+            **auth_headers(user),
+        )
+        self.assertEqual(response.status_code, 200)
+        result.refresh_from_db()
+        self.assertTrue(result.scores_dirty)
+        self.assertEqual(result.age_at_test, 11)
+        self.assertEqual(result.height_at_test, 150)
+
+        recalculate_test_results(stale_test_results(TestResult.objects.all()))
+        result.refresh_from_db()
+        self.assertFalse(result.scores_dirty)
+        self.assertEqual(
+            result.ladder_score, calculate_score(11, "M", "ladder", 3.4, 3.5)
+        )
+        self.assertNotEqual(
+            result.ladder_score, calculate_score(10, "M", "ladder", 3.4, 3.5)
+        )
+
+
+class RescoreInDatabaseTests(TestCase):
+    """The compiled SQL must score exactly like recalculate_test_results"""
+
+    def setUp(self):
+        rng = random.Random(0)
+        team = Team.objects.create(name="Team")
+        events = [
+            None,
+            Event.objects.create(name="Builtin", score_table_version="builtin"),
+            Event.objects.create(name="2024", score_table_version="2024"),
+            Event.objects.create(name="Unpinned", score_table_version=""),
+        ]
+        for i in range(60):
+            person = Person.objects.create(
+                name=f"Person {i}",
+                surname="Test",
+                date_of_birth=(
+                    None if i % 17 == 0 else date(2004 + i % 15, 1 + i % 12, 1 + i % 28)
+                ),
+                gender=None if i % 23 == 0 else "MF"[i % 2],
+                height=None if i % 13 == 0 else rng.uniform(130, 195),
+                team=team,
+            )
+            if i % 3:
+                PersonMeasurement.objects.create(
+                    person=person,
+                    measurement_date=date(2024, 1 + i % 12, 1),
+                    height=rng.uniform(130, 195),
+                    weight=50,
+                )
+
+            def trial(test):
+                value = sweep_values(test)
+                return rng.choice([None, 0, *rng.sample(value, 5)])
+
+            for event in events:
+                TestResult.objects.create(
+                    person=person,
+                    event=event,
+                    ladder_time_1=trial("ladder"),
+                    ladder_time_2=trial("ladder"),
+                    brace_time_1=trial("brace"),
+                    brace_time_2=trial("brace"),
+                    hexagon_time_cw=trial("hexagon"),
+                    hexagon_time_ccw=trial("hexagon"),
+                    medicimbal_throw_1=trial("medicimbal"),
+                    medicimbal_throw_2=trial("medicimbal"),
+                    medicimbal_throw_3=trial("medicimbal"),
+                    triple_jump_distance_1=trial("triple_jump"),
+                    triple_jump_distance_2=trial("triple_jump"),
+                    triple_jump_distance_3=trial("triple_jump"),
+                    jet_laps=rng.choice([None, 0, rng.randint(10, 40)]),
+                    jet_sides=rng.choice([None, rng.randint(1, 3)]),
+                    beep_test_level=rng.choice([None, rng.randint(1, 15)]),
+                    beep_test_laps=rng.choice([None, 0, rng.randint(1, 12)]),
+                    **{
+                        field: rng.choice([rng.uniform(40, 130)] * 12 + [None])
+                        for field in Y_TEST_FIELDS
+                    },
+                )
+
+    def scores(self):
+        return list(TestResult.objects.order_by("pk").values_list(*RECALCULATED_FIELDS))
+
+    def test_matches_recalculate_test_results(self):
+        test_results = TestResult.objects.all()
+        self.assertEqual(rescore_in_database(test_results), 240)
+        in_database = self.scores()
+
+        TestResult.objects.update(scores_dirty=True, scored_table_version="")
+        recalculate_test_results(test_results)
+        self.assertEqual(in_database, self.scores())
+
+    def test_age_and_height_on_test_date(self):
+        person = Person.objects.filter(measurements__isnull=False).first()
+        person.date_of_birth = date(2012, 2, 29)
+        person.save()
+        test_results = TestResult.objects.filter(person=person)
+        for day in (
+            date(2023, 12, 31),
+            date(2024, 2, 28),
+            date(2024, 2, 29),
+            date(2025, 3, 1),
+        ):
+            test_results.update(test_date=day, scores_dirty=True)
+            recalculate_test_results(TestResult.objects.all())
+            scores = self.scores()
+            rescore_in_database(TestResult.objects.all())
+            self.assertEqual(self.scores(), scores)
+
+
+def auth_headers(user):
+    token = jwt.encode({"username": user.username}, settings.SECRET_KEY, "HS256")
+    return {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+
+class RendererTests(SimpleTestCase):
+    def test_dates_are_written_like_ninja_does(self):
+        data = {
+            "aware": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=UTC),
+            "naive": datetime(2024, 5, 1, 12, 30, 15),
+            "date": date(2024, 5, 1),
+            "time": time(8, 5, 0, 999999),
+        }
+        rendered = ORJSONRenderer().render(None, data, response_status=200)
+        self.assertEqual(
+            json.loads(rendered),
+            {
+                "aware": "2024-05-01T12:30:15.123Z",
+                "naive": "2024-05-01T12:30:15",
+                "date": "2024-05-01",
+                "time": "08:05:00.999",
+            },
+        )
+
+
+class PeopleApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.teams = [Team.objects.create(name=f"Team {i}") for i in range(2)]
+        for i in range(6):
+            person = Person.objects.create(
+                name=f"Jan {i}",
+                surname="Novák" if i % 2 else "Svoboda",
+                date_of_birth=date(2012, 5, 1),
+                height=150,
+                weight=40,
+                team=self.teams[i % 2],
+            )
+            for month in (1, 6):
+                PersonMeasurement.objects.create(
+                    person=person,
+                    measurement_date=date(2024, month, 1),
+                    height=150 + i + month,
+                    weight=40 + month,
+                )
+        Person.objects.create(name="Eva", surname="Nová", height=140)
+
+    def get(self, query=""):
+        response = self.client.get(f"/api/people{query}", **auth_headers(self.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["items"]
+
+    def test_latest_measurements_in_one_query(self):
+        # The user and the people, however many people and measurements
+        with self.assertNumQueries(2):
+            people = self.get()
+        self.assertEqual(len(people), 7)
+        for person in people:
+            expected = Person.objects.get(pk=person["id"])
+            self.assertEqual(person["height"], expected.latest_height)
+            self.assertEqual(person["weight"], expected.latest_weight)
+            self.assertEqual(person["team_id"], expected.team_id)
+            self.assertEqual(person["age"], expected.age)
+
+    def test_filters(self):
+        team = self.teams[1]
+        self.assertEqual(
+            [person["id"] for person in self.get(f"?team_id={team.pk}")],
+            list(team.person_set.order_by("id").values_list("id", flat=True)),
+        )
+        self.assertEqual(
+            {person["surname"] for person in self.get("?search=nov")},
+            {"Novák", "Nová"},
+        )
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin")
+        team = Team.objects.create(name="Team")
+        team.admins.add(self.user)
+        for i in range(7):
+            User.objects.create_user(f"coach {i}").teams.add(team)
+            Event.objects.create(name=f"Event {i}", team=team)
+            person = Person.objects.create(name=f"Jan {i}", surname="Novák", team=team)
+            TestResult.objects.create(
+                person=person, team=team, test_name="Test", ladder_time_1=3.0
+            )
+
+    def pages(self, url):
+        """Follow the next links from ``url``, returns the pages' item ids"""
+        pages = []
+        while url:
+            response = self.client.get(url, **auth_headers(self.user))
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            pages.append([item["id"] for item in page["items"]])
+            url = page["next"]
+        return pages
+
+    def test_list_endpoints(self):
+        team = Team.objects.get()
+        endpoints = {
+            "/api/results": TestResult.objects.all(),
+            "/api/people": Person.objects.all(),
+            f"/api/team/{team.pk}/results": TestResult.objects.all(),
+            "/api/results/test-type/ladder": TestResult.objects.all(),
+            "/api/users": User.objects.all(),
+            "/api/events": Event.objects.all(),
+        }
+        for url, expected in endpoints.items():
+            with self.subTest(url):
+                pages = self.pages(f"{url}?limit=3")
+                self.assertEqual(
+                    [len(page) for page in pages[:-1]], [3] * (len(pages) - 1)
+                )
+                self.assertEqual(
+                    sum(pages, []),
+                    list(expected.order_by("id").values_list("id", flat=True)),
+                )
+
+    def test_queries_per_page_are_constant(self):
+        # The user, then the users page with its teams and groups prefetched
+        with self.assertNumQueries(4):
+            self.pages("/api/users?limit=100")
+        # The user is cached by now
+        with self.assertNumQueries(1):
+            self.pages("/api/results?limit=100")
+
+    def test_result_rows(self):
+        from .api import TestResultSchema
+
+        result = TestResult.objects.first()
+        for url in ("/api/results", f"/api/results/{result.person_id}"):
+            with self.subTest(url):
+                response = self.client.get(url, **auth_headers(self.user))
+                self.assertEqual(
+                    response["Content-Type"], "application/json; charset=utf-8"
+                )
+                rows = response.json()
+                row = (rows["items"] if "items" in rows else rows)[0]
+                self.assertEqual(set(row), set(TestResultSchema.model_fields))
+                self.assertEqual(row["team"], "Team")
+                self.assertEqual(row["person_id"], result.person_id)
+                self.assertEqual(row["test_date"], result.test_date.isoformat())
+                self.assertEqual(row["ladder_time_1"], 3.0)
+
+    def test_rows_added_between_pages(self):
+        response = self.client.get("/api/events?limit=4", **auth_headers(self.user))
+        first = response.json()
+        Event.objects.filter(pk=first["items"][0]["id"]).delete()
+        Event.objects.create(name="New")
+        self.assertEqual(
+            self.pages(first["next"]),
+            [list(Event.objects.order_by("id").values_list("id", flat=True)[3:])],
+        )
+
+    def test_invalid_cursor_and_limit(self):
+        cursors = [encode_cursor(values) for values in ([1, 2], ["abc"], [None], [[1]])]
+        for query in (
+            "cursor=nonsense",
+            "cursor=e30",
+            "limit=0",
+            "limit=100000",
+            *(f"cursor={cursor}" for cursor in cursors),
+        ):
+            with self.subTest(query):
+                response = self.client.get(
+                    f"/api/events?{query}", **auth_headers(self.user)
+                )
+                self.assertEqual(
+                    response.status_code, 400 if query.startswith("cursor") else 422
+                )
+
+    def test_cursor_values_are_converted(self):
+        first = Event.objects.order_by("pk").first()
+        response = self.client.get(
+            f"/api/events?cursor={encode_cursor([str(first.pk)])}",
+            **auth_headers(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(first.pk, [event["id"] for event in response.json()["items"]])
+
+    def test_users_requires_superuser(self):
+        coach = User.objects.get(username="coach 0")
+        response = self.client.get("/api/users", **auth_headers(coach))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"detail": "Not authorized"})
+
+
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach", password="secret")
+        self.team = Team.objects.create(name="Team")
+
+    def me(self):
+        response = self.client.get("/api/users/me", **auth_headers(self.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_user_is_cached(self):
+        with self.assertNumQueries(1):
+            self.me()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me()["username"], "coach")
+
+    def test_membership_changes_invalidate(self):
+        self.assertEqual(self.me()["teams"], [])
+        self.team.admins.add(self.user)
+        self.assertEqual(self.me()["teams"], [self.team.pk])
+
+        self.user.groups.add(Group.objects.create(name="Adjudicators"))
+        self.assertEqual(self.me()["groups"], ["Adjudicators"])
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertTrue(self.me()["is_superuser"])
+
+        self.user.delete()
+        response = self.client.get("/api/users/me", **auth_headers(self.user))
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_keeps_cache(self):
+        self.me()
+        response = self.client.post(
+            "/api/token",
+            {"username": "coach", "password": "secret"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            self.me()
+
+    @override_settings(
+        AUTH_CACHE_BACKEND="auth",
+        CACHES={"auth": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_shared_cache(self):
+        with self.assertNumQueries(1):
+            self.me()
+        with self.assertNumQueries(0):
+            self.me()
+        self.team.admins.add(self.user)
+        self.assertEqual(self.me()["teams"], [self.team.pk])
+
+
+class TeamStatisticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.team = Team.objects.create(name="Team")
+        other_team = Team.objects.create(name="Other")
+        for i in range(6):
+            person = Person.objects.create(
+                name=f"Jan {i}",
+                surname="Novák",
+                date_of_birth=date(2012, 5, 1),
+                gender="M",
+                team=self.team if i % 3 else other_team,
+            )
+            TestResult.objects.create(
+                person=person,
+                ladder_time_1=3.0 + i / 10,
+                ladder_time_2=3.2,
+                medicimbal_throw_1=4 + i if i % 2 else None,
+                medicimbal_throw_2=5,
+                medicimbal_throw_3=5.5,
+            )
+        recalculate_test_results(TestResult.objects.all())
+
+    def expected(self):
+        """The statistics aggregated one test and one aggregate at a time"""
+        from django.db.models import Avg, Max, Min
+
+        from .statistics import COMPOSITE_SCORES, TEST_TYPES
+
+        stats = {}
+        for name in TEST_TYPES + [f"{score}_composite" for score in COMPOSITE_SCORES]:
+            field_name = f"{name.removesuffix('_composite')}_score"
+            results = TestResult.objects.filter(person__team=self.team).exclude(
+                **{field_name: None}
+            )
+            stats[name] = {
+                "avg_score": results.aggregate(Avg(field_name))[f"{field_name}__avg"],
+                "max_score": results.aggregate(Max(field_name))[f"{field_name}__max"],
+                "min_score": results.aggregate(Min(field_name))[f"{field_name}__min"],
+            }
+            if name in TEST_TYPES:
+                stats[name]["total_tests"] = results.count()
+        return stats
+
+    def get(self):
+        response = self.client.get(
+            f"/api/statistics/team/{self.team.pk}", **auth_headers(self.user)
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_statistics_in_one_query_then_cached(self):
+        self.client.get("/api/users/me", **auth_headers(self.user))  # Caches the user
+        expected = self.expected()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(), expected)
+        with self.assertNumQueries(0):
+            self.get()
+
+    def test_writes_invalidate(self):
+        self.get()
+        person = self.team.person_set.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            result = TestResult.objects.create(person=person, ladder_score=20)
+        self.assertEqual(self.get(), self.expected())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result.delete()
+        self.assertEqual(self.get(), self.expected())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            person.team = None
+            person.save()
+        self.assertEqual(self.get(), self.expected())
+
+        TestResult.objects.update(ladder_score=0, scores_dirty=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            recalculate_test_results(TestResult.objects.all())
+        self.assertEqual(self.get(), self.expected())
+
+    def test_invalidation_reuses_the_loaded_person(self):
+        self.get()
+        result = TestResult.objects.select_related("person").get(
+            person=self.team.person_set.first()
+        )
+        result.ladder_score = 20
+        # Only the update
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            result.save()
+        self.assertEqual(self.get(), self.expected())
+
+        result = TestResult.objects.get(pk=result.pk)
+        result.ladder_score = 19
+        # The update and the person's team
+        with self.assertNumQueries(2), self.captureOnCommitCallbacks(execute=True):
+            result.save()
+        self.assertEqual(self.get(), self.expected())
+
+
+class PersonProgressTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.person = Person.objects.create(name="Jan", surname="Novák")
+        self.events = [Event.objects.create(name=f"Event {i}") for i in range(2)]
+        days = [date(2024, 9, 1), date(2025, 3, 1), date(2025, 9, 1)]
+        for i, day in enumerate(days):
+            result = TestResult.objects.create(
+                person=self.person,
+                event=self.events[i // 2],
+                ladder_score=10 + i,
+                medicimbal_score=0 if i else 5,
+                jet_score=7 + i,
+            )
+            TestResult.objects.filter(pk=result.pk).update(test_date=day)
+
+    def get(self, query=""):
+        response = self.client.get(
+            f"/api/statistics/person/{self.person.pk}{query}",
+            **auth_headers(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_progress_in_one_query(self):
+        self.client.get("/api/users/me", **auth_headers(self.user))
+        with self.assertNumQueries(1):
+            progress = self.get()
+        self.assertEqual(progress["ladder"]["improvement"], 2)
+        self.assertEqual(progress["ladder"]["improvement_percentage"], 20)
+        self.assertEqual(
+            progress["ladder"]["scores_over_time"],
+            [
+                {"date": "2024-09-01", "score": 10},
+                {"date": "2025-03-01", "score": 11},
+                {"date": "2025-09-01", "score": 12},
+            ],
+        )
+        self.assertEqual(progress["medicimbal"]["improvement"], -5)
+        self.assertEqual(progress["medicimbal"]["improvement_percentage"], -100)
+        # No percentage from a first score of 0
+        self.assertIsNone(progress["y_test"]["improvement_percentage"])
+
+    def test_filters(self):
+        progress = self.get(f"?event_id={self.events[0].pk}")
+        self.assertEqual(progress["ladder"]["improvement"], 1)
+        self.assertEqual(len(progress["jet"]["scores_over_time"]), 2)
+
+        progress = self.get("?date_from=2025-01-01&date_to=2025-12-31")
+        self.assertEqual(progress["ladder"]["improvement"], 1)
+        self.assertEqual(self.get("?date_from=2025-06-01"), {})
+
+
+class TeamProgressTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.team = Team.objects.create(name="Team")
+        self.event = Event.objects.create(name="Event")
+        self.people = [
+            Person.objects.create(name="Jan", surname=surname, team=team)
+            for surname, team in [
+                ("Novák", self.team),
+                ("Dvořák", self.team),
+                ("Svoboda", Team.objects.create(name="Other")),
+            ]
+        ]
+        days = [date(2025, 9, 1), date(2024, 9, 1), date(2025, 3, 1)]
+        for i, person in enumerate(self.people):
+            for j, day in enumerate(days[: i + 1]):
+                result = TestResult.objects.create(
+                    person=person,
+                    event=self.event if j else None,
+                    ladder_score=10 * i + j,
+                )
+                TestResult.objects.filter(pk=result.pk).update(test_date=day)
+
+    def get(self):
+        response = self.client.get(
+            f"/api/statistics/team/{self.team.pk}/progress", **auth_headers(self.user)
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_progress_in_one_query_then_cached(self):
+        self.client.get("/api/users/me", **auth_headers(self.user))
+        with self.assertNumQueries(1):
+            progress = self.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(), progress)
+
+        self.assertEqual(progress["team_id"], self.team.pk)
+        dvorak, novak = progress["people"]
+        self.assertEqual(novak["person_id"], self.people[0].pk)
+        self.assertEqual(novak["tests"]["ladder"]["delta"], 0)
+        self.assertEqual(
+            dvorak["tests"]["ladder"],
+            {
+                # The result of the second day was tested first
+                "first_score": 11,
+                "last_score": 10,
+                "delta": -1,
+                "scores_over_time": [
+                    {"date": "2024-09-01", "event_id": self.event.pk, "score": 11},
+                    {"date": "2025-09-01", "event_id": None, "score": 10},
+                ],
+            },
+        )
+
+    def test_writes_invalidate(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            TestResult.objects.create(person=self.people[0], ladder_score=5)
+        novak = self.get()["people"][1]
+        self.assertEqual(novak["tests"]["ladder"]["last_score"], 5)
+
+
+class BeepTestBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.team = Team.objects.create(name="Team")
+        Event.objects.create(name="Old", team=self.team, is_active=False)
+        self.event = Event.objects.create(name="Test", team=self.team)
+        Event.objects.create(name="Later", team=self.team)
+        self.people = [
+            Person.objects.create(
+                name=f"Jan {i}",
+                surname="Novák",
+                date_of_birth=date(2008 + i, 5, 1),
+                gender="MF"[i % 2],
+                team=self.team,
+            )
+            for i in range(6)
+        ]
+        self.no_team = Person.objects.create(name="Petr", surname="Král")
+        self.saved = TestResult.objects.create(
+            person=self.people[0], event=self.event, ladder_score=12
+        )
+
+    def post(self, items):
+        response = self.client.post(
+            "/api/beep-test/batch",
+            items,
+            content_type="application/json",
+            **auth_headers(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def items(self, people):
+        return [
+            {
+                "person_id": person.pk,
+                "beep_test_level": 3 + i,
+                "beep_test_laps": i,
+                "max_hr": 190,
+            }
+            for i, person in enumerate(people)
+        ]
+
+    def test_saves_and_scores(self):
+        outcomes = self.post(self.items(self.people))
+        self.assertEqual(TestResult.objects.count(), len(self.people))
+        for i, (person, outcome) in enumerate(zip(self.people, outcomes)):
+            self.assertEqual(outcome["person_id"], person.pk)
+            self.assertTrue(outcome["success"])
+            result = TestResult.objects.get(person=person)
+            total_laps = calculate_beep_test_total_laps(3 + i, i)
+            self.assertEqual(result.event, self.event)
+            self.assertEqual(result.team, self.team)
+            self.assertEqual(result.test_name, "Test")
+            self.assertEqual(result.beep_test_total_laps, total_laps)
+            self.assertEqual(result.age_at_test, person.age)
+            self.assertEqual(
+                result.beep_test_score,
+                calculate_score(person.age, person.gender, "beep_test", total_laps),
+            )
+            self.assertEqual(result.endurance_score, result.beep_test_score / 2)
+            self.assertEqual(outcome["result"]["id"], result.pk)
+            self.assertEqual(outcome["result"]["team"], "Team")
+            self.assertEqual(
+                outcome["result"]["beep_test_score"], result.beep_test_score
+            )
+
+        # The saved result of the event is updated
+        self.saved.refresh_from_db()
+        self.assertEqual(self.saved.ladder_score, 12)
+        self.assertEqual(self.saved.beep_test_level, 3)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        self.client.get("/api/users/me", **auth_headers(self.user))
+        # People, events, results, measurements, savepoint, insert, update
+        # and savepoint release
+        with self.assertNumQueries(8):
+            self.post(self.items(self.people[:2]))
+        with self.assertNumQueries(8):
+            self.post(self.items(self.people))
+
+    def test_item_errors(self):
+        self.people[1].gender = "X"
+        self.people[1].save()
+        items = self.items(self.people[:3]) + [
+            {"person_id": 0, "beep_test_level": 3, "beep_test_laps": 1},
+            {"person_id": self.no_team.pk, "beep_test_level": 3, "beep_test_laps": 1},
+        ]
+        items[2]["beep_test_level"] = 16
+        outcomes = self.post(items)
+        self.assertEqual(
+            [outcome["success"] for outcome in outcomes],
+            [True, False, False, False, False],
+        )
+        self.assertEqual(
+            outcomes[1]["error"], "Invalid beep test values - check input data"
+        )
+        self.assertEqual(
+            outcomes[2]["error"], "Invalid beep test values - check input data"
+        )
+        self.assertEqual(outcomes[3]["error"], "No Person matches the given query.")
+        self.assertEqual(
+            outcomes[4]["error"], "No active test found for this profile's team"
+        )
+        self.assertEqual(TestResult.objects.count(), 1)
+
+    def test_has_results_and_latest_in_one_query(self):
+        self.post(self.items(self.people[:3]))
+        older = TestResult.objects.create(
+            person=self.people[1], beep_test_level=2, beep_test_laps=1
+        )
+        TestResult.objects.filter(pk=older.pk).update(test_date=date(2024, 9, 1))
+        ids = [person.pk for person in self.people[:4]] + [0]
+        self.client.get("/api/users/me", **auth_headers(self.user))
+
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                "/api/beep-test/has-results",
+                {"profile_ids": ids},
+                content_type="application/json",
+                **auth_headers(self.user),
+            )
+        self.assertEqual(response.json(), {str(pk): pk in ids[:3] for pk in ids})
+
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                "/api/beep-test/batch-latest",
+                {"profile_ids": ids},
+                content_type="application/json",
+                **auth_headers(self.user),
+            )
+        latest = response.json()
+        self.assertEqual(set(latest), {str(pk) for pk in ids})
+        for person in self.people[:3]:
+            result = TestResult.objects.get(person=person, event=self.event)
+            self.assertEqual(latest[str(person.pk)]["id"], result.pk)
+            self.assertEqual(latest[str(person.pk)]["team"], "Team")
+        self.assertIsNone(latest[str(self.people[3].pk)])
+        self.assertIsNone(latest["0"])
+
+    def test_missing_age_scores_zero(self):
+        self.people[0].date_of_birth = None
+        self.people[0].save()
+        (outcome,) = self.post(self.items(self.people[:1]))
+        self.assertTrue(outcome["success"])
+        self.assertEqual(outcome["result"]["beep_test_score"], 0)
+
+
+class ResultBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        self.team = Team.objects.create(name="Team")
+        self.event = Event.objects.create(name="Test", team=self.team)
+        self.people = [
+            Person.objects.create(
+                name=f"Jan {i}",
+                surname="Novák",
+                date_of_birth=date(2009 + i, 5, 1),
+                gender="MF"[i % 2],
+                height=150,
+                team=self.team,
+            )
+            for i in range(3)
+        ]
+        PersonMeasurement.objects.create(
+            person=self.people[1],
+            measurement_date=date(2025, 1, 1),
+            height=160,
+            weight=50,
+        )
+        self.client.get("/api/users/me", **auth_headers(self.user))
+
+    def post(self, items):
+        response = self.client.post(
+            "/api/results/batch",
+            items,
+            content_type="application/json",
+            **auth_headers(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_saves_and_scores_every_test(self):
+        reaches = {field: 60 + i for i, field in enumerate(Y_TEST_FIELDS)}
+        first, second, third = self.people
+        items = [
+            (first, "ladder", {"ladder_time_1": 4.1, "ladder_time_2": 3.9}),
+            (first, "brace", {"brace_time_1": 6.5}),
+            (first, "medicimbal", {"medicimbal_throw_1": 5, "medicimbal_throw_3": 6.2}),
+            (second, "y_test", reaches),
+            (second, "hexagon", {"hexagon_time_cw": 11, "hexagon_time_ccw": 10.5}),
+            (third, "jet", {"jet_laps": 20, "jet_sides": 2}),
+            (third, "triple_jump", {"triple_jump_distance_2": 6.1}),
+            (third, "beep_test", {"beep_test_level": 7, "beep_test_laps": 4}),
+        ]
+        # People, events, results, measurements, savepoint, insert and release
+        with self.assertNumQueries(7):
+            outcomes = self.post(
+                [
+                    {"person_id": person.pk, "test_type": test, "values": values}
+                    for person, test, values in items
+                ]
+            )
+        self.assertTrue(all(outcome["success"] for outcome in outcomes))
+        # The tests of a person are saved in one result
+        self.assertEqual(TestResult.objects.count(), 3)
+
+        for (person, test, values), outcome in zip(items, outcomes):
+            result = TestResult.objects.get(person=person, event=self.event)
+            self.assertEqual(outcome["test_type"], test)
+            self.assertEqual(outcome["result"]["id"], result.pk)
+            if test == "y_test":
+                args = [160, *(values[field] for field in Y_TEST_FIELDS)]
+                self.assertEqual(result.y_test_index, calculate_y_test_index(*args))
+            elif test == "jet":
+                self.assertEqual(result.jet_distance, 820)
+                args = [820]
+            elif test == "beep_test":
+                self.assertEqual(result.beep_test_total_laps, 65)
+                args = [65]
+            else:
+                args = [values.get(field) for field in TEST_FIELDS[test]]
+            self.assertEqual(
+                getattr(result, f"{test}_score"),
+                calculate_score(person.age, person.gender, test, *args),
+            )
+        result = TestResult.objects.get(person=third)
+        self.assertEqual(
+            result.endurance_score, (result.beep_test_score + result.jet_score) / 2
+        )
+
+    def test_item_errors(self):
+        person = self.people[0].pk
+        items = [
+            {"person_id": person, "test_type": "sprint", "values": {}},
+            {"person_id": person, "test_type": "ladder", "values": {"jet_laps": 3}},
+            {
+                "person_id": person,
+                "test_type": "ladder",
+                "values": {"ladder_time_1": "4"},
+            },
+            {"person_id": person, "test_type": "jet", "values": {"jet_laps": 2.5}},
+            {"person_id": person, "test_type": "jet", "values": {"jet_laps": 2}},
+            {"person_id": person, "test_type": "y_test", "values": {}},
+            {"person_id": 0, "test_type": "ladder", "values": {"ladder_time_1": 4}},
+            {
+                "person_id": person,
+                "test_type": "ladder",
+                "values": {"ladder_time_1": 4},
+            },
+        ]
+        outcomes = self.post(items)
+        self.assertEqual(
+            [outcome["error"] for outcome in outcomes],
+            [
+                "Unknown test 'sprint'",
+                "Unknown value 'jet_laps' for the ladder test",
+                "ladder_time_1 must be a number or null",
+                "jet_laps must be a whole number or null",
+                "jet_laps and jet_sides are required",
+                "Invalid Y test values - check input data",
+                "No Person matches the given query.",
+                None,
+            ],
+        )
+        self.assertEqual(TestResult.objects.get().ladder_time_1, 4)
+
+    def test_single_endpoints_score_like_the_recalculation(self):
+        person = self.people[1]
+        # Measured ahead of time, the test is still scored with today's height
+        PersonMeasurement.objects.create(
+            person=person,
+            measurement_date=date.today() + timedelta(days=30),
+            height=190,
+            weight=60,
+        )
+        reaches = {field: 60 + i for i, field in enumerate(Y_TEST_FIELDS)}
+        paths = [
+            ("y-test", reaches),
+            ("ladder-test", {"ladder_time_1": 4.1, "ladder_time_2": 3.9}),
+            ("jet-test", {"jet_laps": 20, "jet_sides": 2}),
+        ]
+        with mock.patch.object(
+            Person, "height_on", autospec=True, side_effect=Person.height_on
+        ) as height_on:
+            for path, values in paths:
+                response = self.client.post(
+                    f"/api/{path}/{person.pk}",
+                    values,
+                    content_type="application/json",
+                    **auth_headers(self.user),
+                )
+                self.assertEqual(response.status_code, 200)
+        # Saving keeps the snapshot the endpoint scored with
+        self.assertEqual(height_on.call_count, len(paths))
+
+        result = TestResult.objects.get()
+        self.assertEqual(result.height_at_test, 160)
+        self.assertEqual(
+            result.y_test_index,
+            calculate_y_test_index(160, *(reaches[field] for field in Y_TEST_FIELDS)),
+        )
+        fields = [
+            field
+            for field in RECALCULATED_FIELDS
+            if field not in ("scores_dirty", "scored_table_version")
+        ]
+        scores = [getattr(result, field) for field in fields]
+        recalculate_test_results(TestResult.objects.all())
+        result.refresh_from_db()
+        self.assertEqual([getattr(result, field) for field in fields], scores)
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("coach")
+        team = Team.objects.create(name="Team")
+        team.admins.add(self.user)
+        person = Person.objects.create(
+            name="Jan",
+            surname="Novák",
+            date_of_birth=date(2012, 5, 1),
+            gender="M",
+            team=team,
+        )
+        TestResult.objects.create(person=person, ladder_time_1=3.0, ladder_time_2=3.1)
+
+    def test_recalculate_scores_returns_202(self):
+        response = self.client.post(
+            "/api/recalculate-scores?full=true", **auth_headers(self.user)
+        )
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.json()["id"])
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(
+            job.params,
+            {"full": True, "parallel": False, "staged": False, "in_database": False},
+        )
+
+        call_command("run_hermes_worker", "--once", stdout=StringIO())
+
+        response = self.client.get(f"/api/jobs/{job.pk}", **auth_headers(self.user))
+        self.assertEqual(response.json()["status"], Job.SUCCEEDED)
+        self.assertEqual(response.json()["progress"], 1)
+        self.assertEqual(response.json()["result"], {"updated": 1})
+        self.assertNotEqual(TestResult.objects.get().ladder_score, 0)
+
+    def test_parallel_recalculations_cant_be_staged(self):
+        for flag in ["staged", "in_database"]:
+            response = self.client.post(
+                f"/api/recalculate-scores?parallel=true&{flag}=true",
+                **auth_headers(self.user),
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first = enqueue_job(Job.RECALCULATE_SCORES, self.user)
+        second = enqueue_job(Job.RECALCULATE_SCORES, self.user)
+        self.assertEqual(claim_next_job(), first)
+        self.assertEqual(claim_next_job(), second)
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.RUNNING)
+
+    def test_failed_job_records_error(self):
+        job = enqueue_job(Job.PDF_REPORT, self.user)
+        with mock.patch.dict(
+            JOB_HANDLERS, {Job.PDF_REPORT: mock.Mock(side_effect=ValueError)}
+        ):
+            run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("ValueError", job.error)
+
+    def test_params_are_validated(self):
+        self.user.groups.add(Group.objects.create(name="Adjudicators"))
+        for kind, params in [
+            (Job.RECALCULATE_SCORES, {"full": True, "rm": "-rf"}),
+            (Job.RECALCULATE_SCORES, {"staged": [1]}),
+            (Job.RECALCULATE_SCORES, {"parallel": True, "in_database": True}),
+            (Job.PDF_REPORT, {"person_id": "not a number"}),
+        ]:
+            response = self.client.post(
+                "/api/jobs",
+                {"kind": kind, "params": params},
+                content_type="application/json",
+                **auth_headers(self.user),
+            )
+            self.assertEqual(response.status_code, 422, params)
+        self.assertFalse(Job.objects.exists())
+
+        job = enqueue_job(Job.PDF_REPORT, self.user)
+        self.assertEqual(job.params, {"person_id": None})
+
+    def test_pdf_reports_need_an_adjudicator(self):
+        for path, data in [
+            ("/api/reports/pdf", None),
+            ("/api/jobs", {"kind": Job.PDF_REPORT, "params": {}}),
+        ]:
+            response = self.client.post(
+                path, data, content_type="application/json", **auth_headers(self.user)
+            )
+            self.assertEqual(response.status_code, 403)
+        self.user.groups.add(Group.objects.create(name="Adjudicators"))
+        response = self.client.post("/api/reports/pdf", **auth_headers(self.user))
+        self.assertEqual(response.status_code, 202)
+
+    def test_stale_jobs_are_claimed_again(self):
+        job = enqueue_job(Job.RECALCULATE_SCORES, self.user)
+        self.assertEqual(claim_next_job(), job)
+        # The worker is alive
+        self.assertIsNone(claim_next_job())
+
+        for attempt in range(2, MAX_ATTEMPTS + 1):
+            Job.objects.update(heartbeat_at=timezone.now() - STALE_AFTER)
+            self.assertEqual(claim_next_job(), job)
+            self.assertEqual(Job.objects.get().attempts, attempt)
+
+        Job.objects.update(heartbeat_at=timezone.now() - STALE_AFTER)
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, "The worker running the job stopped responding")
+
+    def test_jobs_of_other_users_are_hidden(self):
+        job = enqueue_job(Job.RECALCULATE_SCORES, self.user)
+        other = User.objects.create_user("other")
+        response = self.client.get(f"/api/jobs/{job.pk}", **auth_headers(other))
+        self.assertEqual(response.status_code, 403)
+
+    def test_pdf_report_output(self):
+        self.user.groups.add(Group.objects.create(name="Adjudicators"))
+        response = self.client.post("/api/reports/pdf", **auth_headers(self.user))
+        self.assertEqual(response.status_code, 202)
+        call_command("run_hermes_worker", "--once", stdout=StringIO())
+
+        response = self.client.get(
+            f"/api/jobs/{response.json()['id']}/output", **auth_headers(self.user)
+        )
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
@@ -130,24 +130,3 @@ def download_pdf_report(request, person_id):
     response.write(buffer.getvalue())
 
     return response
-
-
-@login_required
-@user_passes_test(is_adjudicator)
-def download_all_pdf_reports(request):
-    # Get all test results ordered by surname
-    test_results = TestResult.objects.all().order_by("person__surname")
-
-    # Create a BytesIO buffer to receive PDF data
-    buffer = BytesIO()
-
-    # Generate the PDF with all results, passing the current user as adjudicator
-    generate_test_results_pdf(list(test_results), buffer, request.user)
-
-    # Create the HTTP response with PDF mime type
-    buffer.seek(0)
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = 'attachment; filename="all_test_results.pdf"'
-    response.write(buffer.getvalue())
-
-    return response